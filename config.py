@@ -43,6 +43,195 @@ MYSQL_CONN_STR = (
 )
 
 
+# ============================================
+# 连接池配置（见 etl_conn.py，整个进程共享一个Oracle会话池和一个MySQL引擎）
+# ORACLE_POOL_MAX 需不小于 BACKFILL_WORKERS，否则并行回补会排队等待会话
+# ============================================
+ORACLE_POOL_MIN = int(os.getenv('ORACLE_POOL_MIN', '1'))
+ORACLE_POOL_MAX = int(os.getenv('ORACLE_POOL_MAX', '8'))
+MYSQL_POOL_SIZE = int(os.getenv('MYSQL_POOL_SIZE', '5'))
+MYSQL_MAX_OVERFLOW = int(os.getenv('MYSQL_MAX_OVERFLOW', '10'))
+
+
+# ============================================
+# 抽取配置（Oracle流式批量抽取，见 etl_extract.py）
+# arraysize: 每次网络往返取回的行数；prefetchrows: execute时预取行数（arraysize+1可省一次往返）
+# EXTRACT_BATCH_SIZE: 每批生成的DataFrame行数，决定单批内存峰值
+# ============================================
+ORACLE_FETCH_ARRAYSIZE = int(os.getenv('ORACLE_FETCH_ARRAYSIZE', '5000'))
+ORACLE_PREFETCH_ROWS = int(os.getenv('ORACLE_PREFETCH_ROWS', '5001'))
+EXTRACT_BATCH_SIZE = int(os.getenv('EXTRACT_BATCH_SIZE', '50000'))
+
+# 抽取模式：tuple=逐行元组（默认）；arrow=列式抽取（oracledb DataFrame/Arrow接口，
+# 旧版本oracledb或未安装pyarrow时自动退回按列类型累积），ID列直接为int64、数量金额为float64
+ORACLE_FETCH_MODE = os.getenv('ORACLE_FETCH_MODE', 'tuple')
+
+# 每个Oracle连接的语句缓存大小：同一SQL文本（绑定变量）再次执行时复用已解析的游标，不再向服务端发起解析
+ORACLE_STMT_CACHE_SIZE = int(os.getenv('ORACLE_STMT_CACHE_SIZE', '40'))
+
+
+# ============================================
+# 回补配置（etl_dws_sales.backfill 并行分区模式）
+# BACKFILL_WORKERS: 并发Oracle会话上限；BACKFILL_PARTITION: 分区粒度 day / week
+# ============================================
+BACKFILL_WORKERS = int(os.getenv('BACKFILL_WORKERS', '4'))
+BACKFILL_PARTITION = os.getenv('BACKFILL_PARTITION', 'day')
+
+
+# ============================================
+# 加载配置（etl_load.bulk_insert / parallel_load）
+# LOAD_METHOD: infile=临时TSV文件 + LOAD DATA LOCAL INFILE（需MySQL服务端 local_infile=ON）
+#              to_sql=DataFrame.to_sql 参数化批量INSERT；infile 不可用时自动退回 to_sql
+# ============================================
+LOAD_METHOD = os.getenv('LOAD_METHOD', 'infile')
+# 并行写入（etl_load.parallel_load）：按分片并发写入本次运行的临时表，再单事务 INSERT ... SELECT 发布
+# LOAD_WORKERS: 并发MySQL连接数（1=单连接直接写入）；需不超过 MYSQL_POOL_SIZE + MYSQL_MAX_OVERFLOW
+# LOAD_SHARD_ROWS: 每个分片的行数
+LOAD_WORKERS = int(os.getenv('LOAD_WORKERS', '4'))
+LOAD_SHARD_ROWS = int(os.getenv('LOAD_SHARD_ROWS', '50000'))
+
+
+# ============================================
+# 分区配置（etl_partition.py，dws_sales_daily / dws_inventory_daily 按 date_id 按天 RANGE 分区）
+# PARTITION_AHEAD_DAYS: 提前创建的未来日分区天数
+# ============================================
+PARTITION_AHEAD_DAYS = int(os.getenv('PARTITION_AHEAD_DAYS', '7'))
+
+
+# ============================================
+# 抽取暂存配置（etl_stage.py，Oracle抽取结果按日期分区落地为本地Parquet）
+# 重跑/回补时在有效期内直接读取暂存，不再访问ERP；--refresh 强制重新抽取
+# 只暂存截止到昨天及以前的销售日期范围，增量/快照类抽取总是访问Oracle
+# STAGE_MAX_AGE_HOURS: 暂存可复用的最长时间；STAGE_RETENTION_DAYS: 暂存保留天数
+# ============================================
+STAGE_ENABLED = os.getenv('STAGE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+STAGE_DIR = os.getenv('STAGE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'stage'))
+STAGE_MAX_AGE_HOURS = float(os.getenv('STAGE_MAX_AGE_HOURS', '6'))
+STAGE_RETENTION_DAYS = int(os.getenv('STAGE_RETENTION_DAYS', '7'))
+
+
+# ============================================
+# 维度并发抽取配置（etl_dim_async.py，oracledb asyncio）
+# DIM_EXTRACT_MODE: async=三个维度查询并发执行 / sequential=按顺序逐个执行
+#   async 时 run_etl / etl_daemon 以一个 dims 阶段调用 etl_dim_async；sequential 时为前后串联的三个阶段
+# DIM_CONCURRENCY: 同时在ERP上执行的维度查询数上限（async 模式生效）
+# ============================================
+DIM_EXTRACT_MODE = os.getenv('DIM_EXTRACT_MODE', 'async')
+DIM_CONCURRENCY = int(os.getenv('DIM_CONCURRENCY', '3'))
+
+
+# ============================================
+# 维度增量配置（etl_dim_product 按 MODIFIEDDATE 高水位增量，状态存于 etl_watermark）
+# DIM_PRODUCT_LOAD_MODE: auto=按周期自动选择 / incremental / full
+# DIM_PRODUCT_FULL_RECONCILE_DAYS: 距上次全量对账超过该天数时自动走全量
+# WATERMARK_OVERLAP_MINUTES: 增量查询向前重叠的分钟数，防止提交延迟导致漏数（upsert幂等）
+# ============================================
+DIM_PRODUCT_LOAD_MODE = os.getenv('DIM_PRODUCT_LOAD_MODE', 'auto')
+DIM_PRODUCT_FULL_RECONCILE_DAYS = int(os.getenv('DIM_PRODUCT_FULL_RECONCILE_DAYS', '7'))
+WATERMARK_OVERLAP_MINUTES = int(os.getenv('WATERMARK_OVERLAP_MINUTES', '10'))
+
+# 全量刷新先写入影子表 <表>__staging，校验行数后 RENAME TABLE 原子切换；
+# 影子表行数低于线上表的该比例时视为抽取异常，放弃切换
+DIM_PUBLISH_MIN_RATIO = float(os.getenv('DIM_PUBLISH_MIN_RATIO', '0.9'))
+
+
+# ============================================
+# ODS配置（etl_ods_retail 按修改时间/ID高水位增量落地 M_RETAIL/M_RETAILITEM）
+# ODS_RETAIL_INITIAL_DAYS: 首次落地（无高水位）时按单据日期回溯的天数
+# DWS_SALES_SOURCE: dws_sales_daily 日常同步的数据来源，ods=在MySQL内由ODS重建 / oracle=Oracle端聚合
+# DWS_SALES_LOAD_MODE: dws_sales_daily 日常同步的写入方式
+#   merge=按 日期+店仓+SKU 唯一键比对行哈希，只 upsert 变更行并显式删除源端已消失的行
+#   replace=按日期范围先删后插（分区表为交换分区）；历史回补始终为 replace
+# ============================================
+ODS_RETAIL_INITIAL_DAYS = int(os.getenv('ODS_RETAIL_INITIAL_DAYS', '90'))
+DWS_SALES_SOURCE = os.getenv('DWS_SALES_SOURCE', 'ods')
+DWS_SALES_LOAD_MODE = os.getenv('DWS_SALES_LOAD_MODE', 'merge')
+
+
+# ============================================
+# 日内微批配置（etl_sales_micro：沿用ODS高水位，只重算受影响的 日期+店仓+SKU）
+# SALES_MICRO_INTERVAL_SECONDS: 循环模式下两次微批的间隔秒数
+# ODS_LOCK_TIMEOUT_SECONDS: 零售单ODS落地等待微批释放命名锁的秒数（微批拿不到锁时直接跳过本轮）
+# ============================================
+SALES_MICRO_INTERVAL_SECONDS = int(os.getenv('SALES_MICRO_INTERVAL_SECONDS', '300'))
+ODS_LOCK_TIMEOUT_SECONDS = int(os.getenv('ODS_LOCK_TIMEOUT_SECONDS', '600'))
+
+
+# ============================================
+# 库存存储配置（etl_inventory_delta：当前库存表 + 变更日志）
+# INVENTORY_STORAGE_MODE: snapshot=只写每日全量快照 dws_inventory_daily
+#                         both=快照 + 当前库存/变更日志
+#                         delta=快照 + 当前库存/变更日志，且只保留最近 INVENTORY_SNAPSHOT_KEEP_DAYS 天快照，
+#                               更早日期由变更日志还原（inventory_as_of）
+# ============================================
+INVENTORY_STORAGE_MODE = os.getenv('INVENTORY_STORAGE_MODE', 'both')
+INVENTORY_SNAPSHOT_KEEP_DAYS = int(os.getenv('INVENTORY_SNAPSHOT_KEEP_DAYS', '14'))
+
+
+# ============================================
+# 滚动销售汇总配置（etl_sales_rolling：SKU近7/30天销售，供 ads_inventory_health 关联）
+# ROLLING_ENABLED: ADS 是否关联滚动汇总表（false=每次扫描近30天 dws_sales_daily）
+# ROLLING_REFRESH_DAYS: 每次增量维护时重新汇总的最近天数（覆盖日内重复同步的昨天/今天）
+# ROLLING_FULL_RECOMPUTE_DAYS: 距上次全量重算超过N天时全量重算，修正回补/店仓口径变化带来的偏差
+# ============================================
+ROLLING_ENABLED = os.getenv('ROLLING_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+ROLLING_REFRESH_DAYS = int(os.getenv('ROLLING_REFRESH_DAYS', '2'))
+ROLLING_FULL_RECOMPUTE_DAYS = int(os.getenv('ROLLING_FULL_RECOMPUTE_DAYS', '7'))
+
+
+# ============================================
+# ADS计算配置
+# ADS_HEALTH_ENGINE: ads_inventory_health 计算引擎
+#   sql=MySQL内 INSERT ... SELECT / pandas=取数后在ETL进程内向量化计算再批量写入（etl_ads_health_pandas）
+# ============================================
+ADS_HEALTH_ENGINE = os.getenv('ADS_HEALTH_ENGINE', 'sql')
+# ADS_REBUILD_WORKERS: 历史重算（etl_ads_health.rebuild_health）的并发进程数，即同时占用的MySQL连接数
+ADS_REBUILD_WORKERS = int(os.getenv('ADS_REBUILD_WORKERS', '3'))
+
+
+# ============================================
+# 销售覆盖校验配置（etl_coverage：run_etl 每次只回补缺失/异常日期）
+# COVERAGE_DAYS: 校验最近N天（截至昨天）
+# COVERAGE_BASELINE_DAYS: 基线取前N天中有数据日期的行数中位数
+# COVERAGE_MIN_RATIO: 当天行数低于 基线 × 该比例 视为不完整，重新回补
+# ============================================
+COVERAGE_DAYS = int(os.getenv('COVERAGE_DAYS', '30'))
+COVERAGE_BASELINE_DAYS = int(os.getenv('COVERAGE_BASELINE_DAYS', '14'))
+COVERAGE_MIN_RATIO = float(os.getenv('COVERAGE_MIN_RATIO', '0.3'))
+# COVERAGE_SETTLE_DAYS: 行数偏低的日期在其后N天以上回补、且回补后行数未变时，视为源端确实如此不再回补
+#                       （缺失日期始终回补）
+# COVERAGE_REPAIR_EXPIRE_DAYS: 回补记录有效天数，过期后重新按缺口校验
+COVERAGE_SETTLE_DAYS = int(os.getenv('COVERAGE_SETTLE_DAYS', '3'))
+COVERAGE_REPAIR_EXPIRE_DAYS = int(os.getenv('COVERAGE_REPAIR_EXPIRE_DAYS', '7'))
+
+# ============================================
+# 调度配置
+# ETL_MAX_PARALLEL: run_etl 依赖图中同时执行的阶段数上限（1 = 按依赖顺序逐个执行）
+#   各阶段共用Oracle会话池与MySQL连接池，调大时需同步调整 ORACLE_POOL_MAX / MYSQL_POOL_SIZE
+# ============================================
+ETL_MAX_PARALLEL = int(os.getenv('ETL_MAX_PARALLEL', '3'))
+
+
+# ============================================
+# 常驻调度配置（etl_daemon：进程内保持Oracle/MySQL连接池，按任务计划执行）
+# DAEMON_SCHEDULE: 任务计划，分号分隔的 任务=类型@参数，未列出的任务不执行
+#   every@秒数=固定间隔（启动后立即执行一次）/ daily@HH:MM=每天定时 / after@任务=上游任务成功后执行
+#   可用任务：nightly（run_etl 全流程，含维度）、sales_micro、inventory、ads_health、dims、coverage
+# DAEMON_MAX_CONCURRENT: 同时执行的任务数上限（同一任务不会重叠执行）
+# DAEMON_STATUS_FILE: 状态文件（JSON，每次任务状态变化时重写）
+# DAEMON_STATUS_PORT: HTTP状态端口（GET /status 返回同一JSON），0=不开启
+# DAEMON_STATUS_HOST: HTTP状态接口监听地址，默认只监听本机；需远程查看时设为 0.0.0.0 或内网地址
+# ============================================
+DAEMON_SCHEDULE = os.getenv(
+    'DAEMON_SCHEDULE',
+    'nightly=daily@03:00;sales_micro=every@600;inventory=every@3600;ads_health=after@inventory'
+)
+DAEMON_MAX_CONCURRENT = int(os.getenv('DAEMON_MAX_CONCURRENT', '3'))
+DAEMON_STATUS_FILE = os.getenv('DAEMON_STATUS_FILE', os.path.join('logs', 'etl_daemon_status.json'))
+DAEMON_STATUS_PORT = int(os.getenv('DAEMON_STATUS_PORT', '0'))
+DAEMON_STATUS_HOST = os.getenv('DAEMON_STATUS_HOST', '127.0.0.1')
+
+
 # ============================================
 # 业务配置（不要修改，除非业务规则变了）
 # ============================================
@@ -10,14 +10,25 @@
 4. 新增销售加速度：sales_velocity = 7天日均 / 30天日均
 
 策略：每日重新计算
+近7/30天销售默认关联滚动汇总表 dws_sales_rolling（etl_sales_rolling 增量维护），不再每次扫描30天明细
+计算引擎（config.ADS_HEALTH_ENGINE）：sql=本模块的 INSERT ... SELECT；pandas=etl_ads_health_pandas 进程内向量化
+
+历史重算：口径调整后按快照日期重算过去的结果（每天取当天库存快照与截至当天的近7/30天销售），
+多进程并行、每天单事务发布：python etl_ads_health.py rebuild 20260101 20260131 [并发数]
 """
 
-import pandas as pd
-from sqlalchemy import create_engine, text
+from sqlalchemy import text
 from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import nullcontext
+import multiprocessing
 import logging
+import sys
 
-from config import MYSQL_CONN_STR
+from config import ROLLING_ENABLED, ADS_HEALTH_ENGINE, ADS_REBUILD_WORKERS
+from etl_conn import get_mysql_engine
+from etl_runlog import count_rows
+import etl_sales_rolling
 
 # 配置日志
 logging.basicConfig(
@@ -63,35 +74,168 @@ def ensure_table_columns(engine):
                 logger.warning(f"添加字段 {col_name} 时出错（可能已存在）: {e}")
 
 
-def calculate_inventory_health():
-    """计算库存健康度（优化版）"""
-    
-    logger.info("连接MySQL数据库...")
-    engine = create_engine(MYSQL_CONN_STR)
+# 库存汇总（总仓+云仓，含采购欠数）- 作为主表
+INVENTORY_SQL = """(
+        SELECT
+            i.product_id,
+            i.m_productalias_id AS sku_id,
+            SUM(i.qty) AS total_qty,
+            SUM(CASE WHEN s.store_code = '001' THEN i.qty ELSE 0 END) AS warehouse_qty,
+            SUM(CASE WHEN s.is_cloud_store = 'Y' THEN i.qty ELSE 0 END) AS cloud_qty,
+            SUM(COALESCE(i.qtypurchaserem, 0)) AS purchase_rem_qty
+        FROM dws_inventory_daily i
+        LEFT JOIN dim_store s ON i.store_id = s.store_id
+        WHERE i.date_id = :today
+            AND i.m_productalias_id IS NOT NULL
+            AND (s.store_code = '001' OR s.is_cloud_store = 'Y')
+        GROUP BY i.product_id, i.m_productalias_id
+    )"""
+
+# 销售汇总（直接扫描近30天明细，含退货数量）；ROLLING_ENABLED 关闭或滚动汇总维护失败时使用
+SALES_30D_SQL = """(
+        SELECT
+            ds.product_id,
+            ds.m_productalias_id AS sku_id,
+            -- 销售数量（正单）
+            SUM(ds.sales_qty) AS sales_qty_30d,
+            -- 近30天销售金额（使用 dws_sales_daily.sales_amount 汇总，避免 qty*price_list 估算误差）
+            SUM(ds.sales_amount) AS sales_amt_30d,
+            SUM(CASE WHEN ds.date_id >= :date_7_ago THEN ds.sales_qty ELSE 0 END) AS sales_qty_7d,
+            -- ⭐新增：退货数量/退货金额
+            SUM(ds.return_qty) AS return_qty_30d,
+            SUM(ds.return_amount) AS return_amount_30d
+        FROM dws_sales_daily ds
+        LEFT JOIN dim_store s ON ds.store_id = s.store_id
+        WHERE ds.date_id >= :date_30_ago AND ds.date_id <= :today
+            -- ⭐按口径：电商+云仓门店（使用dim_store口径，避免dws字段历史为空）
+            AND (s.store_code LIKE 'DS%%' OR s.is_cloud_store = 'Y')
+            AND ds.m_productalias_id IS NOT NULL
+        GROUP BY ds.product_id, ds.m_productalias_id
+    )"""
+
+
+def window_params(snapshot_date):
+    """快照日期及其近7/30天窗口起点（绑定变量）"""
+    base = datetime.strptime(str(snapshot_date), '%Y%m%d')
+    return {
+        "today": snapshot_date,
+        "date_7_ago": int((base - timedelta(days=7)).strftime('%Y%m%d')),
+        "date_30_ago": int((base - timedelta(days=30)).strftime('%Y%m%d')),
+    }
+
+
+def sales_source(engine, today):
+    """
+    ADS关联的近7/30天销售来源：默认先增量维护滚动汇总表并直接关联（口径与 SALES_30D_SQL 一致）
+    维护失败或重算历史日期（滚动汇总只对应今天）时扫描明细
+    """
+    if not ROLLING_ENABLED or today != int(datetime.now().strftime('%Y%m%d')):
+        return SALES_30D_SQL
+    try:
+        etl_sales_rolling.refresh(engine, today)
+        return "dws_sales_rolling"
+    except Exception as e:
+        logger.warning(f"滚动销售汇总维护失败，改为扫描近30天明细: {e}")
+        return SALES_30D_SQL
+
+
+# 写入 ads_inventory_health 的指标列（GRADE_SQL 内层计算的列，顺序与内层SELECT一致）
+HEALTH_COLS = [
+    'snapshot_date', 'product_id', 'sku_id', 'sku_barcode', 'color', 'size', 'product_code', 'product_name',
+    'category_id', 'category_name', 'property_id', 'property_name', 'series_id', 'series_name', 'price_list',
+    'total_qty', 'warehouse_qty', 'cloud_qty', 'purchase_rem_qty', 'sales_qty_30d', 'sales_amt_30d',
+    'sales_qty_7d', 'return_qty_30d', 'return_amount_30d', 'daily_avg_sales', 'daily_avg_sales_7d',
+    'sales_velocity', 'turnover_days', 'inventory_status', 'suggest_qty', 'status_priority',
+    'etl_time', 'created_at',
+]
+
+# 单条 INSERT ... SELECT：内层 {base} 计算各指标，外层窗口函数计算排名/占比/SABC分级，同时得出销售趋势
+# SABC分级：按近30天销售额降序、sku_id 升序累计，S<30%, A<=70%, B<=90%，其余及无销售额为C
+GRADE_SQL = """
+    INSERT INTO ads_inventory_health
+        ({cols}, sku_grade, sales_rank, sales_ratio, cumulative_ratio, sales_trend)
+    SELECT
+        {g_cols},
+        CASE
+            WHEN g.total_sales = 0 OR g.sales_amt_30d = 0 THEN 'C'
+            WHEN (g.cum_sales - g.sales_amt_30d) / g.total_sales < 0.30 THEN 'S'
+            WHEN g.cum_sales / g.total_sales <= 0.70 THEN 'A'
+            WHEN g.cum_sales / g.total_sales <= 0.90 THEN 'B'
+            ELSE 'C'
+        END AS sku_grade,
+        g.sales_rank,
+        ROUND(g.sales_amt_30d / NULLIF(g.total_sales, 0) * 100, 2) AS sales_ratio,
+        ROUND(g.cum_sales / NULLIF(g.total_sales, 0) * 100, 2) AS cumulative_ratio,
+        -- 销售趋势（基于 sales_velocity）
+        CASE
+            WHEN g.sales_qty_30d = 0 THEN '无销售'
+            WHEN g.sales_velocity >= 1.3 THEN '快速上升'
+            WHEN g.sales_velocity >= 1.0 THEN '稳定'
+            WHEN g.sales_velocity >= 0.7 THEN '降温'
+            ELSE '快速下滑'
+        END AS sales_trend
+    FROM (
+        SELECT
+            h.*,
+            SUM(h.sales_amt_30d) OVER () AS total_sales,
+            SUM(h.sales_amt_30d) OVER (ORDER BY h.sales_amt_30d DESC, h.sku_id
+                                       ROWS BETWEEN UNBOUNDED PRECEDING AND CURRENT ROW) AS cum_sales,
+            ROW_NUMBER() OVER (ORDER BY h.sales_amt_30d DESC, h.sku_id) AS sales_rank
+        FROM ({base}) h
+    ) g
+    """
+
+# 当天结果按 库存状态×分级 分组汇总（一次扫描，供分级统计与汇总打印）
+SUMMARY_SQL = """
+    SELECT
+        inventory_status,
+        sku_grade,
+        COUNT(*) AS sku_count,
+        SUM(total_qty) AS total_qty,
+        SUM(sales_qty_30d) AS sales_qty,
+        COUNT(CASE WHEN purchase_rem_qty > 0 THEN 1 END) AS sku_with_rem,
+        SUM(purchase_rem_qty) AS total_rem_qty,
+        SUM(CASE WHEN suggest_qty > 0 THEN suggest_qty ELSE 0 END) AS total_positive_suggest,
+        SUM(CASE WHEN suggest_qty < 0 THEN suggest_qty ELSE 0 END) AS total_negative_suggest,
+        SUM(suggest_qty) AS total_suggest_qty,
+        COUNT(CASE WHEN suggest_qty < 0 THEN 1 END) AS sku_with_negative
+    FROM ads_inventory_health
+    WHERE snapshot_date = :today
+    GROUP BY inventory_status, sku_grade
+    """
+
+
+def calculate_inventory_health(engine=None, snapshot_date=None, conn=None, summary=False):
+    """计算库存健康度（优化版）
+
+    指标、SABC分级、排名/占比与销售趋势由一条 INSERT ... SELECT 写入（GRADE_SQL），不再回表 UPDATE
+    engine: MySQL引擎，默认进程内共享引擎
+    snapshot_date: 快照日期，默认今天；历史日期按当天库存快照与截至当天的销售窗口重算
+    conn: 调用方事务内连接（历史重算时在调用方事务内发布）；不传则删除与写入单独成一个事务
+    summary: 是否打印汇总（取自写入后的一次分组统计）
+    返回写入行数
+    """
     
-    # 确保表有新字段
-    ensure_table_columns(engine)
+    engine = engine or get_mysql_engine()
     
-    today = int(datetime.now().strftime('%Y%m%d'))
-    date_30_ago = int((datetime.now() - timedelta(days=30)).strftime('%Y%m%d'))
-    date_7_ago = int((datetime.now() - timedelta(days=7)).strftime('%Y%m%d'))
+    # 确保表有新字段（历史重算由调用方预先执行，避免在事务内做DDL）
+    if conn is None:
+        ensure_table_columns(engine)
     
-    # 优化后的大SQL：一次性计算所有指标
-    sql = f"""
-     INSERT INTO ads_inventory_health 
-     (snapshot_date, product_id, sku_id, sku_barcode, color, size, product_code, product_name, category_id, category_name,
-      property_id, property_name, series_id, series_name, price_list, total_qty, warehouse_qty, cloud_qty,
-          purchase_rem_qty, sales_qty_30d, sales_amt_30d, sales_qty_7d, return_qty_30d,
-      return_amount_30d, daily_avg_sales, daily_avg_sales_7d, sales_velocity,
-      turnover_days, inventory_status, sku_grade, suggest_qty, status_priority, etl_time, created_at)
+    today = snapshot_date or int(datetime.now().strftime('%Y%m%d'))
     
+    # 近7/30天销售来源（先维护滚动汇总表）
+    sales = sales_source(engine, today)
+
+    # 优化后的大SQL：一次性计算所有指标（内层），外层窗口函数在同一条语句内完成SABC分级与销售趋势
+    base_sql = f"""
     SELECT
-        {today} AS snapshot_date,
+        :today AS snapshot_date,
         p.product_id,
         inv.sku_id,
         sku.sku_barcode,
-        sku.sku_color,
-        sku.sku_size,
+        sku.sku_color AS color,
+        sku.sku_size AS size,
         p.product_code,
         p.product_name,
         p.category_id,
@@ -149,9 +293,6 @@ def calculate_inventory_health():
             ELSE '库存过高'
         END AS inventory_status,
         
-        -- SKU分级（先设为C，后续update_sku_grade函数会更新）
-        'C' AS sku_grade,
-        
         -- ⭐优化：建议补货数量 = (90天目标 - 当前周转天数) × 日均销量 - 退货 - 采购欠数
         -- ⭐ 修改：移除GREATEST(0,...)，允许负数表示库存过剩（与Oracle逻辑一致）
         CASE
@@ -181,224 +322,110 @@ def calculate_inventory_health():
     -- ⚠️ 修改：改为以库存表为主表（与Oracle SQL逻辑一致）
     -- Oracle SQL: FROM stock st LEFT JOIN sales sa
     -- MySQL ETL: FROM inv_base LEFT JOIN dim_product LEFT JOIN sales
-    FROM (
-        -- 库存汇总（总仓+云仓，含采购欠数）- 作为主表
-        SELECT
-            i.product_id,
-            i.m_productalias_id AS sku_id,
-            SUM(i.qty) AS total_qty,
-            SUM(CASE WHEN s.store_code = '001' THEN i.qty ELSE 0 END) AS warehouse_qty,
-            SUM(CASE WHEN s.is_cloud_store = 'Y' THEN i.qty ELSE 0 END) AS cloud_qty,
-            SUM(COALESCE(i.qtypurchaserem, 0)) AS purchase_rem_qty
-        FROM dws_inventory_daily i
-        LEFT JOIN dim_store s ON i.store_id = s.store_id
-        WHERE i.date_id = {today}
-            AND i.m_productalias_id IS NOT NULL
-            AND (s.store_code = '001' OR s.is_cloud_store = 'Y')
-        GROUP BY i.product_id, i.m_productalias_id
-    ) inv
+    FROM {INVENTORY_SQL} inv
     
     -- 关联商品维度
     LEFT JOIN dim_product p ON inv.product_id = p.product_id
     LEFT JOIN dim_sku sku ON inv.sku_id = sku.sku_id
     
-    -- 销售汇总（含退货数量）
-    LEFT JOIN (
-        SELECT
-            ds.product_id,
-            ds.m_productalias_id AS sku_id,
-            -- 销售数量（正单）
-            SUM(ds.sales_qty) AS sales_qty_30d,
-            -- 近30天销售金额（使用 dws_sales_daily.sales_amount 汇总，避免 qty*price_list 估算误差）
-            SUM(ds.sales_amount) AS sales_amt_30d,
-            SUM(CASE WHEN ds.date_id >= {date_7_ago} THEN ds.sales_qty ELSE 0 END) AS sales_qty_7d,
-            -- ⭐新增：退货数量/退货金额
-            SUM(ds.return_qty) AS return_qty_30d,
-            SUM(ds.return_amount) AS return_amount_30d
-        FROM dws_sales_daily ds
-        LEFT JOIN dim_store s ON ds.store_id = s.store_id
-        WHERE ds.date_id >= {date_30_ago}
-            -- ⭐按口径：电商+云仓门店（使用dim_store口径，避免dws字段历史为空）
-            AND (s.store_code LIKE 'DS%%' OR s.is_cloud_store = 'Y')
-            AND ds.m_productalias_id IS NOT NULL
-        GROUP BY ds.product_id, ds.m_productalias_id
-    ) sales ON inv.product_id = sales.product_id AND inv.sku_id = sales.sku_id
+    -- 销售汇总（含退货数量）：滚动汇总表或近30天明细
+    LEFT JOIN {sales} sales ON inv.product_id = sales.product_id AND inv.sku_id = sales.sku_id
     
     WHERE p.is_main_product = 'Y'
         -- ⚠️ 注意：现在以库存表为主，自动只包含dws_inventory_daily中有记录的商品
         --         这与Oracle SQL逻辑完全一致（FROM stock st LEFT JOIN sales sa）
     """
+    sql = GRADE_SQL.format(
+        cols=', '.join(HEALTH_COLS),
+        g_cols=', '.join(f"g.{c}" for c in HEALTH_COLS),
+        base=base_sql
+    )
     
-    # 先清空当天数据
-    logger.info(f"清空当天数据（{today}）...")
-    with engine.begin() as conn:
-        conn.execute(text(f"DELETE FROM ads_inventory_health WHERE snapshot_date = {today}"))
-    
-    # 执行计算
-    logger.info("执行库存健康度计算...")
-    with engine.connect() as conn:
-        conn.execute(text(sql))
-        conn.commit()
-    
-    # 查询写入记录数
-    with engine.connect() as conn:
-        result = conn.execute(text(f"SELECT COUNT(*) FROM ads_inventory_health WHERE snapshot_date = {today}"))
-        count = result.fetchone()[0]
+    # 先清空当天数据再计算写入（同一事务，读者不会看到空的当天结果）
+    with (nullcontext(conn) if conn is not None else engine.begin()) as tx:
+        logger.info(f"清空当天数据（{today}）...")
+        tx.execute(text("DELETE FROM ads_inventory_health WHERE snapshot_date = :today"), {"today": today})
+
+        logger.info("执行库存健康度计算（含SABC分级与销售趋势）...")
+        count = tx.execute(text(sql), window_params(today)).rowcount
+
+        # 分级统计与汇总：一次分组扫描当天结果
+        rows = tx.execute(text(SUMMARY_SQL), {"today": today}).fetchall() if count else []
+    count_rows(written=count)
     
     logger.info(f"计算完成，共 {count} 条记录")
-    engine.dispose()
+    grades = {}
+    for row in rows:
+        grades[row[1]] = grades.get(row[1], 0) + row[2]
+    logger.info(f"分级完成：S类{grades.get('S',0)}个，A类{grades.get('A',0)}个，B类{grades.get('B',0)}个，C类{grades.get('C',0)}个")
+    if summary and rows:
+        _print_summary(rows, today)
     
     return count
 
 
-def update_sku_grade():
-    """
-    更新SKU分级（SABC分类）
+def print_summary(engine=None, snapshot_date=None):
+    """打印今日（或指定快照日期）汇总统计"""
     
-    分级标准：
-    - S级：累计销售额占比 < 30%（爆款）
-    - A级：累计销售额占比 30% - 70%（核心款）
-    - B级：累计销售额占比 70% - 90%（常规款）
-    - C级：累计销售额占比 >= 90% + 无销售（长尾/滞销）
-    """
-    
-    logger.info("开始计算SABC分级（S<30%, A<70%, B<90%, C>=90%）...")
-    engine = create_engine(MYSQL_CONN_STR)
-    today = int(datetime.now().strftime('%Y%m%d'))
-    
-    # 使用单条 MySQL SQL（窗口函数）批量计算 sales_rank / sales_ratio / cumulative_ratio / sku_grade
-    logger.info("使用 MySQL 窗口函数批量计算分级与排名...")
-    sql_update = f"""
-    UPDATE ads_inventory_health a
-    JOIN (
-        SELECT sku_id, sales_amt_30d, total_sales, cum_sales, sales_rank FROM (
-            SELECT
-                sku_id,
-                COALESCE(sales_amt_30d, 0) AS sales_amt_30d,
-                SUM(COALESCE(sales_amt_30d,0)) OVER () AS total_sales,
-                SUM(COALESCE(sales_amt_30d,0)) OVER (ORDER BY COALESCE(sales_amt_30d,0) DESC, sku_id ROWS BETWEEN UNBOUNDED PRECEDING AND CURRENT ROW) AS cum_sales,
-                ROW_NUMBER() OVER (ORDER BY COALESCE(sales_amt_30d,0) DESC, sku_id) AS sales_rank
-            FROM ads_inventory_health
-            WHERE snapshot_date = {today}
-        ) t
-    ) r ON a.sku_id = r.sku_id AND a.snapshot_date = {today}
-    SET
-        a.sales_rank = r.sales_rank,
-        a.sales_ratio = ROUND(r.sales_amt_30d / NULLIF(r.total_sales, 0) * 100, 2),
-        a.cumulative_ratio = ROUND(r.cum_sales / NULLIF(r.total_sales, 0) * 100, 2),
-        a.sku_grade = CASE
-            WHEN r.total_sales = 0 OR r.sales_amt_30d = 0 THEN 'C'
-            WHEN (r.cum_sales - r.sales_amt_30d) / r.total_sales < 0.30 THEN 'S'
-            WHEN r.cum_sales / r.total_sales <= 0.70 THEN 'A'
-            WHEN r.cum_sales / r.total_sales <= 0.90 THEN 'B'
-            ELSE 'C' END
-    """
-
-    with engine.connect() as conn:
-        conn.execute(text(sql_update))
-        conn.commit()
-
-    # 计算销售趋势文本（基于 sales_velocity）
-    sql_trend = f"""
-    UPDATE ads_inventory_health
-    SET sales_trend = CASE
-        WHEN sales_qty_30d = 0 THEN '无销售'
-        WHEN sales_velocity >= 1.3 THEN '快速上升'
-        WHEN sales_velocity >= 1.0 THEN '稳定'
-        WHEN sales_velocity >= 0.7 THEN '降温'
-        ELSE '快速下滑' END
-    WHERE snapshot_date = {today}
-    """
+    logger.info("生成今日汇总...")
+    engine = engine or get_mysql_engine()
+    today = snapshot_date or int(datetime.now().strftime('%Y%m%d'))
     with engine.connect() as conn:
-        conn.execute(text(sql_trend))
-        conn.commit()
+        rows = conn.execute(text(SUMMARY_SQL), {"today": today}).fetchall()
+    _print_summary(rows, today)
 
-    # 统计分级结果
-    sql_counts = f"SELECT sku_grade, COUNT(*) FROM ads_inventory_health WHERE snapshot_date = {today} GROUP BY sku_grade"
-    with engine.connect() as conn:
-        rows = conn.execute(text(sql_counts)).fetchall()
-    counts = {r[0]: r[1] for r in rows}
-    logger.info(f"分级完成：S类{counts.get('S',0)}个，A类{counts.get('A',0)}个，B类{counts.get('B',0)}个，C类{counts.get('C',0)}个")
-    engine.dispose()
 
+def _print_summary(rows, today):
+    """由 SUMMARY_SQL 的分组结果打印汇总：库存状态分布、SABC分级分布、采购欠数 & 建议补货"""
+    status_order = ['紧急缺货', '需补货', '正常', '库存过高', '滞销', '停售']
+    by_status = {}
+    by_grade = {}
+    totals = [0] * 6
+    for row in rows:
+        status, grade, sku_count, total_qty, sales_qty = row[:5]
+        cur = by_status.get(status, (0, 0))
+        by_status[status] = (cur[0] + sku_count, cur[1] + (total_qty or 0))
+        cur = by_grade.get(grade, (0, 0))
+        by_grade[grade] = (cur[0] + sku_count, cur[1] + (sales_qty or 0))
+        totals = [t + (v or 0) for t, v in zip(totals, row[5:])]
 
-def print_summary():
-    """打印今日汇总统计"""
-    
-    logger.info("生成今日汇总...")
-    engine = create_engine(MYSQL_CONN_STR)
-    today = int(datetime.now().strftime('%Y%m%d'))
-    
-    # 库存状态分布
-    sql_status = f"""
-    SELECT inventory_status, COUNT(*) AS sku_count, SUM(total_qty) AS total_qty
-    FROM ads_inventory_health
-    WHERE snapshot_date = {today}
-    GROUP BY inventory_status
-    ORDER BY FIELD(inventory_status, '紧急缺货', '需补货', '正常', '库存过高', '滞销', '停售')
-    """
+    print("\n" + "="*60)
+    print(f"📊 库存健康度汇总 ({today})")
+    print("="*60)
     
-    # SABC分级分布
-    sql_grade = f"""
-    SELECT sku_grade, COUNT(*) AS sku_count, SUM(sales_qty_30d) AS sales_qty
-    FROM ads_inventory_health
-    WHERE snapshot_date = {today}
-    GROUP BY sku_grade
-    ORDER BY FIELD(sku_grade, 'S', 'A', 'B', 'C')
-    """
+    # 库存状态
+    print("\n【库存状态分布】")
+    print(f"{'状态':<12} {'SKU数':>8} {'库存数量':>12}")
+    print("-"*36)
+    for status in sorted(by_status, key=lambda x: status_order.index(x) if x in status_order else 0):
+        sku_count, total_qty = by_status[status]
+        print(f"{status:<12} {sku_count:>8} {total_qty:>12,}")
     
-    # 采购欠数 & 建议补货汇总（包含负数统计）
-    sql_purchase = f"""
-    SELECT 
-        COUNT(CASE WHEN purchase_rem_qty > 0 THEN 1 END) AS sku_with_rem,
-        SUM(purchase_rem_qty) AS total_rem_qty,
-        SUM(CASE WHEN suggest_qty > 0 THEN suggest_qty ELSE 0 END) AS total_positive_suggest,
-        SUM(CASE WHEN suggest_qty < 0 THEN suggest_qty ELSE 0 END) AS total_negative_suggest,
-        SUM(suggest_qty) AS total_suggest_qty,
-        COUNT(CASE WHEN suggest_qty < 0 THEN 1 END) AS sku_with_negative
-    FROM ads_inventory_health
-    WHERE snapshot_date = {today}
-    """
+    # SABC分级
+    print("\n【SABC分级分布】")
+    print(f"{'分级':<6} {'SKU数':>8} {'销售数量':>12}")
+    print("-"*30)
+    for grade in sorted(by_grade, key=lambda x: 'SABC'.find(x) if x in ('S', 'A', 'B', 'C') else -1):
+        sku_count, sales_qty = by_grade[grade]
+        print(f"{grade:<6} {sku_count:>8} {sales_qty:>12,}")
     
-    with engine.connect() as conn:
-        print("\n" + "="*60)
-        print(f"📊 库存健康度汇总 ({today})")
-        print("="*60)
-        
-        # 库存状态
-        result = conn.execute(text(sql_status))
-        print("\n【库存状态分布】")
-        print(f"{'状态':<12} {'SKU数':>8} {'库存数量':>12}")
-        print("-"*36)
-        for row in result:
-            print(f"{row[0]:<12} {row[1]:>8} {row[2]:>12,}")
-        
-        # SABC分级
-        result = conn.execute(text(sql_grade))
-        print("\n【SABC分级分布】")
-        print(f"{'分级':<6} {'SKU数':>8} {'销售数量':>12}")
-        print("-"*30)
-        for row in result:
-            print(f"{row[0]:<6} {row[1]:>8} {row[2]:>12,}")
-        
-        # 采购欠数 & 建议补货（包含负数统计）
-        result = conn.execute(text(sql_purchase))
-        row = result.fetchone()
-        print("\n【采购欠数 & 建议补货】")
-        print(f"  有采购欠数的SKU: {row[0]:,} 个")
-        print(f"  采购欠数合计: {row[1]:,} 件")
-        print(f"  需要补货合计: {row[2]:,} 件 (正数)")
-        print(f"  库存过剩合计: {row[3]:,} 件 (负数)")
-        print(f"  净建议补货: {row[4]:,} 件 (正-负)")
-        print(f"  库存过剩SKU: {row[5]:,} 个")
-        
-        print("="*60 + "\n")
+    # 采购欠数 & 建议补货（包含负数统计）
+    print("\n【采购欠数 & 建议补货】")
+    print(f"  有采购欠数的SKU: {totals[0]:,} 个")
+    print(f"  采购欠数合计: {totals[1]:,} 件")
+    print(f"  需要补货合计: {totals[2]:,} 件 (正数)")
+    print(f"  库存过剩合计: {totals[3]:,} 件 (负数)")
+    print(f"  净建议补货: {totals[4]:,} 件 (正-负)")
+    print(f"  库存过剩SKU: {totals[5]:,} 个")
     
-    engine.dispose()
+    print("="*60 + "\n")
 
 
-def run():
-    """执行计算"""
+def run(engine=None):
+    """执行计算
+
+    engine: MySQL引擎（由 run_etl 注入，不传则使用进程内共享引擎）；三个步骤共用同一连接池
+    """
     
     start_time = datetime.now()
     logger.info("="*50)
@@ -407,12 +434,13 @@ def run():
     
     try:
         # 计算库存健康度
-        count = calculate_inventory_health()
-        
-        # 更新SABC分级
-        if count > 0:
-            update_sku_grade()
-            print_summary()
+        if ADS_HEALTH_ENGINE == 'pandas':
+            # 分级、趋势与汇总在同一遍内完成，整行一次写入
+            from etl_ads_health_pandas import calculate_inventory_health as calculate_vectorized
+            calculate_vectorized(engine)
+        else:
+            # 分级与趋势在同一条 INSERT ... SELECT 内完成，汇总取自写入后的一次分组统计
+            calculate_inventory_health(engine, summary=True)
         
         end_time = datetime.now()
         duration = (end_time - start_time).seconds
@@ -428,5 +456,81 @@ def run():
         raise
 
 
+def has_snapshot(engine, snapshot_date):
+    """dws_inventory_daily 中是否还保留该日期的库存快照"""
+    with engine.connect() as conn:
+        return conn.execute(text(
+            "SELECT 1 FROM dws_inventory_daily WHERE date_id = :d LIMIT 1"
+        ), {"d": snapshot_date}).fetchone() is not None
+
+
+def _rebuild_day(snapshot_date):
+    """
+    重算一天（在子进程中执行）：删除与写入（含分级与趋势）在同一事务内提交，读者只会看到旧结果或新结果
+    当天库存快照不存在（未抽取或已按保留期清理）时不动已有结果，返回None
+    """
+    engine = get_mysql_engine()
+    if not has_snapshot(engine, snapshot_date):
+        return None
+    if ADS_HEALTH_ENGINE == 'pandas':
+        from etl_ads_health_pandas import calculate_inventory_health as calculate_vectorized
+        return calculate_vectorized(engine, summary=False, snapshot_date=snapshot_date)
+    with engine.begin() as conn:
+        return calculate_inventory_health(engine, snapshot_date, conn=conn)
+
+
+def rebuild_health(start_date, end_date, workers=None):
+    """
+    按快照日期重算 [start_date, end_date] 的库存健康度
+    每天取当天的 dws_inventory_daily 快照与截至当天的近7/30天销售（扫描明细）；
+    最多 workers 个子进程同时计算（即最多 workers 个MySQL连接），每天单独发布，失败的日期重跑即可
+    库存快照已不存在的日期跳过（保留原有结果）并在结束时列出
+    """
+    workers = workers or ADS_REBUILD_WORKERS
+    dates = []
+    cur = datetime.strptime(str(start_date), '%Y%m%d')
+    while cur <= datetime.strptime(str(end_date), '%Y%m%d'):
+        dates.append(int(cur.strftime('%Y%m%d')))
+        cur += timedelta(days=1)
+
+    start_time = datetime.now()
+    logger.info("="*50)
+    logger.info(f"开始重算库存健康度：{start_date} - {end_date}（{len(dates)} 天，并发={workers}）")
+    logger.info("="*50)
+    ensure_table_columns(get_mysql_engine())
+
+    failed = []
+    skipped = []
+    # spawn：子进程各自创建MySQL连接，不继承父进程的连接池
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+        futures = {executor.submit(_rebuild_day, d): d for d in dates}
+        for future in as_completed(futures):
+            d = futures[future]
+            try:
+                count = future.result()
+                if count is None:
+                    skipped.append(d)
+                    logger.warning(f"{d} 跳过：当天库存快照不存在或已清理，保留原有结果")
+                else:
+                    logger.info(f"{d} 重算完成，{count} 条")
+            except Exception as e:
+                failed.append(d)
+                logger.error(f"{d} 重算失败: {e}")
+
+    duration = (datetime.now() - start_time).seconds
+    if skipped:
+        logger.warning(f"{len(skipped)} 天无库存快照未重算: {sorted(skipped)}")
+    if failed:
+        logger.error(f"✗ 重算未完成：{len(failed)} 天失败")
+        raise RuntimeError(f"{len(failed)} 天重算失败: {sorted(failed)}")
+    logger.info(f"✓ 重算完成！耗时 {duration} 秒")
+
+
 if __name__ == '__main__':
-    run()
\ No newline at end of file
+    # 默认计算今天
+    # 历史重算：python etl_ads_health.py rebuild 20260101 20260131 [并发数]
+    if len(sys.argv) > 3 and sys.argv[1] == 'rebuild':
+        rebuild_health(int(sys.argv[2]), int(sys.argv[3]),
+                       workers=int(sys.argv[4]) if len(sys.argv) > 4 else None)
+    else:
+        run()
\ No newline at end of file
@@ -0,0 +1,325 @@
+# -*- coding: utf-8 -*-
+"""
+何方珠宝 - 库存健康度计算（进程内向量化引擎）
+与 etl_ads_health 的 INSERT ... SELECT 口径相同：MySQL只负责一次性取出库存汇总、商品/SKU属性与近7/30天销售，
+日均、加速度、周转天数、库存状态、建议补货、状态优先级全部在ETL进程内用 NumPy 向量化计算，
+SABC分级（排序后累计求和）与销售趋势在同一遍中算出，整行一次写入，汇总统计直接取自内存结果。
+公式集中在 compute_health() / grade_and_trend()（纯函数，输入输出均为DataFrame）。
+
+引擎选择：config.ADS_HEALTH_ENGINE = sql / pandas（etl_ads_health.run 按此分派）
+
+对账模式：SQL引擎照常写入当天结果，本引擎只计算不写入，逐行比对各指标
+    python etl_ads_health_pandas.py parity
+注：MySQL DECIMAL 除法按 div_precision_increment 保留中间精度，与浮点计算在末位可能相差，
+    数值列按各自精度设容差比对；库存状态/优先级等分类结果逐行严格比对。
+"""
+
+import logging
+import sys
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+from etl_conn import get_mysql_engine
+from etl_load import bulk_insert
+from etl_ads_health import INVENTORY_SQL, ensure_table_columns, sales_source, window_params
+
+logger = logging.getLogger(__name__)
+
+TARGET_TURNOVER_DAYS = 90
+
+# 写入 ads_inventory_health 的列（与SQL引擎的INSERT列一致）
+OUTPUT_COLS = [
+    'snapshot_date', 'product_id', 'sku_id', 'sku_barcode', 'color', 'size', 'product_code', 'product_name',
+    'category_id', 'category_name', 'property_id', 'property_name', 'series_id', 'series_name', 'price_list',
+    'total_qty', 'warehouse_qty', 'cloud_qty', 'purchase_rem_qty', 'sales_qty_30d', 'sales_amt_30d',
+    'sales_qty_7d', 'return_qty_30d', 'return_amount_30d', 'daily_avg_sales', 'daily_avg_sales_7d',
+    'sales_velocity', 'turnover_days', 'inventory_status', 'sku_grade', 'suggest_qty', 'status_priority',
+    'sales_rank', 'sales_ratio', 'cumulative_ratio', 'sales_trend', 'etl_time', 'created_at',
+]
+
+# 对账：数值列容差（按表字段精度）与严格比对的分类列
+PARITY_TOLERANCE = {
+    'total_qty': 0, 'warehouse_qty': 0, 'cloud_qty': 0, 'purchase_rem_qty': 0,
+    'sales_qty_30d': 0, 'sales_amt_30d': 0.01, 'sales_qty_7d': 0, 'return_qty_30d': 0, 'return_amount_30d': 0.01,
+    'daily_avg_sales': 0.01, 'daily_avg_sales_7d': 0.01, 'sales_velocity': 0.01,
+    'turnover_days': 0.1, 'suggest_qty': 1,
+    'sales_rank': 0, 'sales_ratio': 0.01, 'cumulative_ratio': 0.01,
+}
+PARITY_EXACT = ['inventory_status', 'status_priority', 'sku_grade', 'sales_trend']
+
+# 库存状态与优先级（1紧急缺货 → 6停售）
+STATUS_PRIORITY = {'紧急缺货': 1, '需补货': 2, '正常': 3, '库存过高': 4, '滞销': 5, '停售': 6}
+
+
+def base_sql(sales):
+    """取数SQL：库存汇总为主表，关联商品/SKU维度与近7/30天销售，只取原始字段不做指标计算"""
+    return f"""
+    SELECT
+        inv.product_id,
+        inv.sku_id,
+        sku.sku_barcode,
+        sku.sku_color AS color,
+        sku.sku_size AS size,
+        p.product_code,
+        p.product_name,
+        p.category_id,
+        p.category_name,
+        p.property_id,
+        p.property_name,
+        p.series_id,
+        p.series_name,
+        p.price_list,
+        inv.total_qty,
+        inv.warehouse_qty,
+        inv.cloud_qty,
+        inv.purchase_rem_qty,
+        sales.sales_qty_30d,
+        sales.sales_amt_30d,
+        sales.sales_qty_7d,
+        sales.return_qty_30d,
+        sales.return_amount_30d
+    FROM {INVENTORY_SQL} inv
+    LEFT JOIN dim_product p ON inv.product_id = p.product_id
+    LEFT JOIN dim_sku sku ON inv.sku_id = sku.sku_id
+    LEFT JOIN {sales} sales ON inv.product_id = sales.product_id AND inv.sku_id = sales.sku_id
+    WHERE p.is_main_product = 'Y'
+    """
+
+
+def round_half_up(values, decimals=0):
+    """与MySQL ROUND 一致的四舍五入（远离零），NumPy 的 round 为银行家舍入"""
+    factor = 10.0 ** decimals
+    return np.sign(values) * np.floor(np.abs(values) * factor + 0.5) / factor
+
+
+def compute_health(df, snapshot_date):
+    """
+    计算库存健康度指标（纯函数）
+    df: base_sql 的取数结果；返回按 OUTPUT_COLS 排列的新DataFrame（含SABC分级与销售趋势）
+    """
+    out = df.copy()
+    for col in ['total_qty', 'warehouse_qty', 'cloud_qty', 'purchase_rem_qty', 'sales_qty_30d',
+                'sales_amt_30d', 'sales_qty_7d', 'return_qty_30d', 'return_amount_30d']:
+        out[col] = pd.to_numeric(out[col]).fillna(0).astype('float64')
+
+    qty = out['total_qty'].to_numpy()
+    s30 = out['sales_qty_30d'].to_numpy()
+    s7 = out['sales_qty_7d'].to_numpy()
+    r30 = out['return_qty_30d'].to_numpy()
+    rem = out['purchase_rem_qty'].to_numpy()
+
+    no_sales = s30 == 0
+    avg30 = s30 / 30
+    avg7 = s7 / 7
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # 周转天数 = 库存 / 30天日均（无销售时为NULL，对应SQL中的 NULLIF）
+        cover = np.where(no_sales, np.nan, qty / np.where(no_sales, 1, avg30))
+        velocity = np.where(no_sales, np.nan, avg7 / np.where(no_sales, 1, avg30))
+
+    out['daily_avg_sales'] = round_half_up(avg30, 2)
+    out['daily_avg_sales_7d'] = round_half_up(avg7, 2)
+    out['sales_velocity'] = round_half_up(velocity, 2)
+    out['turnover_days'] = np.where(no_sales, 9999, round_half_up(cover, 1))
+
+    # 库存状态：与SQL的CASE顺序一致；无销售且库存为负时周转为NULL，落入ELSE（库存过高）
+    status = np.select(
+        [no_sales & (qty > 0), no_sales & (qty == 0), cover < 30, cover < 70, cover <= TARGET_TURNOVER_DAYS],
+        ['滞销', '停售', '紧急缺货', '需补货', '正常'],
+        default='库存过高'
+    )
+    out['inventory_status'] = status
+    out['status_priority'] = pd.Series(status).map(STATUS_PRIORITY).to_numpy()
+
+    # 建议补货 = (90天目标 - 当前周转天数) × 日均销量 - 退货 - 采购欠数（允许负数表示库存过剩）
+    suggest = round_half_up((TARGET_TURNOVER_DAYS - cover) * avg30 - r30 - rem, 0)
+    out['suggest_qty'] = np.where(no_sales | (cover >= TARGET_TURNOVER_DAYS), 0, suggest)
+
+    out = grade_and_trend(out)
+
+    now = datetime.now()
+    out['snapshot_date'] = snapshot_date
+    out['etl_time'] = now
+    out['created_at'] = now
+    return out[OUTPUT_COLS]
+
+
+def grade_and_trend(df):
+    """
+    SABC分级与销售趋势（与 etl_ads_health.GRADE_SQL 口径一致）
+    按近30天销售额降序、sku_id 升序排序后累计求和：
+    - S：排在该SKU之前的累计占比 < 30%；A：含该SKU累计占比 <= 70%；B：<= 90%；其余及无销售额为 C
+    销售趋势按 sales_velocity：>=1.3 快速上升，>=1.0 稳定，>=0.7 降温，其余快速下滑；无销售为"无销售"
+    """
+    out = df.copy()
+    amount = out['sales_amt_30d'].to_numpy(dtype='float64')
+    order = np.lexsort((out['sku_id'].to_numpy(), -amount))
+
+    rank = np.empty(len(out), dtype='int64')
+    rank[order] = np.arange(1, len(out) + 1)
+    cumulative = np.empty(len(out), dtype='float64')
+    cumulative[order] = np.cumsum(amount[order])
+    total = amount.sum()
+    safe_total = total if total else 1.0
+
+    out['sales_rank'] = rank
+    out['sales_ratio'] = round_half_up(amount / safe_total * 100, 2) if total else np.nan
+    out['cumulative_ratio'] = round_half_up(cumulative / safe_total * 100, 2) if total else np.nan
+    out['sku_grade'] = np.select(
+        [(total == 0) | (amount == 0),
+         (cumulative - amount) / safe_total < 0.30,
+         cumulative / safe_total <= 0.70,
+         cumulative / safe_total <= 0.90],
+        ['C', 'S', 'A', 'B'],
+        default='C'
+    )
+
+    velocity = out['sales_velocity'].to_numpy(dtype='float64')
+    out['sales_trend'] = np.select(
+        [out['sales_qty_30d'].to_numpy() == 0, velocity >= 1.3, velocity >= 1.0, velocity >= 0.7],
+        ['无销售', '快速上升', '稳定', '降温'],
+        default='快速下滑'
+    )
+    return out
+
+
+def print_summary(df, snapshot_date):
+    """由内存中的计算结果打印汇总（口径同 etl_ads_health.print_summary，不再查询数据库）"""
+    status_order = ['紧急缺货', '需补货', '正常', '库存过高', '滞销', '停售']
+    by_status = df.groupby('inventory_status').agg(sku_count=('sku_id', 'size'), total_qty=('total_qty', 'sum'))
+    by_grade = df.groupby('sku_grade').agg(sku_count=('sku_id', 'size'), sales_qty=('sales_qty_30d', 'sum'))
+    suggest = df['suggest_qty']
+
+    print("\n" + "="*60)
+    print(f"📊 库存健康度汇总 ({snapshot_date})")
+    print("="*60)
+
+    print("\n【库存状态分布】")
+    print(f"{'状态':<12} {'SKU数':>8} {'库存数量':>12}")
+    print("-"*36)
+    for status in [s for s in status_order if s in by_status.index]:
+        row = by_status.loc[status]
+        print(f"{status:<12} {int(row['sku_count']):>8} {int(row['total_qty']):>12,}")
+
+    print("\n【SABC分级分布】")
+    print(f"{'分级':<6} {'SKU数':>8} {'销售数量':>12}")
+    print("-"*30)
+    for grade in [g for g in ['S', 'A', 'B', 'C'] if g in by_grade.index]:
+        row = by_grade.loc[grade]
+        print(f"{grade:<6} {int(row['sku_count']):>8} {int(row['sales_qty']):>12,}")
+
+    print("\n【采购欠数 & 建议补货】")
+    print(f"  有采购欠数的SKU: {int((df['purchase_rem_qty'] > 0).sum()):,} 个")
+    print(f"  采购欠数合计: {int(df['purchase_rem_qty'].sum()):,} 件")
+    print(f"  需要补货合计: {int(suggest[suggest > 0].sum()):,} 件 (正数)")
+    print(f"  库存过剩合计: {int(suggest[suggest < 0].sum()):,} 件 (负数)")
+    print(f"  净建议补货: {int(suggest.sum()):,} 件 (正-负)")
+    print(f"  库存过剩SKU: {int((suggest < 0).sum()):,} 个")
+
+    print("="*60 + "\n")
+
+
+def extract_base(engine, today):
+    """一次性取出计算所需的库存、维度与销售数据（today 为快照日期）"""
+    sql = base_sql(sales_source(engine, today))
+    with engine.connect() as conn:
+        return pd.read_sql(text(sql), conn, params=window_params(today))
+
+
+def calculate_inventory_health(engine=None, summary=True, snapshot_date=None):
+    """
+    计算库存健康度（进程内向量化，含SABC分级与销售趋势），先删后插一次写入当天完整结果（单事务）
+    summary: 是否由计算结果打印汇总
+    snapshot_date: 快照日期，默认今天（历史重算时传入）
+    返回写入行数
+    """
+    engine = engine or get_mysql_engine()
+    ensure_table_columns(engine)
+    today = snapshot_date or int(datetime.now().strftime('%Y%m%d'))
+
+    logger.info("读取库存/销售汇总...")
+    base = extract_base(engine, today)
+    logger.info(f"进程内计算库存健康度（{len(base)} 个SKU）...")
+    result = compute_health(base, today)
+
+    with engine.begin() as conn:
+        conn.execute(text("DELETE FROM ads_inventory_health WHERE snapshot_date = :today"), {"today": today})
+        bulk_insert(conn, 'ads_inventory_health', result)
+
+    counts = result['sku_grade'].value_counts()
+    logger.info(f"计算完成，共 {len(result)} 条记录")
+    logger.info(f"分级完成：S类{counts.get('S', 0)}个，A类{counts.get('A', 0)}个，"
+                f"B类{counts.get('B', 0)}个，C类{counts.get('C', 0)}个")
+    if summary and not result.empty:
+        print_summary(result, today)
+    return len(result)
+
+
+def parity(engine=None):
+    """
+    对账：SQL引擎写入当天结果后，与本引擎的计算结果按 (product_id, sku_id) 逐行比对
+    返回差异明细DataFrame（列：product_id, sku_id, column, sql_value, pandas_value）
+    """
+    from etl_ads_health import calculate_inventory_health as calculate_sql
+
+    engine = engine or get_mysql_engine()
+    today = int(datetime.now().strftime('%Y%m%d'))
+
+    logger.info("SQL引擎计算...")
+    calculate_sql(engine)
+    with engine.connect() as conn:
+        expected = pd.read_sql(text(
+            "SELECT * FROM ads_inventory_health WHERE snapshot_date = :today"
+        ), conn, params={"today": today})
+
+    logger.info("向量化引擎计算（不写入）...")
+    actual = compute_health(extract_base(engine, today), today)
+
+    merged = expected.merge(actual, on=['product_id', 'sku_id'], how='outer',
+                            suffixes=('_sql', '_pandas'), indicator=True)
+    diffs = []
+    missing = merged[merged['_merge'] != 'both']
+    for _, row in missing.iterrows():
+        side = 'sql' if row['_merge'] == 'left_only' else 'pandas'
+        diffs.append({'product_id': row['product_id'], 'sku_id': row['sku_id'],
+                      'column': f'<only in {side}>', 'sql_value': None, 'pandas_value': None})
+
+    both = merged[merged['_merge'] == 'both']
+    for col, tol in PARITY_TOLERANCE.items():
+        left = pd.to_numeric(both[f'{col}_sql'], errors='coerce').astype('float64')
+        right = pd.to_numeric(both[f'{col}_pandas'], errors='coerce').astype('float64')
+        bad = ~((left - right).abs() <= tol + 1e-9) & ~(left.isna() & right.isna())
+        for idx in both.index[bad]:
+            diffs.append({'product_id': both.at[idx, 'product_id'], 'sku_id': both.at[idx, 'sku_id'],
+                          'column': col, 'sql_value': left[idx], 'pandas_value': right[idx]})
+    for col in PARITY_EXACT:
+        left = both[f'{col}_sql'].astype(str)
+        right = both[f'{col}_pandas'].astype(str)
+        for idx in both.index[left != right]:
+            diffs.append({'product_id': both.at[idx, 'product_id'], 'sku_id': both.at[idx, 'sku_id'],
+                          'column': col, 'sql_value': left[idx], 'pandas_value': right[idx]})
+
+    diff_df = pd.DataFrame(diffs, columns=['product_id', 'sku_id', 'column', 'sql_value', 'pandas_value'])
+    print("\n" + "=" * 60)
+    print(f"库存健康度引擎对账 ({today})：SQL {len(expected)} 行，向量化 {len(actual)} 行")
+    if diff_df.empty:
+        print("✓ 全部一致")
+    else:
+        print(f"✗ 差异 {len(diff_df)} 处")
+        print(diff_df.groupby('column').size().to_string())
+        print("\n示例：")
+        print(diff_df.head(20).to_string(index=False))
+    print("=" * 60 + "\n")
+    return diff_df
+
+
+if __name__ == '__main__':
+    # python etl_ads_health_pandas.py          向量化引擎计算并写入（含SABC分级与汇总）
+    # python etl_ads_health_pandas.py parity   与SQL引擎逐行对账
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    if len(sys.argv) > 1 and sys.argv[1] == 'parity':
+        parity()
+    else:
+        calculate_inventory_health()
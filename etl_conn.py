@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""
+何方珠宝 - 数据库连接管理（公共模块）
+进程内共享一个Oracle会话池（oracledb.create_pool）和一个带连接池的SQLAlchemy引擎，
+由 run_etl.run_all 创建后注入各模块 run()；单独运行模块时按需懒加载同一实例。
+ERP的TLS/认证握手每次运行只发生在建池时，而不是每个函数一次。
+"""
+
+import logging
+import threading
+from contextlib import contextmanager
+
+import oracledb
+from sqlalchemy import create_engine
+
+from config import (
+    ORACLE_CONFIG, ORACLE_DSN, MYSQL_CONN_STR,
+    ORACLE_POOL_MIN, ORACLE_POOL_MAX, MYSQL_POOL_SIZE, MYSQL_MAX_OVERFLOW, ORACLE_STMT_CACHE_SIZE,
+    LOAD_METHOD
+)
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_oracle_pool = None
+_mysql_engine = None
+
+
+def connect_oracle():
+    """建立独立Oracle连接（thin模式，不经过会话池，供工具脚本使用）"""
+    return oracledb.connect(
+        user=ORACLE_CONFIG['user'],
+        password=ORACLE_CONFIG['password'],
+        dsn=ORACLE_DSN,
+        stmtcachesize=ORACLE_STMT_CACHE_SIZE
+    )
+
+
+def get_oracle_pool():
+    """获取进程内共享的Oracle会话池（首次调用时创建）"""
+    global _oracle_pool
+    with _lock:
+        if _oracle_pool is None:
+            logger.info(f"创建Oracle会话池（min={ORACLE_POOL_MIN}, max={ORACLE_POOL_MAX}）...")
+            _oracle_pool = oracledb.create_pool(
+                user=ORACLE_CONFIG['user'],
+                password=ORACLE_CONFIG['password'],
+                dsn=ORACLE_DSN,
+                min=ORACLE_POOL_MIN,
+                max=ORACLE_POOL_MAX,
+                increment=1,
+                getmode=oracledb.POOLGETMODE_WAIT,
+                stmtcachesize=ORACLE_STMT_CACHE_SIZE
+            )
+        return _oracle_pool
+
+
+def get_mysql_engine():
+    """获取进程内共享的MySQL引擎（首次调用时创建）"""
+    global _mysql_engine
+    with _lock:
+        if _mysql_engine is None:
+            logger.info(f"创建MySQL连接池（pool_size={MYSQL_POOL_SIZE}, max_overflow={MYSQL_MAX_OVERFLOW}）...")
+            _mysql_engine = create_engine(
+                MYSQL_CONN_STR,
+                pool_size=MYSQL_POOL_SIZE,
+                max_overflow=MYSQL_MAX_OVERFLOW,
+                pool_pre_ping=True,
+                pool_recycle=3600,
+                # LOAD DATA LOCAL INFILE 需客户端显式开启
+                connect_args={'local_infile': LOAD_METHOD == 'infile'}
+            )
+        return _mysql_engine
+
+
+def create_oracle_pool_async(max_size=None):
+    """
+    创建asyncio会话池（oracledb 2.0+ thin模式）
+    异步池绑定创建它的事件循环，不做进程级共享，由调用方在同一循环内 await pool.close()
+    """
+    max_size = max_size or ORACLE_POOL_MAX
+    logger.info(f"创建Oracle异步会话池（max={max_size}）...")
+    return oracledb.create_pool_async(
+        user=ORACLE_CONFIG['user'],
+        password=ORACLE_CONFIG['password'],
+        dsn=ORACLE_DSN,
+        min=1,
+        max=max_size,
+        increment=1,
+        stmtcachesize=ORACLE_STMT_CACHE_SIZE
+    )
+
+
+def supports_async():
+    """当前 oracledb 是否支持 asyncio（2.0+）"""
+    return hasattr(oracledb, 'create_pool_async')
+
+
+@contextmanager
+def oracle_connection(pool=None):
+    """从会话池借出一个Oracle连接，用完归还"""
+    pool = pool or get_oracle_pool()
+    conn = pool.acquire()
+    try:
+        yield conn
+    finally:
+        pool.release(conn)
+
+
+def pool_stats():
+    """连接池统计（未创建的池不出现在结果中）"""
+    stats = {}
+    if _oracle_pool is not None:
+        stats['oracle'] = {
+            'opened': _oracle_pool.opened,
+            'busy': _oracle_pool.busy,
+            'max': _oracle_pool.max,
+        }
+    if _mysql_engine is not None:
+        pool = _mysql_engine.pool
+        stats['mysql'] = {
+            'size': pool.size(),
+            'checked_out': pool.checkedout(),
+            'overflow': pool.overflow(),
+            'status': pool.status(),
+        }
+    return stats
+
+
+def log_pool_stats():
+    """输出连接池统计到日志"""
+    stats = pool_stats()
+    if 'oracle' in stats:
+        o = stats['oracle']
+        logger.info(f"Oracle会话池：已打开 {o['opened']}，使用中 {o['busy']}，上限 {o['max']}")
+    if 'mysql' in stats:
+        logger.info(f"MySQL连接池：{stats['mysql']['status']}")
+
+
+def close_all():
+    """关闭共享连接池（进程退出前调用）"""
+    global _oracle_pool, _mysql_engine
+    with _lock:
+        if _oracle_pool is not None:
+            _oracle_pool.close(force=True)
+            _oracle_pool = None
+        if _mysql_engine is not None:
+            _mysql_engine.dispose()
+            _mysql_engine = None
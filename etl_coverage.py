@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+"""
+何方珠宝 - 销售数据覆盖校验与缺口修复（公共模块）
+原先 run_etl 统计近30天 DISTINCT date_id，缺一天就整段回补30天（从Oracle重新抽取一个月零售明细）。
+改为按天统计 dws_sales_daily 行数，找出：
+- 缺失日期：当天没有任何行
+- 异常日期：行数低于前 COVERAGE_BASELINE_DAYS 天（有数据日期）行数中位数 × COVERAGE_MIN_RATIO
+连续的日期合并为区间，只回补这些区间，并输出修复报告（区间、原因、修复前后行数）。
+回补过的日期连同回补后的行数记入 etl_backfill_progress（backfill_id='coverage'）；
+行数偏低（low）的日期在源端稳定后（晚于该日 COVERAGE_SETTLE_DAYS 天）回补过、且行数仍与回补后一致时
+不再判为缺口（当天确实销售很少）；缺失日期始终回补；回补记录 COVERAGE_REPAIR_EXPIRE_DAYS 天后失效。
+回补总是重新抽取Oracle，不复用抽取暂存。
+
+用法：
+    python etl_coverage.py              # 只分析最近 COVERAGE_DAYS 天，不回补
+    python etl_coverage.py repair       # 分析并回补
+    python etl_coverage.py 60 repair    # 指定天数
+"""
+
+import logging
+import sys
+from datetime import datetime, timedelta
+from statistics import median
+
+from sqlalchemy import text
+
+from config import (
+    COVERAGE_DAYS, COVERAGE_BASELINE_DAYS, COVERAGE_MIN_RATIO, COVERAGE_SETTLE_DAYS, COVERAGE_REPAIR_EXPIRE_DAYS
+)
+from etl_conn import get_mysql_engine
+
+logger = logging.getLogger(__name__)
+
+# 基线至少需要的有数据天数（不足时只判断缺失，不判断异常）
+MIN_BASELINE_SAMPLES = 3
+
+# etl_backfill_progress 中缺口修复记录的回补任务ID（partition_start = partition_end = 日期）
+REPAIR_ID = 'coverage'
+
+
+def _date_id(dt):
+    return int(dt.strftime('%Y%m%d'))
+
+
+def _shift(date_id, days):
+    """日期ID加减天数"""
+    return _date_id(datetime.strptime(str(date_id), '%Y%m%d') + timedelta(days=days))
+
+
+def _dates(start_date, end_date):
+    """[start_date, end_date] 内的所有日期ID"""
+    cur = datetime.strptime(str(start_date), '%Y%m%d')
+    last = datetime.strptime(str(end_date), '%Y%m%d')
+    days = []
+    while cur <= last:
+        days.append(_date_id(cur))
+        cur += timedelta(days=1)
+    return days
+
+
+def daily_counts(engine, start_date, end_date):
+    """dws_sales_daily 按天行数 {date_id: 行数}（无数据的日期不出现）"""
+    with engine.connect() as conn:
+        rows = conn.execute(text("""
+            SELECT date_id, COUNT(*) FROM dws_sales_daily
+            WHERE date_id BETWEEN :start_date AND :end_date
+            GROUP BY date_id
+        """), {"start_date": start_date, "end_date": end_date}).fetchall()
+    return {int(r[0]): int(r[1]) for r in rows}
+
+
+def repaired_counts(engine, start_date, end_date):
+    """
+    有效期内（COVERAGE_REPAIR_EXPIRE_DAYS）回补过的日期 {date_id: (回补后行数, 回补日期ID)}
+    """
+    from etl_dws_sales import ensure_progress_table
+
+    ensure_progress_table(engine)
+    with engine.connect() as conn:
+        rows = conn.execute(text("""
+            SELECT partition_start, rows_written, updated_at FROM etl_backfill_progress
+            WHERE backfill_id = :bid AND status = 'SUCCESS'
+                AND partition_start BETWEEN :start_date AND :end_date
+                AND updated_at >= NOW() - INTERVAL :expire DAY
+        """), {"bid": REPAIR_ID, "start_date": start_date, "end_date": end_date,
+               "expire": COVERAGE_REPAIR_EXPIRE_DAYS}).fetchall()
+    return {int(r[0]): (int(r[1]), _date_id(r[2])) for r in rows}
+
+
+def is_settled(gap, repaired, settle_days=None):
+    """
+    缺口是否视为源端确实如此：只针对行数偏低（缺失日期始终回补），
+    且回补发生在该日之后 settle_days 天以上（源端已稳定）、当前行数与回补后一致
+    repaired: repaired_counts 的结果
+    """
+    settle_days = COVERAGE_SETTLE_DAYS if settle_days is None else settle_days
+    if gap['reason'] != 'low' or gap['date_id'] not in repaired:
+        return False
+    rows_after, repaired_on = repaired[gap['date_id']]
+    return rows_after == gap['rows'] and repaired_on >= _shift(gap['date_id'], settle_days)
+
+
+def record_repaired(engine, counts):
+    """记录回补后的按天行数 {date_id: 行数}"""
+    with engine.begin() as conn:
+        for date_id, rows in counts.items():
+            conn.execute(text("""
+                INSERT INTO etl_backfill_progress
+                    (backfill_id, partition_start, partition_end, status, rows_written, error_message)
+                VALUES (:bid, :d, :d, 'SUCCESS', :rows, NULL)
+                ON DUPLICATE KEY UPDATE status = VALUES(status), rows_written = VALUES(rows_written)
+            """), {"bid": REPAIR_ID, "d": date_id, "rows": rows})
+
+
+def find_gaps(counts, days, baseline_days=None, min_ratio=None):
+    """
+    逐天判断缺失/异常
+    counts: {date_id: 行数}，需包含 days 之前 baseline_days 天（用于计算基线）
+    days: 待校验的日期ID列表（升序）
+    返回 [dict(date_id, reason, rows, baseline)]，reason 为 'missing' / 'low'
+    """
+    baseline_days = baseline_days or COVERAGE_BASELINE_DAYS
+    min_ratio = COVERAGE_MIN_RATIO if min_ratio is None else min_ratio
+    gaps = []
+    for d in days:
+        rows = counts.get(d, 0)
+        history = [counts[p] for p in _dates(_shift(d, -baseline_days), _shift(d, -1)) if counts.get(p)]
+        baseline = median(history) if len(history) >= MIN_BASELINE_SAMPLES else None
+        if rows == 0:
+            gaps.append({'date_id': d, 'reason': 'missing', 'rows': 0, 'baseline': baseline})
+        elif baseline is not None and rows < baseline * min_ratio:
+            gaps.append({'date_id': d, 'reason': 'low', 'rows': rows, 'baseline': baseline})
+    return gaps
+
+
+def group_ranges(date_ids):
+    """把日期ID合并为连续区间 [(起, 止), ...]"""
+    ranges = []
+    for d in sorted(date_ids):
+        if ranges and _shift(ranges[-1][1], 1) == d:
+            ranges[-1] = (ranges[-1][0], d)
+        else:
+            ranges.append((d, d))
+    return ranges
+
+
+def analyze(engine=None, days=None, end_date=None):
+    """
+    校验截至 end_date（默认昨天）的最近 days 天（默认 COVERAGE_DAYS）
+    返回 (gaps, ranges)
+    """
+    engine = engine or get_mysql_engine()
+    days = days or COVERAGE_DAYS
+    end_date = end_date or _date_id(datetime.now() - timedelta(days=1))
+    start_date = _shift(end_date, -(days - 1))
+    checked = _dates(start_date, end_date)
+
+    counts = daily_counts(engine, _shift(start_date, -COVERAGE_BASELINE_DAYS), end_date)
+    repaired = repaired_counts(engine, start_date, end_date)
+    gaps = []
+    settled = []
+    for g in find_gaps(counts, checked):
+        # 源端稳定后回补过且行数未变：当天就是这么多，不再重复回补
+        if is_settled(g, repaired):
+            settled.append(g['date_id'])
+        else:
+            gaps.append(g)
+    ranges = group_ranges(g['date_id'] for g in gaps)
+
+    covered = sum(1 for d in checked if counts.get(d))
+    logger.info(f"近{days}天（{start_date} - {end_date}）销售数据覆盖 {covered} 天")
+    for g in gaps:
+        if g['reason'] == 'missing':
+            logger.warning(f"  {g['date_id']} 缺失")
+        else:
+            logger.warning(f"  {g['date_id']} 行数异常：{g['rows']}（基线 {g['baseline']:.0f}）")
+    if settled:
+        logger.info(f"  {len(settled)} 天行数偏低但已回补过且行数未变，不再回补: {settled}")
+    return gaps, ranges
+
+
+def repair(engine=None, pool=None, days=None, end_date=None):
+    """
+    只回补缺失/异常日期所在的连续区间，返回修复报告
+    [dict(start, end, days, reasons, rows_before, rows_after)]；某区间回补失败时继续其余区间，最后抛出异常
+    """
+    from etl_dws_sales import backfill
+    from etl_sales_rolling import invalidate as invalidate_rolling
+
+    engine = engine or get_mysql_engine()
+    gaps, ranges = analyze(engine, days, end_date)
+    if not ranges:
+        logger.info("销售数据覆盖完整，无需回补")
+        return []
+
+    by_date = {g['date_id']: g for g in gaps}
+    report = []
+    failed = []
+    for start, end in ranges:
+        span = _dates(start, end)
+        before = sum(by_date[d]['rows'] for d in span)
+        reasons = sorted({by_date[d]['reason'] for d in span})
+        logger.info(f"回补 {start} - {end}（{len(span)} 天，{'/'.join(reasons)}）...")
+        try:
+            # 总是重新抽取：复用暂存会把回补前同样不完整的结果再写一遍
+            backfill(start, end, engine=engine, pool=pool, cache=False)
+        except Exception as e:
+            failed.append((start, end))
+            logger.error(f"回补 {start} - {end} 失败: {e}")
+            continue
+        after_counts = daily_counts(engine, start, end)
+        record_repaired(engine, {d: after_counts.get(d, 0) for d in span})
+        after = sum(after_counts.values())
+        report.append({'start': start, 'end': end, 'days': len(span), 'reasons': reasons,
+                       'rows_before': before, 'rows_after': after})
+
+    if report:
+        # 回补的日期在滚动窗口内时，增量维护感知不到，下次维护改为全量重算
+        invalidate_rolling(engine)
+
+    log_report(report)
+    if failed:
+        raise RuntimeError(f"{len(failed)} 个区间回补失败: {failed}")
+    return report
+
+
+def log_report(report):
+    """输出修复报告"""
+    if not report:
+        return
+    total_days = sum(r['days'] for r in report)
+    logger.info(f"销售数据缺口修复：{len(report)} 个区间，共 {total_days} 天")
+    for r in report:
+        logger.info(
+            f"  {r['start']} - {r['end']}（{r['days']} 天，{'/'.join(r['reasons'])}）："
+            f"{r['rows_before']} → {r['rows_after']} 行"
+        )
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    args = sys.argv[1:]
+    days = int(args[0]) if args and args[0].isdigit() else None
+    try:
+        if 'repair' in args:
+            repair(days=days)
+        else:
+            analyze(days=days)
+    finally:
+        from etl_conn import close_all
+        close_all()
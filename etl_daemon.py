@@ -0,0 +1,414 @@
+# -*- coding: utf-8 -*-
+"""
+何方珠宝 - ETL常驻调度进程
+计划任务/cron 每次启动 scheduled_etl.py 都要重新加载解释器与 pandas/oracledb/SQLAlchemy、重新建立连接，
+并执行全部任务。常驻进程只在启动时建一次Oracle会话池与MySQL连接池，按 DAEMON_SCHEDULE 分任务执行：
+
+- nightly：run_etl 全流程（维度、零售单ODS、销售、库存、库存健康度），默认每天 03:00
+- sales_micro：日内销售微批（etl_sales_micro），默认每10分钟
+- inventory：库存快照（etl_dws_inventory），默认每小时
+- ads_health：库存健康度，默认在 inventory 成功后执行
+- dims / coverage：维度同步、销售覆盖校验与缺口回补（默认不单独调度，包含在 nightly 中）
+
+同一任务不会重叠执行：到期时上一轮仍在执行则跳过本轮（after 类任务在上一轮结束后补执行一次）。
+nightly 独占执行：等待其他任务结束后开始，执行期间不启动其他任务。
+除 nightly（run_etl 自行按阶段记录）外，每次执行在 etl_log 中记录一行（etl_runlog）。
+任务状态写入 DAEMON_STATUS_FILE（JSON），DAEMON_STATUS_PORT 非0时另提供 HTTP GET /status。
+
+用法：
+    python etl_daemon.py               # 前台常驻，Ctrl+C / SIGTERM 等待执行中的任务结束后退出
+    python etl_daemon.py once JOB      # 在当前进程执行一次指定任务（调试用）
+"""
+
+import json
+import logging
+import logging.handlers
+import os
+import signal
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from config import (
+    DAEMON_SCHEDULE, DAEMON_MAX_CONCURRENT, DAEMON_STATUS_FILE, DAEMON_STATUS_PORT, DAEMON_STATUS_HOST
+)
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+if PROJECT_DIR not in sys.path:
+    sys.path.insert(0, PROJECT_DIR)
+
+logger = logging.getLogger(__name__)
+
+# 调度循环检查间隔（秒）
+TICK_SECONDS = 1
+
+SCHEDULE_KINDS = ('every', 'daily', 'after')
+
+_lock = threading.Lock()
+# 状态文件写入串行化（多个任务线程结束时会同时写）
+_status_file_lock = threading.Lock()
+_stop = threading.Event()
+_jobs = {}
+_started_at = datetime.now()
+
+
+# ============================================
+# 任务
+# ============================================
+
+def _nightly(engine, pool):
+    from run_etl import run_all
+    if not run_all():
+        raise RuntimeError("run_etl 存在未成功的阶段，详见 etl_log")
+
+
+def _sales_micro(engine, pool):
+    from etl_sales_micro import run
+    run(engine=engine, pool=pool)
+
+
+def _inventory(engine, pool):
+    from etl_dws_inventory import run
+    run(engine=engine, pool=pool)
+
+
+def _ads_health(engine, pool):
+    from etl_ads_health import run
+    run(engine=engine)
+
+
+def _dims(engine, pool):
+    from config import DIM_EXTRACT_MODE
+    if DIM_EXTRACT_MODE == 'async':
+        from etl_dim_async import run as run_dims
+        run_dims(engine=engine, raise_on_failure=True)
+        return
+    from etl_dim_product import run as run_dim_product
+    from etl_dim_sku import run as run_dim_sku
+    from etl_dim_store import run as run_dim_store
+    run_dim_product(engine=engine, pool=pool)
+    run_dim_sku(engine=engine, pool=pool)
+    run_dim_store(engine=engine, pool=pool)
+
+
+def _coverage(engine, pool):
+    from etl_coverage import repair
+    repair(engine=engine, pool=pool)
+
+
+# 任务名 → (函数, 是否独占, 是否由调度进程记录 etl_log)
+JOBS = {
+    'nightly': (_nightly, True, False),
+    'sales_micro': (_sales_micro, False, True),
+    'inventory': (_inventory, False, True),
+    'ads_health': (_ads_health, False, True),
+    'dims': (_dims, False, True),
+    'coverage': (_coverage, False, True),
+}
+
+
+# ============================================
+# 计划
+# ============================================
+
+def parse_schedule(spec=None):
+    """
+    解析任务计划 'job=kind@arg;...' → {job: (kind, arg)}
+    every 的参数为秒数（int），daily 为 (时, 分)，after 为上游任务名
+    """
+    spec = DAEMON_SCHEDULE if spec is None else spec
+    schedule = {}
+    for item in filter(None, (part.strip() for part in spec.split(';'))):
+        try:
+            name, rule = (x.strip() for x in item.split('=', 1))
+            kind, arg = (x.strip() for x in rule.split('@', 1))
+        except ValueError:
+            raise ValueError(f"任务计划格式错误: {item}（应为 任务=类型@参数）")
+        if name not in JOBS:
+            raise ValueError(f"未知任务: {name}（可用：{', '.join(JOBS)}）")
+        if kind not in SCHEDULE_KINDS:
+            raise ValueError(f"未知计划类型: {kind}（可用：{', '.join(SCHEDULE_KINDS)}）")
+        if kind == 'every':
+            arg = int(arg)
+        elif kind == 'daily':
+            hour, minute = arg.split(':')
+            arg = (int(hour), int(minute))
+        schedule[name] = (kind, arg)
+
+    for name, (kind, arg) in schedule.items():
+        if kind == 'after' and arg not in schedule:
+            raise ValueError(f"任务 {name} 依赖的 {arg} 未在计划中")
+    return schedule
+
+
+def next_daily(hour, minute, now):
+    """下一次 HH:MM（今天已过则为明天）"""
+    run_at = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    return run_at if run_at > now else run_at + timedelta(days=1)
+
+
+def _schedule_next(job, now):
+    """按计划类型计算下一次执行时间（after 类任务没有固定时间）"""
+    kind, arg = job['kind'], job['arg']
+    if kind == 'every':
+        job['next_run'] = now + timedelta(seconds=arg)
+    elif kind == 'daily':
+        job['next_run'] = next_daily(arg[0], arg[1], now)
+
+
+def init_jobs(schedule, now=None):
+    """初始化任务状态：every 类启动后立即执行一次，daily 类等到下一个时间点"""
+    now = now or datetime.now()
+    _jobs.clear()
+    for name, (kind, arg) in schedule.items():
+        _jobs[name] = {
+            'kind': kind, 'arg': arg, 'running': False, 'pending': False,
+            'next_run': now if kind == 'every' else None,
+            'last_start': None, 'last_end': None, 'last_status': None, 'last_error': None,
+            'runs': 0, 'failures': 0, 'skipped': 0,
+        }
+        if kind == 'daily':
+            _schedule_next(_jobs[name], now)
+
+
+def _is_due(job, now):
+    if job['kind'] == 'after':
+        return job['pending']
+    return job['next_run'] is not None and job['next_run'] <= now
+
+
+# ============================================
+# 状态
+# ============================================
+
+def status():
+    """当前状态（可JSON序列化的dict）"""
+    from etl_conn import pool_stats
+    with _lock:
+        jobs = {}
+        for name, job in _jobs.items():
+            arg = job['arg']
+            rule = f"{job['kind']}@{arg[0]:02d}:{arg[1]:02d}" if job['kind'] == 'daily' else f"{job['kind']}@{arg}"
+            jobs[name] = {
+                'schedule': rule,
+                'running': job['running'],
+                'next_run': job['next_run'],
+                'last_start': job['last_start'],
+                'last_end': job['last_end'],
+                'last_status': job['last_status'],
+                'last_error': job['last_error'],
+                'runs': job['runs'],
+                'failures': job['failures'],
+                'skipped': job['skipped'],
+            }
+    return {
+        'pid': os.getpid(),
+        'started_at': _started_at,
+        'updated_at': datetime.now(),
+        'jobs': jobs,
+        'pools': pool_stats(),
+    }
+
+
+def write_status(path=None):
+    """写入状态文件（先写临时文件再替换，读者不会读到半截JSON；多线程调用时串行写入）"""
+    path = path or DAEMON_STATUS_FILE
+    if not os.path.isabs(path):
+        path = os.path.join(PROJECT_DIR, path)
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with _status_file_lock:
+            tmp = f"{path}.tmp"
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(status(), f, ensure_ascii=False, indent=2, default=str)
+            os.replace(tmp, path)
+    except Exception as e:
+        logger.warning(f"写入状态文件失败: {e}")
+
+
+class _StatusHandler(BaseHTTPRequestHandler):
+    """GET /status 返回状态JSON"""
+
+    def do_GET(self):
+        if self.path.rstrip('/') not in ('', '/status'):
+            self.send_error(404)
+            return
+        body = json.dumps(status(), ensure_ascii=False, default=str).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_status(port, host=None):
+    """在后台线程提供HTTP状态接口，返回server（退出时 shutdown）；默认只监听本机（DAEMON_STATUS_HOST）"""
+    host = host or DAEMON_STATUS_HOST
+    server = ThreadingHTTPServer((host, port), _StatusHandler)
+    threading.Thread(target=server.serve_forever, name='etl-daemon-status', daemon=True).start()
+    logger.info(f"状态接口：http://{host}:{port}/status")
+    return server
+
+
+# ============================================
+# 执行
+# ============================================
+
+def run_job(name, engine, pool):
+    """执行一次任务并更新状态；成功后触发 after 类下游任务"""
+    from etl_runlog import track_stage, new_run_id, business_date
+    func, _, tracked = JOBS[name]
+    logger.info(f">>> 开始 {name}")
+    started = datetime.now()
+    try:
+        if tracked:
+            with track_stage(engine, new_run_id(), business_date(), name):
+                func(engine, pool)
+        else:
+            func(engine, pool)
+        result, error = 'SUCCESS', None
+    except Exception as e:
+        result, error = 'FAILED', str(e)[:500]
+        logger.error(f"{name} failed: {e}")
+
+    ended = datetime.now()
+    with _lock:
+        job = _jobs[name]
+        job.update(running=False, last_end=ended, last_status=result, last_error=error)
+        job['runs'] += 1
+        if error:
+            job['failures'] += 1
+        if result == 'SUCCESS':
+            for downstream in _jobs.values():
+                if downstream['kind'] == 'after' and downstream['arg'] == name:
+                    downstream['pending'] = True
+    logger.info(f"<<< {name} {result}（{(ended - started).total_seconds():.1f} 秒）")
+    write_status()
+
+
+def _dispatch(executor, engine, pool, now):
+    """启动到期且可执行的任务；同一任务仍在执行时跳过本轮"""
+    started = []
+    with _lock:
+        running = [n for n, j in _jobs.items() if j['running']]
+        exclusive_running = any(JOBS[n][1] for n in running)
+        due = [n for n, j in _jobs.items() if _is_due(j, now)]
+        exclusive_waiting = any(JOBS[n][1] and not _jobs[n]['running'] for n in due)
+
+        for name in due:
+            job = _jobs[name]
+            exclusive = JOBS[name][1]
+            if job['running']:
+                if job['kind'] != 'after':
+                    # 上一轮仍在执行：跳过本轮（after 类保留待执行标记，结束后补一次）
+                    job['skipped'] += 1
+                    _schedule_next(job, now)
+                    logger.warning(f"{name} 上一轮仍在执行，跳过本轮")
+                continue
+            if exclusive_running or len(running) >= DAEMON_MAX_CONCURRENT:
+                continue
+            if exclusive and running:
+                continue  # 独占任务等待其他任务结束
+            if not exclusive and exclusive_waiting:
+                continue  # 独占任务等待期间不启动新任务
+            job.update(running=True, pending=False, last_start=now)
+            _schedule_next(job, now)
+            running.append(name)
+            exclusive_running = exclusive
+            started.append(name)
+
+    for name in started:
+        executor.submit(run_job, name, engine, pool)
+    if started:
+        write_status()
+
+
+def run_daemon(schedule=None):
+    """常驻执行，直到收到 SIGINT/SIGTERM"""
+    from etl_conn import get_oracle_pool, get_mysql_engine, close_all
+    from etl_runlog import ensure_log_table
+    from etl_stage import configure as configure_stage
+
+    schedule = schedule or parse_schedule()
+    logger.info("#" * 60)
+    logger.info("#  何方珠宝 - ETL常驻调度启动")
+    for name, (kind, arg) in schedule.items():
+        logger.info(f"#  {name}: {kind}@{arg}")
+    logger.info("#" * 60)
+
+    # 调度任务总是重新抽取（同 scheduled_etl），同时刷新暂存供手动重跑复用
+    configure_stage(refresh=True)
+    engine = get_mysql_engine()
+    try:
+        pool = get_oracle_pool()
+    except Exception as e:
+        # 建池失败时Oracle任务各自报错，并由 etl_conn 在下次使用时重试建池
+        logger.error(f"Oracle会话池创建失败: {e}")
+        pool = None
+    try:
+        ensure_log_table(engine)
+    except Exception as e:
+        logger.warning(f"etl_log 初始化失败: {e}")
+
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda signum, frame: _stop.set())
+
+    init_jobs(schedule)
+    write_status()
+    server = serve_status(DAEMON_STATUS_PORT) if DAEMON_STATUS_PORT else None
+
+    executor = ThreadPoolExecutor(max_workers=DAEMON_MAX_CONCURRENT, thread_name_prefix='etl-job')
+    try:
+        while not _stop.is_set():
+            _dispatch(executor, engine, pool, datetime.now())
+            _stop.wait(TICK_SECONDS)
+    finally:
+        logger.info("收到退出信号，等待执行中的任务结束...")
+        executor.shutdown(wait=True)
+        if server is not None:
+            server.shutdown()
+        write_status()
+        close_all()
+        logger.info("ETL常驻调度已退出")
+
+
+def setup_logging():
+    """日志输出到控制台与 logs/etl_daemon.log（每天零点轮转，保留30天）"""
+    log_dir = os.path.join(PROJECT_DIR, 'logs')
+    os.makedirs(log_dir, exist_ok=True)
+    if hasattr(sys.stdout, 'reconfigure'):
+        sys.stdout.reconfigure(encoding='utf-8')
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(threadName)s - %(name)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.handlers.TimedRotatingFileHandler(
+                os.path.join(log_dir, 'etl_daemon.log'), when='midnight', backupCount=30, encoding='utf-8'
+            ),
+            logging.StreamHandler(sys.stdout)
+        ]
+    )
+
+
+if __name__ == '__main__':
+    setup_logging()
+    if len(sys.argv) > 2 and sys.argv[1] == 'once':
+        if sys.argv[2] not in JOBS:
+            print(f"未知任务: {sys.argv[2]}（可用：{', '.join(JOBS)}）")
+            sys.exit(2)
+        from etl_conn import get_oracle_pool, get_mysql_engine, close_all
+        from etl_stage import configure as configure_stage
+        # 与常驻调度一致：总是重新抽取
+        configure_stage(refresh=True)
+        init_jobs({sys.argv[2]: ('after', None)})
+        try:
+            run_job(sys.argv[2], get_mysql_engine(), get_oracle_pool())
+        finally:
+            close_all()
+        sys.exit(0 if _jobs[sys.argv[2]]['last_status'] == 'SUCCESS' else 1)
+    run_daemon()
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""
+何方珠宝 - ETL阶段依赖图执行器（公共模块）
+每个阶段声明上游依赖，互不依赖的阶段在线程池中并发执行（ETL阶段以等待Oracle/MySQL为主），
+整体耗时取决于关键路径而不是各阶段之和。
+
+- requires：强依赖，上游失败或被跳过时本阶段跳过（失败只影响下游受波及的阶段）
+- after：仅排序，等上游结束（无论成败）后再执行，本阶段自行处理上游失败（如ODS失败时销售改从Oracle聚合）
+阶段函数接收当前结果字典 {阶段名: 'SUCCESS' / 'FAILED: ...' / 'SKIPPED: ...'}（只读）
+"""
+
+import logging
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+logger = logging.getLogger(__name__)
+
+Stage = namedtuple('Stage', ['name', 'func', 'requires', 'after'])
+
+
+def stage(name, func, requires=(), after=()):
+    """声明一个阶段"""
+    return Stage(name, func, tuple(requires), tuple(after))
+
+
+def validate(stages):
+    """检查阶段名唯一、依赖存在且无环；返回拓扑序的阶段名列表"""
+    by_name = {}
+    for s in stages:
+        if s.name in by_name:
+            raise ValueError(f"阶段重复: {s.name}")
+        by_name[s.name] = s
+    for s in stages:
+        for dep in s.requires + s.after:
+            if dep not in by_name:
+                raise ValueError(f"阶段 {s.name} 依赖不存在的阶段 {dep}")
+
+    order = []
+    state = {}
+
+    def visit(name, path):
+        if state.get(name) == 'done':
+            return
+        if state.get(name) == 'visiting':
+            raise ValueError(f"阶段依赖存在环: {' → '.join(path + [name])}")
+        state[name] = 'visiting'
+        for dep in by_name[name].requires + by_name[name].after:
+            visit(dep, path + [name])
+        state[name] = 'done'
+        order.append(name)
+
+    for s in stages:
+        visit(s.name, [])
+    return order
+
+
+def _error_text(e):
+    return str(e).encode('utf-8', errors='ignore').decode('utf-8')
+
+
+def run_dag(stages, max_workers=1, completed=()):
+    """
+    按依赖并发执行各阶段
+    max_workers: 同时执行的阶段数上限（1 = 按拓扑序逐个执行）
+    completed: 已成功、本次不再执行的阶段名（断点续跑），视为 SUCCESS
+    返回 (results, timings)：results {阶段名: 结果文本}，timings {阶段名: (开始秒, 结束秒)}（相对执行开始）
+    """
+    order = validate(stages)
+    by_name = {s.name: s for s in stages}
+    results = {}
+    for name in completed:
+        if name in by_name:
+            results[name] = 'SUCCESS'
+            logger.info(f"跳过 {name}（已成功）")
+    timings = {}
+    running = {}
+    t0 = time.perf_counter()
+
+    def finished(name):
+        return name in results
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while len(results) < len(stages):
+            for name in order:
+                s = by_name[name]
+                if finished(name) or name in running.values():
+                    continue
+                if not all(finished(d) for d in s.requires + s.after):
+                    continue
+                failed = [d for d in s.requires if results[d] != 'SUCCESS']
+                if failed:
+                    results[name] = f"SKIPPED: upstream {', '.join(failed)} not successful"
+                    logger.warning(f"跳过 {name}（上游 {', '.join(failed)} 未成功）")
+                    continue
+                if len(running) >= max_workers:
+                    break
+                logger.info(f"\n>>> 开始 {name}")
+                start = time.perf_counter() - t0
+                future = executor.submit(s.func, dict(results))
+                running[future] = name
+                timings[name] = (start, None)
+
+            if not running:
+                continue
+
+            done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                end = time.perf_counter() - t0
+                timings[name] = (timings[name][0], end)
+                try:
+                    future.result()
+                    results[name] = 'SUCCESS'
+                    logger.info(f"<<< 完成 {name}（{end - timings[name][0]:.1f} 秒）")
+                except Exception as e:
+                    error_msg = _error_text(e)
+                    results[name] = f'FAILED: {error_msg[:100]}'
+                    logger.error(f"{name} failed: {error_msg}")
+
+    return {s.name: results[s.name] for s in stages}, timings
+
+
+def critical_path(stages, timings):
+    """
+    由实际耗时推算关键路径：从最后结束的阶段开始，沿着结束最晚的上游阶段回溯
+    返回 (阶段名列表, 关键路径耗时秒)
+    """
+    by_name = {s.name: s for s in stages}
+    ran = {n: t for n, t in timings.items() if t[1] is not None}
+    if not ran:
+        return [], 0.0
+    name = max(ran, key=lambda n: ran[n][1])
+    path = [name]
+    while True:
+        deps = [d for d in by_name[name].requires + by_name[name].after if d in ran]
+        if not deps:
+            break
+        name = max(deps, key=lambda d: ran[d][1])
+        path.append(name)
+    path.reverse()
+    return path, ran[path[-1]][1] - ran[path[0]][0]
+
+
+def log_timings(stages, timings):
+    """输出各阶段耗时、阶段耗时之和与关键路径"""
+    ran = {n: t for n, t in timings.items() if t[1] is not None}
+    if not ran:
+        return
+    total = sum(end - start for start, end in ran.values())
+    wall = max(end for _, end in ran.values())
+    for name, (start, end) in sorted(ran.items(), key=lambda item: item[1][0]):
+        logger.info(f"  {name:<16} {start:>7.1f}s → {end:>7.1f}s（{end - start:.1f} 秒）")
+    path, length = critical_path(stages, timings)
+    logger.info(f"阶段耗时之和 {total:.1f} 秒，实际 {wall:.1f} 秒")
+    logger.info(f"关键路径：{' → '.join(path)}（{length:.1f} 秒）")
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""
+何方珠宝 - 维度并发ETL（asyncio）
+dim_product / dim_sku / dim_store 三个查询互不依赖，用 oracledb 异步连接并发执行，
+每个结果抽取完成后立即交给对应模块的 transform/load（在线程中执行，不阻塞其余查询）。
+维度阶段耗时取决于最慢的查询，而不是三者之和；并发数由 DIM_CONCURRENCY 限制以保护ERP。
+"""
+
+import asyncio
+from datetime import datetime
+import logging
+
+from config import DIM_CONCURRENCY
+from etl_conn import get_mysql_engine, create_oracle_pool_async
+from etl_extract import fetch_df_async
+import etl_dim_product
+import etl_dim_sku
+import etl_dim_store
+
+# 配置日志
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+
+def _dim_jobs(engine):
+    """
+    各维度的 (名称, 抽取SQL, 绑定变量, 列类型, 加载函数)
+    加载函数接收抽取结果的DataFrame，在工作线程中执行 transform + load
+    """
+    mode, product_sql, product_params = etl_dim_product.plan(engine)
+    return [
+        ('dim_product', product_sql, product_params, etl_dim_product.EXTRACT_DTYPES,
+         lambda df: etl_dim_product.load_frames(mode, [df], engine)),
+        ('dim_sku', etl_dim_sku.EXTRACT_SQL, None, etl_dim_sku.EXTRACT_DTYPES,
+         lambda df: etl_dim_sku.load_to_mysql(etl_dim_sku.transform(df), engine)),
+        ('dim_store', etl_dim_store.EXTRACT_SQL, None, etl_dim_store.EXTRACT_DTYPES,
+         lambda df: etl_dim_store.load_to_mysql(etl_dim_store.transform(df), engine)),
+    ]
+
+
+async def _run_job(pool, semaphore, name, sql, params, dtypes, load):
+    """单个维度：限流抽取 → 线程中加载"""
+    start_time = datetime.now()
+    async with semaphore:
+        logger.info(f"[{name}] 开始抽取...")
+        df = await fetch_df_async(pool, sql, params, dtypes=dtypes)
+    logger.info(f"[{name}] 抽取完成 {len(df)} 条，开始加载...")
+    await asyncio.to_thread(load, df)
+    logger.info(f"[{name}] ✓ 完成，耗时 {(datetime.now() - start_time).seconds} 秒")
+
+
+async def _run_all(engine, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    pool = create_oracle_pool_async(max_size=concurrency)
+    try:
+        jobs = _dim_jobs(engine)
+        outcomes = await asyncio.gather(
+            *(_run_job(pool, semaphore, *job) for job in jobs),
+            return_exceptions=True
+        )
+    finally:
+        await pool.close()
+    return {job[0]: outcome for job, outcome in zip(jobs, outcomes)}
+
+
+def run(engine=None, concurrency=None, raise_on_failure=False):
+    """
+    并发执行三个维度ETL
+    返回 {维度名: 'SUCCESS' / 'FAILED: ...'}，某个维度失败不影响其余维度；
+    raise_on_failure=True 时全部维度结束后若有失败则抛出 RuntimeError（供 run_etl / etl_daemon 标记阶段失败）
+    """
+    engine = engine or get_mysql_engine()
+    concurrency = concurrency or DIM_CONCURRENCY
+
+    start_time = datetime.now()
+    logger.info("=" * 50)
+    logger.info(f"开始并发执行维度ETL（并发上限 {concurrency}）")
+    logger.info("=" * 50)
+
+    outcomes = asyncio.run(_run_all(engine, concurrency))
+
+    results = {}
+    for name, outcome in outcomes.items():
+        if isinstance(outcome, Exception):
+            error_msg = str(outcome).encode('utf-8', errors='ignore').decode('utf-8')
+            results[name] = f'FAILED: {error_msg[:100]}'
+            logger.error(f"{name} failed: {error_msg}")
+        else:
+            results[name] = 'SUCCESS'
+
+    duration = (datetime.now() - start_time).seconds
+    logger.info(f"维度ETL完成，耗时 {duration} 秒")
+
+    failed = {name: result for name, result in results.items() if result != 'SUCCESS'}
+    if raise_on_failure and failed:
+        raise RuntimeError(f"维度ETL失败: {failed}")
+    return results
+
+
+if __name__ == '__main__':
+    from etl_conn import close_all
+    try:
+        print(run())
+    finally:
+        close_all()
@@ -2,16 +2,25 @@
 """
 何方珠宝 - 商品维度ETL
 从Oracle M_PRODUCT同步到MySQL dim_product
-策略：全量覆盖
+策略：增量upsert（按 M_PRODUCT/M_PRODUCT_ALIAS.MODIFIEDDATE 高水位）+ 定期全量对账
+全量对账写入影子表 dim_product__staging 后 RENAME TABLE 原子切换，加载期间线上表不空
+
+增量模式只抽取高水位之后新增/修改的商品（含停用，停用商品从维度表删除），
+M_DIM 名称变更等不改动商品本身的情况由定期全量对账兜底。
 """
 
-import oracledb
 import pandas as pd
-from sqlalchemy import create_engine, text
-from datetime import datetime
+from sqlalchemy import text
+from datetime import datetime, timedelta
 import logging
+import sys
 
-from config import ORACLE_CONFIG, ORACLE_DSN, MYSQL_CONN_STR
+from config import DIM_PRODUCT_LOAD_MODE, DIM_PRODUCT_FULL_RECONCILE_DAYS, WATERMARK_OVERLAP_MINUTES
+from etl_conn import get_mysql_engine
+from etl_extract import iter_batches, as_frames
+from etl_queries import MAIN_CATEGORY_IN, MAIN_CATEGORY_PARAMS, with_categories
+from etl_load import upsert_frame, delete_keys, bulk_insert, prepare_staging, publish_staging
+from etl_state import get_watermark, set_watermark
 
 # 配置日志
 logging.basicConfig(
@@ -21,11 +30,14 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
-def extract_from_oracle():
-    """从Oracle抽取商品数据"""
+JOB_NAME = 'dim_product'
+
+# dim_product 表中不存在的列：颜色/尺寸单独写入 dim_product_attr，modified_at 仅用于推进高水位
+# （取商品与其SKU修改时间的较大者，与增量条件一致）
+NON_TABLE_COLS = ['color_attr', 'size_attr', 'modified_at']
 
-    # 使用实际存在的字段名（不使用行尾反斜杠，保持 SQL 可读）
-    sql = """
+# 使用实际存在的字段名（不使用行尾反斜杠，保持 SQL 可读）
+SELECT_SQL = f"""
     SELECT
         p.ID AS product_id,
         p.NAME AS product_code,
@@ -41,9 +53,10 @@ def extract_from_oracle():
         p.PRICELIST AS price_list,
         p.FABELEMENT AS material,
         p.PRECOST AS price_cost,
-        CASE WHEN p.M_DIM4_ID IN (134,142,139,138,141,143,133,136,140,137,144,145) THEN 'Y' ELSE 'N' END AS is_main_product,
+        CASE WHEN p.M_DIM4_ID IN ({MAIN_CATEGORY_IN}) THEN 'Y' ELSE 'N' END AS is_main_product,
         p.ISACTIVE AS is_active,
         p.CREATIONDATE AS created_at,
+        GREATEST(p.MODIFIEDDATE, NVL(pa_mod.MODIFIEDDATE, p.MODIFIEDDATE)) AS modified_at,
         asi.VALUE1 AS color_attr,
         asi.VALUE2 AS size_attr
     FROM M_PRODUCT p
@@ -60,28 +73,39 @@ def extract_from_oracle():
         ) inner_pa WHERE inner_pa.rn = 1
     ) pa_alias ON p.ID = pa_alias.M_PRODUCT_ID
     LEFT JOIN M_ATTRIBUTESETINSTANCE asi ON pa_alias.M_ATTRIBUTESETINSTANCE_ID = asi.ID
+    LEFT JOIN (
+        SELECT M_PRODUCT_ID, MAX(MODIFIEDDATE) AS MODIFIEDDATE FROM M_PRODUCT_ALIAS GROUP BY M_PRODUCT_ID
+    ) pa_mod ON p.ID = pa_mod.M_PRODUCT_ID
+"""
+
+# 全量：所有有效商品
+EXTRACT_SQL = SELECT_SQL + """
     WHERE p.ISACTIVE = 'Y'
     """
 
-    logger.info("连接Oracle数据库...")
-    conn = oracledb.connect(
-        user=ORACLE_CONFIG['user'],
-        password=ORACLE_CONFIG['password'],
-        dsn=ORACLE_DSN
-    )
+# 增量：高水位之后修改过的商品（不过滤ISACTIVE，以便捕获停用），SKU变更也会影响颜色尺寸
+INCREMENTAL_SQL = SELECT_SQL + """
+    WHERE p.MODIFIEDDATE > :since
+        OR p.ID IN (SELECT pa2.M_PRODUCT_ID FROM M_PRODUCT_ALIAS pa2 WHERE pa2.MODIFIEDDATE > :since)
+    """
 
-    logger.info("执行SQL查询...")
-    cursor = conn.cursor()
-    cursor.execute(sql)
-    columns = [col[0].lower() for col in cursor.description]
-    data = cursor.fetchall()
-    df = pd.DataFrame(data, columns=columns)
 
-    cursor.close()
-    conn.close()
+# 列式抽取时的列类型（ID列直接int64，可空ID为Int64，金额float64）
+EXTRACT_DTYPES = {
+    'product_id': 'int64',
+    'category_id': 'Int64',
+    'property_id': 'Int64',
+    'series_id': 'Int64',
+    'brand_id': 'Int64',
+    'price_list': 'float64',
+    'price_cost': 'float64',
+}
 
-    logger.info(f"抽取完成，共 {len(df)} 条记录")
-    return df
+
+def extract_from_oracle(batch_size=None, fetch_mode=None, pool=None):
+    """从Oracle分批抽取商品数据（生成器，每批一个DataFrame）"""
+    return iter_batches(EXTRACT_SQL, MAIN_CATEGORY_PARAMS, batch_size=batch_size,
+                        fetch_mode=fetch_mode, dtypes=EXTRACT_DTYPES, pool=pool)
 
 
 def transform(df):
@@ -112,41 +136,67 @@ def transform(df):
     return df
 
 
-def load_to_mysql(df):
-    """加载到MySQL"""
-
-    logger.info("连接MySQL数据库...")
-    engine = create_engine(MYSQL_CONN_STR)
-
-    # 全量覆盖：先清空再写入
-    logger.info("清空目标表 dim_product...")
-    with engine.begin() as conn:
-        conn.execute(text("TRUNCATE TABLE dim_product"))
-
-    logger.info("写入数据...")
-    # 写入 dim_product 前，移除属性列（颜色/尺寸），属性单独写入 dim_product_attr
-    df_product = df.copy()
-    for col in ['color_attr', 'size_attr']:
-        if col in df_product.columns:
-            df_product.drop(columns=[col], inplace=True)
-
-    df_product.to_sql(
-        name='dim_product',
-        con=engine,
-        if_exists='append',
-        index=False,
-        chunksize=5000
-    )
-
-    logger.info(f"写入完成，共 {len(df)} 条记录")
-    engine.dispose()
-
-
-def load_attr_to_mysql(df):
-    """将颜色/尺寸写入 dim_product_attr 表，便于下游使用"""
-    logger.info("开始写入 dim_product_attr...")
-    engine = create_engine(MYSQL_CONN_STR)
+def ensure_attr_table(engine):
+    """确保 dim_product_attr 存在且有 product_id 索引（旧版本以 to_sql replace 建表，无索引）"""
+    with engine.connect() as conn:
+        conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS dim_product_attr (
+                product_id BIGINT NOT NULL COMMENT '商品ID',
+                color VARCHAR(100) DEFAULT '' COMMENT '颜色',
+                size VARCHAR(100) DEFAULT '' COMMENT '尺寸',
+                KEY idx_product_id (product_id)
+            ) COMMENT='商品颜色尺寸属性'
+        """))
+        has_index = conn.execute(text("""
+            SELECT COUNT(*) FROM information_schema.STATISTICS
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'dim_product_attr' AND COLUMN_NAME = 'product_id'
+        """)).scalar() > 0
+        if not has_index:
+            logger.info("添加索引: dim_product_attr.product_id")
+            conn.execute(text("ALTER TABLE dim_product_attr ADD INDEX idx_product_id (product_id)"))
+        conn.commit()
+
+
+def load_to_mysql(frames, engine=None):
+    """加载到MySQL（全量刷新：写入影子表，校验后与 dim_product_attr 一起原子切换）
+
+    frames: 已转换的DataFrame，或DataFrame迭代器
+    engine: MySQL引擎，默认进程内共享引擎
+    线上表在加载期间保持旧数据可读；无数据或行数校验失败时不切换
+    """
 
+    engine = engine or get_mysql_engine()
+    ensure_attr_table(engine)
+    product_staging = prepare_staging(engine, 'dim_product')
+    attr_staging = prepare_staging(engine, 'dim_product_attr')
+
+    logger.info("写入影子表...")
+    total = 0
+    attr_total = 0
+    for df in as_frames(frames):
+        if df.empty:
+            continue
+        # 写入 dim_product 前，移除属性列（颜色/尺寸），属性单独写入 dim_product_attr
+        df_product = df.drop(columns=NON_TABLE_COLS, errors='ignore')
+        with engine.begin() as conn:
+            bulk_insert(conn, product_staging, df_product)
+            attr_total += load_attr_to_mysql(df, conn, table=attr_staging)
+        total += len(df)
+
+    if total == 0:
+        logger.warning("没有数据需要写入，保留线上表")
+        return
+    logger.info(f"影子表写入完成，共 {total} 条记录")
+
+    publish_staging(engine, {'dim_product': total, 'dim_product_attr': attr_total})
+
+
+def load_attr_to_mysql(df, conn, table='dim_product_attr'):
+    """将颜色/尺寸写入属性表，便于下游使用
+
+    conn: 事务内连接；table: 目标表（全量刷新时为影子表）
+    返回写入行数
+    """
     # color_attr/size_attr 来自 M_ATTRIBUTESETINSTANCE
     df_attr = df[['product_id', 'color_attr', 'size_attr']].drop_duplicates()
     # 填充空值
@@ -155,20 +205,116 @@ def load_attr_to_mysql(df):
 
     # 重命名列为通用字段名（color / size）写入目标表
     df_attr = df_attr.rename(columns={'color_attr': 'color', 'size_attr': 'size'})
-    df_attr.to_sql(
-        name='dim_product_attr',
-        con=engine,
-        if_exists='replace',
-        index=False,
-        chunksize=5000
-    )
+    return bulk_insert(conn, table, df_attr)
 
-    logger.info(f"写入完成，共 {len(df_attr)} 条记录")
-    engine.dispose()
 
+def load_incremental(df, engine=None):
+    """
+    增量加载（单事务）：
+    - 有效商品 upsert 到 dim_product
+    - 停用商品从 dim_product 删除（与全量只保留有效商品的口径一致）
+    - 变更商品的 dim_product_attr 先删后插
+    - 推进高水位（取已有高水位与本批最大修改时间的较大者，不会回退）
+    返回 (upsert数, 删除数)
+    """
+    engine = engine or get_mysql_engine()
+
+    active = df[df['is_active'] == 'Y']
+    inactive_ids = df.loc[df['is_active'] != 'Y', 'product_id'].tolist()
+    watermark = df['modified_at'].max()
+    state = get_watermark(engine, JOB_NAME)
+    previous = state['watermark_time'] if state else None
+    if pd.isna(watermark):
+        watermark = None
+    if previous is not None and (watermark is None or watermark < previous):
+        watermark = previous
+
+    df_attr = active[['product_id', 'color_attr', 'size_attr']].drop_duplicates()
+    df_attr = df_attr.fillna({'color_attr': '', 'size_attr': ''})
+    df_attr = df_attr.rename(columns={'color_attr': 'color', 'size_attr': 'size'})
+
+    with engine.begin() as conn:
+        upserted = upsert_frame(conn, 'dim_product', active.drop(columns=NON_TABLE_COLS, errors='ignore'),
+                                key_cols=['product_id'])
+        deleted = delete_keys(conn, 'dim_product', 'product_id', inactive_ids)
+        delete_keys(conn, 'dim_product_attr', 'product_id', df['product_id'].tolist())
+        bulk_insert(conn, 'dim_product_attr', df_attr)
+        set_watermark(conn, JOB_NAME, watermark_time=watermark)
+
+    logger.info(f"增量写入完成：upsert {upserted} 条，删除停用 {deleted} 条")
+    return upserted, deleted
+
+
+def resolve_mode(mode, state):
+    """确定本次加载模式：显式指定优先；auto 时无高水位或超过对账周期走全量"""
+    if mode in ('full', 'incremental'):
+        if mode == 'incremental' and (state is None or state['watermark_time'] is None):
+            logger.warning("尚无高水位，增量模式退回全量")
+            return 'full'
+        return mode
+    if state is None or state['watermark_time'] is None or state['last_full_at'] is None:
+        return 'full'
+    if datetime.now() - state['last_full_at'] >= timedelta(days=DIM_PRODUCT_FULL_RECONCILE_DAYS):
+        logger.info(f"距上次全量对账已超过 {DIM_PRODUCT_FULL_RECONCILE_DAYS} 天，执行全量对账")
+        return 'full'
+    return 'incremental'
+
+
+def plan(engine=None, mode=None):
+    """
+    确定本次加载模式及对应的抽取语句（供同步 run() 与 etl_dim_async 共用）
+    返回 (mode, sql, params)
+    """
+    engine = engine or get_mysql_engine()
+    state = get_watermark(engine, JOB_NAME)
+    mode = resolve_mode(mode or DIM_PRODUCT_LOAD_MODE, state)
+    logger.info(f"模式：{'增量upsert' if mode == 'incremental' else '全量覆盖'}")
+    if mode == 'incremental':
+        # 向前重叠 WATERMARK_OVERLAP_MINUTES 分钟，upsert幂等
+        since = state['watermark_time'] - timedelta(minutes=WATERMARK_OVERLAP_MINUTES)
+        logger.info(f"增量抽取：MODIFIEDDATE > {since}")
+        return mode, INCREMENTAL_SQL, with_categories({'since': since})
+    return mode, EXTRACT_SQL, MAIN_CATEGORY_PARAMS
+
+
+def load_frames(mode, frames, engine=None):
+    """
+    转换并加载已抽取的原始数据
+    full: 全量覆盖并重置高水位（定期对账的安全网）；incremental: 合并后增量upsert
+    """
+    engine = engine or get_mysql_engine()
+
+    if mode == 'incremental':
+        frames = [df for df in as_frames(frames) if not df.empty]
+        if not frames:
+            logger.info("无变更商品")
+            return
+        df = transform(pd.concat(frames, ignore_index=True))
+        load_incremental(df, engine)
+        return
 
-def run():
-    """执行ETL"""
+    high_marks = []
+
+    def track(frames):
+        for df in frames:
+            if not df.empty:
+                high_marks.append(df['modified_at'].max())
+            yield df
+
+    # Transform → Load（逐批流式处理，内存峰值与数据量无关）；Load 含颜色尺寸属性表
+    load_to_mysql(track(transform(df) for df in as_frames(frames)), engine)
+
+    marks = [m for m in high_marks if pd.notna(m)]
+    with engine.begin() as conn:
+        set_watermark(conn, JOB_NAME, watermark_time=max(marks) if marks else None, full=True)
+
+
+def run(engine=None, pool=None, mode=None):
+    """执行ETL
+
+    engine: MySQL引擎；pool: Oracle会话池（由 run_etl 注入，不传则使用进程内共享实例）
+    mode: 'auto' / 'incremental' / 'full'，默认 DIM_PRODUCT_LOAD_MODE
+    """
 
     start_time = datetime.now()
     logger.info("=" * 50)
@@ -176,16 +322,12 @@ def run():
     logger.info("=" * 50)
 
     try:
-        # Extract
-        df = extract_from_oracle()
-
-        # Transform
-        df = transform(df)
+        engine = engine or get_mysql_engine()
+        mode, sql, params = plan(engine, mode)
 
-        # Load
-        load_to_mysql(df)
-        # 写入颜色尺寸属性表
-        load_attr_to_mysql(df)
+        # 全量逐批流式写入；增量批次在 load_frames 中合并后一次upsert
+        frames = iter_batches(sql, params, dtypes=EXTRACT_DTYPES, pool=pool, cache=False)
+        load_frames(mode, frames, engine)
 
         end_time = datetime.now()
         duration = (end_time - start_time).seconds
@@ -202,4 +344,5 @@ def run():
 
 
 if __name__ == '__main__':
-    run()
\ No newline at end of file
+    # 可选参数：auto（默认）/ incremental / full
+    run(mode=sys.argv[1] if len(sys.argv) > 1 else None)
\ No newline at end of file
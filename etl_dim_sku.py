@@ -2,20 +2,19 @@
 """
 何方珠宝 - SKU维度ETL
 从Oracle M_PRODUCT_ALIAS同步到MySQL dim_sku
-策略：全量覆盖
+策略：行哈希合并（只写入新增/变更/删除的行，无变化时不写表）
 
 修复说明（2026-01-29）：
 - 解决Oracle保留字冲突：COLOR/SIZE → sku_color/sku_size
 - Oracle保留字不能直接用作列别名
 """
 
-import oracledb
-import pandas as pd
-from sqlalchemy import create_engine, text
 from datetime import datetime
 import logging
 
-from config import ORACLE_CONFIG, ORACLE_DSN, MYSQL_CONN_STR
+from etl_conn import get_mysql_engine
+from etl_extract import iter_batches, as_frames
+from etl_load import row_hash, merge_by_hash
 
 # 配置日志
 logging.basicConfig(
@@ -25,11 +24,8 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
-def extract_from_oracle():
-    """从Oracle抽取SKU维度数据"""
-
-    # ⚠️ 注意：COLOR/SIZE 是 Oracle 保留字，必须改为 sku_color/sku_size
-    sql = """
+# ⚠️ 注意：COLOR/SIZE 是 Oracle 保留字，必须改为 sku_color/sku_size
+EXTRACT_SQL = """
     SELECT
         pa.ID AS sku_id,
         pa.NO AS sku_barcode,
@@ -43,25 +39,22 @@ def extract_from_oracle():
     WHERE pa.ISACTIVE = 'Y'
     """
 
-    logger.info("连接Oracle数据库...")
-    conn = oracledb.connect(
-        user=ORACLE_CONFIG['user'],
-        password=ORACLE_CONFIG['password'],
-        dsn=ORACLE_DSN
-    )
 
-    logger.info("执行SQL查询...")
-    cursor = conn.cursor()
-    cursor.execute(sql)
-    columns = [col[0].lower() for col in cursor.description]
-    data = cursor.fetchall()
-    df = pd.DataFrame(data, columns=columns)
+# 参与行哈希的内容列（不含 updated_at 等ETL时间戳）
+HASH_COLS = ['sku_id', 'sku_barcode', 'product_id', 'sku_color', 'sku_size', 'is_active', 'created_at']
 
-    cursor.close()
-    conn.close()
 
-    logger.info(f"抽取完成，共 {len(df)} 条记录")
-    return df
+# 列式抽取时的列类型
+EXTRACT_DTYPES = {
+    'sku_id': 'int64',
+    'product_id': 'int64',
+}
+
+
+def extract_from_oracle(batch_size=None, fetch_mode=None, pool=None):
+    """从Oracle分批抽取SKU维度数据（生成器，每批一个DataFrame）"""
+    return iter_batches(EXTRACT_SQL, batch_size=batch_size,
+                        fetch_mode=fetch_mode, dtypes=EXTRACT_DTYPES, pool=pool)
 
 
 def transform(df):
@@ -83,42 +76,34 @@ def transform(df):
     df['sku_size'] = df['sku_size'].fillna('')  # ⚠️ 改为 sku_size
     df['is_active'] = df['is_active'].fillna('Y')
 
-    # 更新时间戳
+    # 行内容哈希（合并加载时与目标表比对）
+    df['row_hash'] = row_hash(df, HASH_COLS)
+
+    # 更新时间戳（仅新增/变更行会被写入）
     df['updated_at'] = datetime.now()
 
     logger.info(f"转换完成，共 {len(df)} 条记录")
     return df
 
 
-def load_to_mysql(df):
-    """加载到MySQL（全量覆盖）"""
+def load_to_mysql(frames, engine=None):
+    """加载到MySQL（按行哈希合并，只写入新增/变更/删除的行）
 
-    if df.empty:
-        logger.warning("没有数据需要写入")
-        return
-
-    logger.info("连接MySQL数据库...")
-    engine = create_engine(MYSQL_CONN_STR)
-
-    logger.info("清空目标表 dim_sku...")
-    with engine.begin() as conn:
-        conn.execute(text("TRUNCATE TABLE dim_sku"))
+    frames: 已转换的DataFrame，或DataFrame迭代器
+    engine: MySQL引擎，默认进程内共享引擎
+    返回 dict(inserted, updated, unchanged, deleted)
+    """
 
-    logger.info("写入数据...")
-    df.to_sql(
-        name='dim_sku',
-        con=engine,
-        if_exists='append',
-        index=False,
-        chunksize=5000
-    )
+    engine = engine or get_mysql_engine()
+    logger.info("合并写入 dim_sku...")
+    return merge_by_hash(engine, 'dim_sku', as_frames(frames), key_col='sku_id')
 
-    logger.info(f"写入完成，共 {len(df)} 条记录")
-    engine.dispose()
 
+def run(engine=None, pool=None):
+    """执行ETL
 
-def run():
-    """执行ETL"""
+    engine: MySQL引擎；pool: Oracle会话池（由 run_etl 注入，不传则使用进程内共享实例）
+    """
 
     start_time = datetime.now()
     logger.info("=" * 50)
@@ -126,9 +111,9 @@ def run():
     logger.info("=" * 50)
 
     try:
-        df = extract_from_oracle()
-        df = transform(df)
-        load_to_mysql(df)
+        # 逐批流式处理：抽取一批、转换一批、写入一批
+        frames = (transform(df) for df in extract_from_oracle(pool=pool))
+        load_to_mysql(frames, engine)
 
         end_time = datetime.now()
         duration = (end_time - start_time).seconds
@@ -2,16 +2,15 @@
 """
 何方珠宝 - 店仓维度ETL
 从Oracle C_STORE同步到MySQL dim_store
-策略：全量覆盖
+策略：行哈希合并（只写入新增/变更/删除的行，无变化时不写表）
 """
 
-import oracledb
-import pandas as pd
-from sqlalchemy import create_engine, text
 from datetime import datetime
 import logging
 
-from config import ORACLE_CONFIG, ORACLE_DSN, MYSQL_CONN_STR
+from etl_conn import get_mysql_engine
+from etl_extract import iter_batches, as_frames
+from etl_load import row_hash, merge_by_hash
 
 # 配置日志
 logging.basicConfig(
@@ -21,11 +20,8 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
-def extract_from_oracle():
-    """从Oracle抽取店仓数据"""
-
-    # 移除了不存在的CREATED和UPDATED字段
-    sql = """
+# 移除了不存在的CREATED和UPDATED字段
+EXTRACT_SQL = """
           SELECT s.ID                         AS store_id, \
                  s.CODE                       AS store_code, \
                  s.NAME                       AS store_name, \
@@ -48,25 +44,27 @@ def extract_from_oracle():
           WHERE s.ISACTIVE = 'Y' \
           """
 
-    logger.info("连接Oracle数据库...")
-    conn = oracledb.connect(
-        user=ORACLE_CONFIG['user'],
-        password=ORACLE_CONFIG['password'],
-        dsn=ORACLE_DSN
-    )
 
-    logger.info("执行SQL查询...")
-    cursor = conn.cursor()
-    cursor.execute(sql)
-    columns = [col[0].lower() for col in cursor.description]
-    data = cursor.fetchall()
-    df = pd.DataFrame(data, columns=columns)
+# 参与行哈希的内容列（不含 created_at/updated_at 等ETL时间戳）
+HASH_COLS = [
+    'store_id', 'store_code', 'store_name', 'area_id', 'area_name', 'is_warehouse',
+    'is_store', 'is_cloud_store', 'is_center', 'store_type', 'is_active'
+]
 
-    cursor.close()
-    conn.close()
 
-    logger.info(f"抽取完成，共 {len(df)} 条记录")
-    return df
+# 列式抽取时的列类型
+EXTRACT_DTYPES = {
+    'store_id': 'int64',
+    'area_id': 'Int64',
+    'is_warehouse': 'Int64',
+    'is_store': 'Int64',
+}
+
+
+def extract_from_oracle(batch_size=None, fetch_mode=None, pool=None):
+    """从Oracle分批抽取店仓数据（生成器，每批一个DataFrame）"""
+    return iter_batches(EXTRACT_SQL, batch_size=batch_size,
+                        fetch_mode=fetch_mode, dtypes=EXTRACT_DTYPES, pool=pool)
 
 
 def transform(df):
@@ -85,39 +83,37 @@ def transform(df):
     df['is_warehouse'] = df['is_warehouse'].astype('int')
     df['is_store'] = df['is_store'].astype('int')
 
-    # 添加ETL时间戳
-    df['created_at'] = datetime.now()
+    # 行内容哈希（合并加载时与目标表比对）
+    df['row_hash'] = row_hash(df, HASH_COLS)
+
+    # 添加ETL时间戳（created_at 仅新增时写入，updated_at 随变更刷新）
+    now = datetime.now()
+    df['created_at'] = now
+    df['updated_at'] = now
 
     logger.info(f"转换完成，共 {len(df)} 条记录")
     return df
 
 
-def load_to_mysql(df):
-    """加载到MySQL"""
-
-    logger.info("连接MySQL数据库...")
-    engine = create_engine(MYSQL_CONN_STR)
+def load_to_mysql(frames, engine=None):
+    """加载到MySQL（按行哈希合并，只写入新增/变更/删除的行）
 
-    # 全量覆盖
-    logger.info("清空目标表 dim_store...")
-    with engine.begin() as conn:
-        conn.execute(text("TRUNCATE TABLE dim_store"))
+    frames: 已转换的DataFrame，或DataFrame迭代器
+    engine: MySQL引擎，默认进程内共享引擎
+    返回 dict(inserted, updated, unchanged, deleted)
+    """
 
-    logger.info("写入数据...")
-    df.to_sql(
-        name='dim_store',
-        con=engine,
-        if_exists='append',
-        index=False,
-        chunksize=1000
-    )
+    engine = engine or get_mysql_engine()
+    logger.info("合并写入 dim_store...")
+    return merge_by_hash(engine, 'dim_store', as_frames(frames), key_col='store_id',
+                         insert_only_cols=('created_at',))
 
-    logger.info(f"写入完成，共 {len(df)} 条记录")
-    engine.dispose()
 
+def run(engine=None, pool=None):
+    """执行ETL
 
-def run():
-    """执行ETL"""
+    engine: MySQL引擎；pool: Oracle会话池（由 run_etl 注入，不传则使用进程内共享实例）
+    """
 
     start_time = datetime.now()
     logger.info("=" * 50)
@@ -125,14 +121,9 @@ def run():
     logger.info("=" * 50)
 
     try:
-        # Extract
-        df = extract_from_oracle()
-
-        # Transform
-        df = transform(df)
-
-        # Load
-        load_to_mysql(df)
+        # Extract → Transform → Load（逐批流式处理）
+        frames = (transform(df) for df in extract_from_oracle(pool=pool))
+        load_to_mysql(frames, engine)
 
         end_time = datetime.now()
         duration = (end_time - start_time).seconds
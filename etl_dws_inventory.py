@@ -3,15 +3,23 @@
 何方珠宝 - 库存数据ETL
 从Oracle FA_STORAGE同步到MySQL dws_inventory_daily
 策略：每日全量快照
+
+config.INVENTORY_STORAGE_MODE 为 both/delta 时，同时把快照合并进当前库存表与变更日志（etl_inventory_delta），
+delta 模式下快照只保留最近 INVENTORY_SNAPSHOT_KEEP_DAYS 天，更早日期由变更日志还原
 """
 
-import oracledb
 import pandas as pd
-from sqlalchemy import create_engine, text
+from sqlalchemy import text
 from datetime import datetime
 import logging
 
-from config import ORACLE_CONFIG, ORACLE_DSN, MYSQL_CONN_STR
+from config import INVENTORY_STORAGE_MODE
+from etl_conn import get_mysql_engine
+from etl_extract import iter_batches, as_frames
+from etl_load import bulk_insert
+from etl_inventory_delta import apply_snapshot, prune_snapshots
+from etl_partition import is_partitioned, replace_days
+from etl_queries import MAIN_CATEGORY_IN, MAIN_CATEGORY_PARAMS
 
 # 配置日志
 logging.basicConfig(
@@ -21,13 +29,10 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
-def extract_from_oracle():
-    """从Oracle抽取当前库存数据"""
-
-    # 移除了不存在的QTYOCCUPY字段
-    # ⚠️ 注意：不要过滤QTY=0的记录！Oracle原SQL没有此过滤
-    #         FA_STORAGE中QTY=0的记录仍然表示该商品在仓库中存在过/被管理
-    sql = """
+# 移除了不存在的QTYOCCUPY字段
+# ⚠️ 注意：不要过滤QTY=0的记录！Oracle原SQL没有此过滤
+#         FA_STORAGE中QTY=0的记录仍然表示该商品在仓库中存在过/被管理
+EXTRACT_SQL = f"""
     SELECT
         fs.C_STORE_ID AS store_id,
         s.CODE AS store_code,
@@ -43,40 +48,29 @@ def extract_from_oracle():
     WHERE fs.ISACTIVE = 'Y'
         AND fs.M_PRODUCTALIAS_ID IS NOT NULL
         AND (s.CODE = '001' OR s.IS_ALLO2OSTORAGE = 'Y')
-        AND p.M_DIM4_ID IN (134,142,139,138,141,143,133,136,140,137,144,145)
+        AND p.M_DIM4_ID IN ({MAIN_CATEGORY_IN})
     """
 
-    logger.info("连接Oracle数据库...")
-    conn = oracledb.connect(
-        user=ORACLE_CONFIG['user'],
-        password=ORACLE_CONFIG['password'],
-        dsn=ORACLE_DSN
-    )
 
-    logger.info("执行SQL查询...")
-    cursor = conn.cursor()
-    cursor.execute(sql)
-    columns = [col[0].lower() for col in cursor.description]
-    data = cursor.fetchall()
-    df = pd.DataFrame(data, columns=columns)
+# 列式抽取时的列类型（ID列int64，数量列float64）
+EXTRACT_DTYPES = {
+    'store_id': 'int64',
+    'product_id': 'int64',
+    'm_productalias_id': 'Int64',
+    'qty': 'float64',
+    'qty_valid': 'float64',
+    'qtypurchaserem': 'float64',
+}
 
-    cursor.close()
-    conn.close()
-
-    logger.info(f"抽取完成，共 {len(df)} 条记录")
-    return df
 
+def extract_from_oracle(batch_size=None, fetch_mode=None, pool=None):
+    """从Oracle分批抽取当前库存数据（生成器，每批一个DataFrame；实时快照，不使用抽取暂存）"""
+    return iter_batches(EXTRACT_SQL, MAIN_CATEGORY_PARAMS, batch_size=batch_size,
+                        fetch_mode=fetch_mode, dtypes=EXTRACT_DTYPES, pool=pool, cache=False)
 
-def transform(df):
-    """数据转换清洗"""
-
-    logger.info("开始数据转换...")
-
-    if df.empty:
-        logger.warning("没有数据需要处理")
-        return df
 
-    # 转换数据类型
+def _cast_batch(df):
+    """单批类型转换：尽早把Python对象列转为定长数值列，降低合并前的内存占用"""
     df['store_id'] = df['store_id'].astype('int64')
     df['product_id'] = df['product_id'].astype('int64')
     if 'm_productalias_id' in df.columns:
@@ -84,9 +78,11 @@ def transform(df):
     else:
         df['m_productalias_id'] = pd.Series([pd.NA] * len(df), dtype='Int64')
 
-    # 处理空值
-    df['qty'] = df['qty'].fillna(0)
-    df['qty_valid'] = df['qty_valid'].fillna(0)
+    # 处理空值（数量列转为数值dtype，避免逐格Python对象）
+    df['qty'] = pd.to_numeric(df['qty']).fillna(0)
+    df['qty_valid'] = pd.to_numeric(df['qty_valid']).fillna(0)
+    if 'qtypurchaserem' in df.columns:
+        df['qtypurchaserem'] = pd.to_numeric(df['qtypurchaserem']).fillna(0)
     if 'store_code' in df.columns:
         df['store_code'] = df['store_code'].fillna('')
     else:
@@ -95,6 +91,25 @@ def transform(df):
         df['is_cloud_store'] = df['is_cloud_store'].fillna('N')
     else:
         df['is_cloud_store'] = 'N'
+    return df
+
+
+def transform(frames):
+    """数据转换清洗
+
+    frames: 抽取的DataFrame，或DataFrame迭代器。
+    逐批完成类型转换后再合并：去重需要全量视角（重复键可能跨批），
+    但合并的是已转为数值类型的紧凑列，而非原始元组。
+    """
+
+    logger.info("开始数据转换...")
+
+    batches = [_cast_batch(df) for df in as_frames(frames) if not df.empty]
+    if not batches:
+        logger.warning("没有数据需要处理")
+        return pd.DataFrame()
+    df = pd.concat(batches, ignore_index=True)
+    del batches
 
     # 去重：如果同一个(store_id, product_id, m_productalias_id)有多条记录，合并数量与在途采购欠数
     duplicate_count = len(df) - len(df.groupby(['store_id', 'product_id', 'm_productalias_id']).size())
@@ -125,42 +140,43 @@ def transform(df):
     return df
 
 
-def load_to_mysql(df):
+def load_to_mysql(df, engine=None):
     """加载到MySQL（当日快照覆盖）
 
     将删除与写入置于同一事务中，异常自动回滚，避免连接处于无效事务状态。
+    表已按天分区时写入交换表后交换当天分区（etl_partition.replace_days）
+    engine: MySQL引擎，默认进程内共享引擎
     """
 
     if df.empty:
         logger.warning("没有数据需要写入")
         return
 
-    logger.info("连接MySQL数据库...")
-    engine = create_engine(MYSQL_CONN_STR)
+    engine = engine or get_mysql_engine()
 
     today = int(datetime.now().strftime('%Y%m%d'))
 
-    try:
-        logger.info(f"删除当天旧数据（{today}）并写入新数据（单事务）...")
-        # 使用同一事务执行删除与批量插入；若中途失败，SQLAlchemy将回滚事务
-        with engine.begin() as conn:
-            conn.execute(text("DELETE FROM dws_inventory_daily WHERE date_id = :d"), {"d": today})
-            df.to_sql(
-                name='dws_inventory_daily',
-                con=conn,
-                if_exists='append',
-                index=False,
-                chunksize=5000,
-                method=None  # 走默认插入方式以保证事务一致性
-            )
-
+    if is_partitioned(engine, 'dws_inventory_daily'):
+        logger.info(f"写入交换表并替换当天分区（{today}）...")
+        replace_days(engine, 'dws_inventory_daily', df, today, today)
         logger.info(f"写入完成，共 {len(df)} 条记录")
-    finally:
-        engine.dispose()
+        return
 
+    logger.info(f"删除当天旧数据（{today}）并写入新数据（单事务）...")
+    # 使用同一事务执行删除与批量插入；若中途失败，SQLAlchemy将回滚事务
+    with engine.begin() as conn:
+        conn.execute(text("DELETE FROM dws_inventory_daily WHERE date_id = :d"), {"d": today})
+        # LOAD DATA LOCAL INFILE 批量载入（不可用时退回 to_sql），与删除同一事务
+        bulk_insert(conn, 'dws_inventory_daily', df)
 
-def run():
-    """执行ETL"""
+    logger.info(f"写入完成，共 {len(df)} 条记录")
+
+
+def run(engine=None, pool=None):
+    """执行ETL
+
+    engine: MySQL引擎；pool: Oracle会话池（由 run_etl 注入，不传则使用进程内共享实例）
+    """
 
     start_time = datetime.now()
     logger.info("=" * 50)
@@ -168,14 +184,17 @@ def run():
     logger.info("=" * 50)
 
     try:
-        # Extract
-        df = extract_from_oracle()
-
-        # Transform
-        df = transform(df)
+        # Extract + Transform（逐批类型转换后合并去重）
+        df = transform(extract_from_oracle(pool=pool))
 
         # Load
-        load_to_mysql(df)
+        load_to_mysql(df, engine)
+
+        # 当前库存 + 变更日志
+        if INVENTORY_STORAGE_MODE in ('both', 'delta') and not df.empty:
+            apply_snapshot(df, int(df['date_id'].iloc[0]), engine)
+            if INVENTORY_STORAGE_MODE == 'delta':
+                prune_snapshots(engine)
 
         end_time = datetime.now()
         duration = (end_time - start_time).seconds
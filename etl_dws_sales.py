@@ -3,16 +3,33 @@
 何方珠宝 - 销售数据ETL
 从Oracle M_RETAIL/M_RETAILITEM同步到MySQL dws_sales_daily
 策略：增量同步（按日期）
+
+数据来源（config.DWS_SALES_SOURCE）：
+- ods：由 etl_ods_retail 落地的 ods_m_retail/ods_m_retailitem 在MySQL内聚合（rebuild_from_ods），不占用ERP
+- oracle：在Oracle端聚合后抽取（extract_from_oracle），历史补数（backfill）始终走此路径
+
+写入方式（config.DWS_SALES_LOAD_MODE）：
+- merge：按唯一键 uk_sales_grain(date_id, store_id, product_id, m_productalias_id) 比对行哈希，
+         只 upsert 新增/变更行，显式删除源端已消失的行；日内多次同步时写入量与变更量成正比
+- replace：按日期范围先删后插（分区表为交换分区）；历史补数始终走此路径
 """
 
-import oracledb
 import pandas as pd
-from sqlalchemy import create_engine, text
+from sqlalchemy import text
 from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import logging
 import sys
 
-from config import ORACLE_CONFIG, ORACLE_DSN, MYSQL_CONN_STR
+from config import (
+    BACKFILL_WORKERS, BACKFILL_PARTITION, DWS_SALES_SOURCE, DWS_SALES_LOAD_MODE, LOAD_WORKERS, LOAD_SHARD_ROWS
+)
+from etl_conn import get_mysql_engine
+from etl_extract import iter_batches, nonempty_frames, exceeds_rows
+from etl_queries import SALES_DAILY_SQL, MAIN_CATEGORY_IN, sales_daily_params
+from etl_load import bulk_insert, parallel_load, publish_load, drop_load_table, merge_by_hash, row_hash
+from etl_partition import is_partitioned, replace_days, rebuild_days, ensure_partitions
+from etl_runlog import count_rows
 
 # 配置日志
 logging.basicConfig(
@@ -22,59 +39,42 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
-def extract_from_oracle(start_date, end_date):
-    """从Oracle抽取销售数据"""
-    
-    sql = f"""
-    SELECT
-        r.BILLDATE AS date_id,
-        r.C_STORE_ID AS store_id,
-        s.CODE AS store_code,
-        NVL(s.IS_ALLO2OSTORAGE, 'N') AS is_cloud_store,
-        ri.M_PRODUCT_ID AS product_id,
-        ri.M_PRODUCTALIAS_ID AS m_productalias_id,
-        -- 销售数据（正单）
-        SUM(CASE WHEN r.TOT_AMT_ACTUAL > 0 THEN ri.QTY ELSE 0 END) AS sales_qty,
-        SUM(CASE WHEN r.TOT_AMT_ACTUAL > 0 THEN ri.TOT_AMT_ACTUAL ELSE 0 END) AS sales_amount,
-        SUM(CASE WHEN r.TOT_AMT_ACTUAL > 0 THEN ri.TOT_AMT_LIST ELSE 0 END) AS sales_amount_list,
-        -- 退货数据（负单）
-        SUM(CASE WHEN r.TOT_AMT_ACTUAL < 0 THEN ABS(ri.QTY) ELSE 0 END) AS return_qty,
-        SUM(CASE WHEN r.TOT_AMT_ACTUAL < 0 THEN ABS(ri.TOT_AMT_ACTUAL) ELSE 0 END) AS return_amount,
-        -- 订单数
-        COUNT(DISTINCT CASE WHEN r.TOT_AMT_ACTUAL > 0 THEN r.ID END) AS order_count
-    FROM M_RETAILITEM ri
-    LEFT JOIN M_RETAIL r ON ri.M_RETAIL_ID = r.ID
-    LEFT JOIN C_STORE s ON r.C_STORE_ID = s.ID
-    LEFT JOIN M_PRODUCT p ON ri.M_PRODUCT_ID = p.ID
-    WHERE r.ISACTIVE = 'Y' 
-        AND r.STATUS = 2
-        AND r.BILLDATE >= {start_date}
-        AND r.BILLDATE <= {end_date}
-        AND ri.M_PRODUCTALIAS_ID IS NOT NULL
-        AND (s.CODE LIKE 'DS%' OR s.IS_ALLO2OSTORAGE = 'Y')
-        AND p.M_DIM4_ID IN (134,142,139,138,141,143,133,136,140,137,144,145)
-    GROUP BY r.BILLDATE, r.C_STORE_ID, s.CODE, NVL(s.IS_ALLO2OSTORAGE, 'N'), ri.M_PRODUCT_ID, ri.M_PRODUCTALIAS_ID
-    """
-    
-    logger.info("连接Oracle数据库...")
-    conn = oracledb.connect(
-        user=ORACLE_CONFIG['user'],
-        password=ORACLE_CONFIG['password'],
-        dsn=ORACLE_DSN
-    )
-    
-    logger.info(f"执行SQL查询（日期范围：{start_date} - {end_date}）...")
-    cursor = conn.cursor()
-    cursor.execute(sql)
-    columns = [col[0].lower() for col in cursor.description]
-    data = cursor.fetchall()
-    df = pd.DataFrame(data, columns=columns)
-    
-    cursor.close()
-    conn.close()
-    
-    logger.info(f"抽取完成，共 {len(df)} 条记录")
-    return df
+# 列式抽取时的列类型（ID列int64，数量金额float64）
+EXTRACT_DTYPES = {
+    'date_id': 'int64',
+    'store_id': 'int64',
+    'product_id': 'int64',
+    'm_productalias_id': 'Int64',
+    'sales_qty': 'float64',
+    'sales_amount': 'float64',
+    'sales_amount_list': 'float64',
+    'return_qty': 'float64',
+    'return_amount': 'float64',
+    'order_count': 'int64',
+}
+
+
+# 业务粒度（唯一键 uk_sales_grain；分区表的唯一键须包含分区列 date_id）
+GRAIN_COLS = ['date_id', 'store_id', 'product_id', 'm_productalias_id']
+UNIQUE_KEY = 'uk_sales_grain'
+
+# 参与行哈希的内容列（不含 etl_time）
+HASH_COLS = ['store_code', 'is_cloud_store', 'sales_qty', 'sales_amount', 'sales_amount_list',
+             'return_qty', 'return_amount', 'order_count']
+
+
+def extract_from_oracle(start_date, end_date, batch_size=None, fetch_mode=None, pool=None, cache=None):
+    """从Oracle分批抽取销售数据（生成器，每批一个DataFrame）
+
+    SQL已在Oracle端按(日期,店仓,SKU)聚合，批间无重复键，可逐批写入。
+    日期范围与类别均为绑定变量（etl_queries），不同日期范围共用同一游标。
+    只有截止到昨天及以前的日期范围使用抽取暂存（含当天的结果仍在变化）；cache=False 时强制重新抽取。
+    """
+    logger.info(f"抽取销售数据（日期范围：{start_date} - {end_date}）...")
+    if cache is None:
+        cache = int(end_date) < int(datetime.now().strftime('%Y%m%d'))
+    return iter_batches(SALES_DAILY_SQL, sales_daily_params(start_date, end_date), batch_size=batch_size,
+                        fetch_mode=fetch_mode, dtypes=EXTRACT_DTYPES, pool=pool, cache=cache)
 
 
 def transform(df):
@@ -117,41 +117,234 @@ def transform(df):
     return df
 
 
-def load_to_mysql(df, start_date, end_date):
-    """加载到MySQL（增量：先删后插）"""
+def load_to_mysql(frames, start_date, end_date, engine=None, workers=None):
+    """加载到MySQL（增量：先删后插，删除与逐批写入在同一事务内）
+
+    表已按天分区时改为逐天交换分区（etl_partition.replace_days），不再执行范围DELETE
+    frames: 已转换的DataFrame，或DataFrame迭代器
+    engine: MySQL引擎，默认进程内共享引擎
+    workers: 并行写入连接数，默认 LOAD_WORKERS；大于1且数据超过 LOAD_SHARD_ROWS 行（至少两个分片）时
+             先经多连接并行写入临时表（etl_load.parallel_load），再单事务 INSERT ... SELECT 发布；
+             单天修补等小批量直接写入
+    返回写入行数
+    """
     
-    if df.empty:
+    frames = nonempty_frames(frames)
+    if frames is None:
         logger.warning("没有数据需要写入")
-        return
+        return 0
+    
+    engine = engine or get_mysql_engine()
+    workers = workers or LOAD_WORKERS
+
+    if workers > 1:
+        large, frames = exceeds_rows(frames, LOAD_SHARD_ROWS)
+        if large:
+            return _load_parallel(frames, start_date, end_date, engine, workers)
+
+    if is_partitioned(engine, 'dws_sales_daily'):
+        logger.info(f"按天交换分区写入（{start_date} - {end_date}）...")
+        total = replace_days(engine, 'dws_sales_daily', frames, start_date, end_date)
+        logger.info(f"写入完成，共 {total} 条记录")
+        return total
     
-    logger.info("连接MySQL数据库...")
-    engine = create_engine(MYSQL_CONN_STR)
+    with engine.begin() as conn:
+        # 先删除该日期范围的旧数据
+        logger.info(f"删除旧数据（{start_date} - {end_date}）...")
+        conn.execute(text(
+            "DELETE FROM dws_sales_daily WHERE date_id >= :start_date AND date_id <= :end_date"
+        ), {"start_date": start_date, "end_date": end_date})
+        
+        logger.info("写入新数据...")
+        total = 0
+        for df in frames:
+            if df.empty:
+                continue
+            bulk_insert(conn, 'dws_sales_daily', df)
+            total += len(df)
     
+    logger.info(f"写入完成，共 {total} 条记录")
+    return total
+
+
+def _load_parallel(frames, start_date, end_date, engine, workers):
+    """多连接并行写入临时表后发布：未分区表单事务先删后 INSERT ... SELECT，分区表按天写入交换表后交换分区"""
+    logger.info(f"并行写入临时表（{workers} 个连接）...")
+    run_table, columns, shards = parallel_load(engine, 'dws_sales_daily', frames, workers=workers)
     try:
-        with engine.begin() as conn:
-            # 先删除该日期范围的旧数据
-            logger.info(f"删除旧数据（{start_date} - {end_date}）...")
-            conn.execute(text(f"DELETE FROM dws_sales_daily WHERE date_id >= {start_date} AND date_id <= {end_date}"))
-            
-            logger.info("写入新数据...")
-            df.to_sql(
-                name='dws_sales_daily',
-                con=conn,
-                if_exists='append',
-                index=False,
-                chunksize=5000
-            )
-        
-        logger.info(f"写入完成，共 {len(df)} 条记录")
+        if is_partitioned(engine, 'dws_sales_daily'):
+            def fill(conn, table, day_start, day_end):
+                return publish_load(conn, table, run_table, columns,
+                                    where="date_id >= :start_date AND date_id <= :end_date",
+                                    params={"start_date": day_start, "end_date": day_end})
+
+            logger.info(f"按天交换分区发布（{start_date} - {end_date}）...")
+            total = rebuild_days(engine, 'dws_sales_daily', start_date, end_date, fill)
+        else:
+            with engine.begin() as conn:
+                logger.info(f"删除旧数据（{start_date} - {end_date}）并由临时表发布（单事务）...")
+                conn.execute(text(
+                    "DELETE FROM dws_sales_daily WHERE date_id >= :start_date AND date_id <= :end_date"
+                ), {"start_date": start_date, "end_date": end_date})
+                total = publish_load(conn, 'dws_sales_daily', run_table, columns)
     finally:
-        engine.dispose()
+        drop_load_table(engine, run_table)
+
+    logger.info(f"写入完成，共 {total} 条记录（{len(shards)} 个分片）")
+    return total
 
 
-def run(days_back=1, include_today=False):
+# 由ODS聚合：口径与 extract_from_oracle（SALES_DAILY_SQL）一致，绑定 :start_date / :end_date 与类别
+# 店仓编码/云仓标记、商品类别取 ods_c_store / ods_m_product（含停用记录，
+# dim_store/dim_product 只保留启用记录，关联维度表会丢失之后停用的店仓/商品的历史销售）
+REBUILD_SELECT_SQL = f"""
+    SELECT
+        r.billdate AS date_id,
+        r.c_store_id AS store_id,
+        s.code AS store_code,
+        COALESCE(s.is_allo2ostorage, 'N') AS is_cloud_store,
+        ri.m_product_id AS product_id,
+        ri.m_productalias_id,
+        -- 销售数据（正单）
+        SUM(CASE WHEN r.tot_amt_actual > 0 THEN ri.qty ELSE 0 END) AS sales_qty,
+        SUM(CASE WHEN r.tot_amt_actual > 0 THEN ri.tot_amt_actual ELSE 0 END) AS sales_amount,
+        SUM(CASE WHEN r.tot_amt_actual > 0 THEN ri.tot_amt_list ELSE 0 END) AS sales_amount_list,
+        -- 退货数据（负单）
+        SUM(CASE WHEN r.tot_amt_actual < 0 THEN ABS(ri.qty) ELSE 0 END) AS return_qty,
+        SUM(CASE WHEN r.tot_amt_actual < 0 THEN ABS(ri.tot_amt_actual) ELSE 0 END) AS return_amount,
+        -- 订单数
+        COUNT(DISTINCT CASE WHEN r.tot_amt_actual > 0 THEN r.id END) AS order_count,
+        NOW() AS etl_time
+    FROM ods_m_retailitem ri
+    JOIN ods_m_retail r ON ri.m_retail_id = r.id
+    LEFT JOIN ods_c_store s ON r.c_store_id = s.id
+    LEFT JOIN ods_m_product p ON ri.m_product_id = p.id
+    WHERE r.isactive = 'Y'
+        AND r.status = 2
+        AND r.billdate BETWEEN :start_date AND :end_date
+        AND ri.m_productalias_id IS NOT NULL
+        AND (s.code LIKE 'DS%%' OR s.is_allo2ostorage = 'Y')
+        AND p.m_dim4_id IN ({MAIN_CATEGORY_IN})
+    GROUP BY r.billdate, r.c_store_id, s.code, COALESCE(s.is_allo2ostorage, 'N'),
+             ri.m_product_id, ri.m_productalias_id
+    """
+
+# 由ODS重建（replace）；{table}：目标表（dws_sales_daily，分区表按天重建时为交换表）
+REBUILD_SQL = """
+    INSERT INTO {table}
+        (date_id, store_id, store_code, is_cloud_store, product_id, m_productalias_id,
+         sales_qty, sales_amount, sales_amount_list, return_qty, return_amount, order_count, etl_time)
+""" + REBUILD_SELECT_SQL
+
+
+def rebuild_from_ods(start_date, end_date, engine=None):
+    """
+    在MySQL内由ODS重建日期范围的 dws_sales_daily（先删后插，单事务，不访问Oracle）
+    表已按天分区时逐天写入交换表后交换分区
+    返回写入行数
+    """
+    engine = engine or get_mysql_engine()
+    params = sales_daily_params(start_date, end_date)
+
+    if is_partitioned(engine, 'dws_sales_daily'):
+        def fill(conn, table, day_start, day_end):
+            rows = conn.execute(text(REBUILD_SQL.format(table=table)),
+                                sales_daily_params(day_start, day_end)).rowcount
+            count_rows(written=rows)
+            return rows
+
+        logger.info(f"由ODS按天重建分区（{start_date} - {end_date}）...")
+        total = rebuild_days(engine, 'dws_sales_daily', start_date, end_date, fill)
+        logger.info(f"写入完成，共 {total} 条记录")
+        return total
+
+    with engine.begin() as conn:
+        logger.info(f"删除旧数据（{start_date} - {end_date}）...")
+        conn.execute(text(
+            "DELETE FROM dws_sales_daily WHERE date_id >= :start_date AND date_id <= :end_date"
+        ), params)
+
+        logger.info("由ODS聚合写入...")
+        total = conn.execute(text(REBUILD_SQL.format(table='dws_sales_daily')), params).rowcount
+        count_rows(written=total)
+
+    logger.info(f"写入完成，共 {total} 条记录")
+    return total
+
+
+def ensure_unique_key(engine):
+    """
+    确保业务粒度唯一键存在（merge 写入依赖 ON DUPLICATE KEY UPDATE）
+    已有重复数据导致建键失败时返回False，调用方退回 replace
+    """
+    with engine.connect() as conn:
+        exists = conn.execute(text("""
+            SELECT COUNT(*) FROM information_schema.STATISTICS
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'dws_sales_daily' AND INDEX_NAME = :idx
+        """), {"idx": UNIQUE_KEY}).scalar() > 0
+    if exists:
+        return True
+    logger.info(f"添加唯一键: dws_sales_daily.{UNIQUE_KEY}({', '.join(GRAIN_COLS)})")
+    try:
+        with engine.begin() as conn:
+            conn.execute(text(
+                f"ALTER TABLE dws_sales_daily ADD UNIQUE KEY {UNIQUE_KEY} ({', '.join(GRAIN_COLS)})"
+            ))
+    except Exception as e:
+        logger.error(f"唯一键创建失败（可能存在重复粒度数据，需先按日期重跑 replace 清理）: {e}")
+        return False
+    return True
+
+
+def _with_hash(df):
+    """计算行哈希（数量金额统一为float，ODS与Oracle两种来源的哈希一致）"""
+    if df.empty:
+        return df
+    measures = ['sales_qty', 'sales_amount', 'sales_amount_list', 'return_qty', 'return_amount']
+    df[measures] = df[measures].astype('float64')
+    df['order_count'] = df['order_count'].astype('int64')
+    df['row_hash'] = row_hash(df, HASH_COLS)
+    return df
+
+
+def merge_to_mysql(frames, start_date, end_date, engine=None):
+    """
+    按唯一键合并加载（单事务）
+    只读取目标表日期范围内的 键+行哈希 做比对：新增/变更行批量 INSERT ... ON DUPLICATE KEY UPDATE，
+    范围内源端已消失的行按键删除（源端范围内已无数据时删除范围内全部行），未变化的行不写入
+    frames: 已转换的DataFrame或迭代器
+    返回 dict(inserted, updated, unchanged, deleted)
+    """
+    engine = engine or get_mysql_engine()
+    if not ensure_unique_key(engine):
+        logger.warning("唯一键不可用，本次改为 replace 写入")
+        return load_to_mysql(frames, start_date, end_date, engine)
+
+    logger.info(f"按唯一键合并写入（{start_date} - {end_date}）...")
+    return merge_by_hash(
+        engine, 'dws_sales_daily', (_with_hash(df) for df in frames), GRAIN_COLS,
+        where="date_id >= :start_date AND date_id <= :end_date",
+        params={"start_date": start_date, "end_date": end_date}
+    )
+
+
+def merge_from_ods(start_date, end_date, engine=None):
+    """由ODS聚合后按唯一键合并写入（聚合结果为日期范围内的 日期×店仓×SKU，可整体载入内存）"""
+    engine = engine or get_mysql_engine()
+    logger.info(f"由ODS聚合（{start_date} - {end_date}）...")
+    with engine.connect() as conn:
+        df = pd.read_sql(text(REBUILD_SELECT_SQL), conn, params=sales_daily_params(start_date, end_date))
+    return merge_to_mysql(transform(df), start_date, end_date, engine)
+
+
+def run(days_back=1, include_today=False, engine=None, pool=None, source=None):
     """
     执行ETL（智能判断模式）
     days_back: 回溯天数，默认1（只同步昨天/今天）
     include_today: 是否启用智能模式，默认False
+    engine/pool: MySQL引擎与Oracle会话池（由 run_etl 注入，不传则使用进程内共享实例）
+    source: 'ods' / 'oracle'，默认 DWS_SALES_SOURCE
+    写入方式按 DWS_SALES_LOAD_MODE（merge / replace）
     """
     
     start_time = datetime.now()
@@ -184,14 +377,20 @@ def run(days_back=1, include_today=False):
     logger.info(f"同步日期范围：{start_date} - {end_date}")
     
     try:
-        # Extract
-        df = extract_from_oracle(start_date, end_date)
-        
-        # Transform
-        df = transform(df)
-        
-        # Load
-        load_to_mysql(df, start_date, end_date)
+        merge = DWS_SALES_LOAD_MODE == 'merge'
+        if (source or DWS_SALES_SOURCE) == 'ods':
+            # 由ODS重建（ODS需先由 etl_ods_retail 落地）
+            if merge:
+                merge_from_ods(start_date, end_date, engine)
+            else:
+                rebuild_from_ods(start_date, end_date, engine)
+        else:
+            # Extract → Transform → Load（逐批流式处理，内存峰值与日期范围无关）
+            frames = (transform(df) for df in extract_from_oracle(start_date, end_date, pool=pool))
+            if merge:
+                merge_to_mysql(frames, start_date, end_date, engine)
+            else:
+                load_to_mysql(frames, start_date, end_date, engine)
         
         end_time = datetime.now()
         duration = (end_time - start_time).seconds
@@ -207,21 +406,30 @@ def run(days_back=1, include_today=False):
         raise
 
 
-def backfill(start_date, end_date):
+def backfill(start_date, end_date, parallel=False, partition=None, workers=None, resume=True,
+             engine=None, pool=None, cache=None):
     """
     补数函数：补历史数据
     start_date: 开始日期，格式YYYYMMDD
     end_date: 结束日期，格式YYYYMMDD
+    parallel: 是否启用分区并行模式（默认False，整段单事务）
+    partition: 分区粒度 'day' / 'week'，默认 BACKFILL_PARTITION
+    workers: 并发Oracle会话数，默认 BACKFILL_WORKERS
+    resume: 并行模式下跳过同一回补任务中已成功的分区（失败后重跑即续传）
+    engine/pool: MySQL引擎与Oracle会话池，默认进程内共享实例
+    cache: 是否使用抽取暂存（单事务模式），默认截止到昨天的范围使用；False 强制重新抽取
     """
+    if parallel:
+        return backfill_parallel(start_date, end_date, partition, workers, resume, engine, pool)
+
     start_time = datetime.now()
     logger.info("="*50)
     logger.info(f"开始补数：{start_date} - {end_date}")
     logger.info("="*50)
     
     try:
-        df = extract_from_oracle(start_date, end_date)
-        df = transform(df)
-        load_to_mysql(df, start_date, end_date)
+        frames = (transform(df) for df in extract_from_oracle(start_date, end_date, pool=pool, cache=cache))
+        load_to_mysql(frames, start_date, end_date, engine)
         
         end_time = datetime.now()
         duration = (end_time - start_time).seconds
@@ -232,11 +440,137 @@ def backfill(start_date, end_date):
         raise
 
 
+def split_date_range(start_date, end_date, partition='day'):
+    """把 [start_date, end_date] 切分为按天/按周的闭区间列表 [(起, 止), ...]"""
+    step = {'day': 1, 'week': 7}[partition]
+    cur = datetime.strptime(str(start_date), '%Y%m%d')
+    last = datetime.strptime(str(end_date), '%Y%m%d')
+    parts = []
+    while cur <= last:
+        part_end = min(cur + timedelta(days=step - 1), last)
+        parts.append((int(cur.strftime('%Y%m%d')), int(part_end.strftime('%Y%m%d'))))
+        cur = part_end + timedelta(days=1)
+    return parts
+
+
+def ensure_progress_table(engine):
+    """确保分区回补进度表存在"""
+    with engine.begin() as conn:
+        conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS etl_backfill_progress (
+                backfill_id VARCHAR(64) NOT NULL COMMENT '回补任务ID（表_起_止_粒度）',
+                partition_start INT NOT NULL COMMENT '分区开始日期',
+                partition_end INT NOT NULL COMMENT '分区结束日期',
+                status VARCHAR(20) NOT NULL COMMENT 'RUNNING/SUCCESS/FAILED',
+                rows_written INT DEFAULT 0 COMMENT '写入行数',
+                error_message TEXT COMMENT '错误信息',
+                updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+                PRIMARY KEY (backfill_id, partition_start)
+            ) COMMENT='分区回补进度'
+        """))
+
+
+def _record_progress(engine, backfill_id, part, status, rows=0, error=None):
+    """记录单个分区的回补状态"""
+    with engine.begin() as conn:
+        conn.execute(text("""
+            INSERT INTO etl_backfill_progress
+                (backfill_id, partition_start, partition_end, status, rows_written, error_message)
+            VALUES (:bid, :ps, :pe, :status, :rows, :err)
+            ON DUPLICATE KEY UPDATE
+                partition_end = VALUES(partition_end), status = VALUES(status),
+                rows_written = VALUES(rows_written), error_message = VALUES(error_message)
+        """), {"bid": backfill_id, "ps": part[0], "pe": part[1],
+               "status": status, "rows": rows, "err": error})
+
+
+def _backfill_partition(part, engine, pool):
+    """回补单个分区：独立Oracle会话抽取，独立MySQL事务先删后插
+
+    分区之间已并行，分区内单连接写入，避免 并发分区数 × LOAD_WORKERS 超出MySQL连接池
+    """
+    frames = (transform(df) for df in extract_from_oracle(part[0], part[1], pool=pool))
+    return load_to_mysql(frames, part[0], part[1], engine, workers=1)
+
+
+def backfill_parallel(start_date, end_date, partition=None, workers=None, resume=True,
+                      engine=None, pool=None):
+    """
+    分区并行补数
+    按天/周切分日期范围，最多 workers 个分区同时抽取（即最多 workers 个Oracle会话），
+    每个分区单独提交并记录进度；重跑相同参数时只处理未成功的分区。
+    并发会话从共享会话池借出，池上限（ORACLE_POOL_MAX）同样约束并发。
+    """
+    partition = partition or BACKFILL_PARTITION
+    workers = workers or BACKFILL_WORKERS
+    backfill_id = f"dws_sales_{start_date}_{end_date}_{partition}"
+
+    start_time = datetime.now()
+    logger.info("="*50)
+    logger.info(f"开始并行补数：{start_date} - {end_date}（粒度={partition}，并发={workers}）")
+    logger.info("="*50)
+
+    engine = engine or get_mysql_engine()
+    ensure_progress_table(engine)
+    # 分区表：派发前一次性建好范围内的日分区，避免各线程并发重组分区
+    ensure_partitions(engine, 'dws_sales_daily', end_date)
+
+    parts = split_date_range(start_date, end_date, partition)
+    if resume:
+        with engine.connect() as conn:
+            done = {row[0] for row in conn.execute(text(
+                "SELECT partition_start FROM etl_backfill_progress "
+                "WHERE backfill_id = :bid AND status = 'SUCCESS'"
+            ), {"bid": backfill_id})}
+        if done:
+            logger.info(f"续传：跳过已完成的 {len(done)} 个分区")
+        parts = [p for p in parts if p[0] not in done]
+
+    logger.info(f"待处理分区 {len(parts)} 个")
+    failed = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {}
+        for part in parts:
+            _record_progress(engine, backfill_id, part, 'RUNNING')
+            futures[executor.submit(_backfill_partition, part, engine, pool)] = part
+        for future in as_completed(futures):
+            part = futures[future]
+            try:
+                rows = future.result()
+                count_rows(written=rows)  # 分区在工作线程内写入，由调度线程计入
+                _record_progress(engine, backfill_id, part, 'SUCCESS', rows=rows)
+                logger.info(f"分区 {part[0]} - {part[1]} 完成，写入 {rows} 条")
+            except Exception as e:
+                failed.append(part)
+                _record_progress(engine, backfill_id, part, 'FAILED', error=str(e)[:2000])
+                logger.error(f"分区 {part[0]} - {part[1]} 失败: {e}")
+
+    duration = (datetime.now() - start_time).seconds
+    if failed:
+        logger.error(f"✗ 并行补数未完成：{len(failed)} 个分区失败，重跑相同参数即可续传")
+        raise RuntimeError(f"{len(failed)} 个分区回补失败: {sorted(failed)}")
+    logger.info(f"✓ 并行补数完成！耗时 {duration} 秒")
+
+
 if __name__ == '__main__':
     # 默认同步昨天数据
     # 如需补历史，使用: backfill(20260101, 20260113)
+    # 并行分区补数：python etl_dws_sales.py backfill 20251102 20260130 [day|week] [并发数]
+    # 由ODS重建（不访问Oracle）：python etl_dws_sales.py rebuild 20260101 20260113
+    # 加 --refresh 忽略抽取暂存，强制重新查询Oracle
     
-    if len(sys.argv) > 1:
+    if '--refresh' in sys.argv:
+        from etl_stage import configure as configure_stage
+        configure_stage(refresh=True)
+        sys.argv.remove('--refresh')
+
+    if len(sys.argv) > 3 and sys.argv[1] == 'backfill':
+        backfill(int(sys.argv[2]), int(sys.argv[3]), parallel=True,
+                 partition=sys.argv[4] if len(sys.argv) > 4 else None,
+                 workers=int(sys.argv[5]) if len(sys.argv) > 5 else None)
+    elif len(sys.argv) > 3 and sys.argv[1] == 'rebuild':
+        rebuild_from_ods(int(sys.argv[2]), int(sys.argv[3]))
+    elif len(sys.argv) > 1:
         # 支持命令行指定回溯天数
         days = int(sys.argv[1])
         run(days_back=days)
@@ -0,0 +1,300 @@
+# -*- coding: utf-8 -*-
+"""
+何方珠宝 - Oracle流式抽取（公共模块）
+各 etl_* 模块共用：按批 fetchmany 生成 DataFrame，替代 fetchall 一次性载入
+策略：调优 arraysize/prefetchrows，单批行数可配置，内存峰值与日期范围无关
+
+抽取结果同时写入本地Parquet暂存（etl_stage），有效期内相同查询直接读取暂存，不访问Oracle。
+
+抽取模式（config.ORACLE_FETCH_MODE，或调用时 fetch_mode 参数）：
+- tuple：逐行元组构建DataFrame，类型在各模块 transform() 中再转换
+- arrow：列式抽取。oracledb 3.x 走 Connection.fetch_df_batches（Arrow列存），
+         否则退回按列类型累积（每个 arraysize 块立即转为定长数组），无逐格Python对象常驻
+"""
+
+import itertools
+import logging
+
+import numpy as np
+import pandas as pd
+
+from config import (
+    ORACLE_FETCH_ARRAYSIZE, ORACLE_PREFETCH_ROWS, EXTRACT_BATCH_SIZE,
+    ORACLE_FETCH_MODE
+)
+from etl_conn import get_oracle_pool
+from etl_runlog import count_rows
+import etl_stage
+
+try:
+    import pyarrow
+except ImportError:  # pyarrow 为可选依赖，仅 arrow 模式需要
+    pyarrow = None
+
+logger = logging.getLogger(__name__)
+
+
+def iter_batches(sql, params=None, batch_size=None, conn=None, fetch_mode=None, dtypes=None, pool=None,
+                 cache=None):
+    """
+    流式执行查询，按批生成DataFrame（生成器）
+    sql: 查询语句
+    params: 绑定变量（dict/list），无则None
+    batch_size: 每批行数，默认 EXTRACT_BATCH_SIZE
+    conn: 已有Oracle连接；不传则从会话池借出，迭代结束后归还
+    pool: Oracle会话池，默认进程内共享池（etl_conn.get_oracle_pool）
+    fetch_mode: 'tuple' / 'arrow'，默认 ORACLE_FETCH_MODE
+    dtypes: {列名: dtype}，列式模式下按此类型直接构建列（如ID列'int64'、可空ID列'Int64'）
+    cache: 是否使用抽取暂存（需显式 True 且全局开关开启；只用于结果不再变化的查询），默认不使用
+
+    查询无结果时生成一个带列名的空DataFrame，便于下游按原逻辑判空。
+    """
+    fetch_mode = fetch_mode or ORACLE_FETCH_MODE
+    if not etl_stage.is_enabled(cache):
+        yield from _counted(_fetch_batches(sql, params, batch_size, conn, fetch_mode, dtypes, pool))
+        return
+
+    key = etl_stage.query_key(sql, params, fetch_mode)
+    cached = etl_stage.lookup(key)
+    if cached:
+        yield from _counted(etl_stage.read_batches(cached))
+        return
+
+    # 边抽取边暂存；全部批次被消费后才标记完整（下游中途失败时丢弃）
+    path = etl_stage.begin(key)
+    committed = False
+    try:
+        for batch_no, df in enumerate(_fetch_batches(sql, params, batch_size, conn, fetch_mode, dtypes, pool)):
+            etl_stage.write_batch(path, batch_no, df)
+            count_rows(read=len(df))
+            yield df
+        etl_stage.commit(path)
+        committed = True
+    finally:
+        if not committed:
+            etl_stage.abort(path)
+
+
+def _counted(batches):
+    """逐批计入当前阶段的读取行数（etl_runlog）"""
+    for df in batches:
+        count_rows(read=len(df))
+        yield df
+
+
+def _fetch_batches(sql, params, batch_size, conn, fetch_mode, dtypes, pool):
+    """从Oracle流式抽取（iter_batches 的实际抽取部分）"""
+    batch_size = batch_size or EXTRACT_BATCH_SIZE
+    own_conn = conn is None
+    if own_conn:
+        logger.info("从会话池获取Oracle连接...")
+        pool = pool or get_oracle_pool()
+        conn = pool.acquire()
+
+    try:
+        if fetch_mode == 'arrow' and pyarrow is not None and hasattr(conn, 'fetch_df_batches'):
+            batches = _arrow_batches(conn, sql, params, batch_size, dtypes)
+        else:
+            if fetch_mode == 'arrow':
+                logger.info("当前oracledb/pyarrow不支持DataFrame抽取，改用按列类型累积")
+            batches = _cursor_batches(conn, sql, params, batch_size, fetch_mode, dtypes)
+
+        total = 0
+        batch_no = 0
+        for df in batches:
+            if df.empty:
+                yield df
+                continue
+            total += len(df)
+            batch_no += 1
+            logger.info(f"抽取第 {batch_no} 批，{len(df)} 条（累计 {total} 条）")
+            yield df
+        logger.info(f"抽取完成，共 {total} 条记录")
+    finally:
+        if own_conn:
+            pool.release(conn)
+
+
+def _cursor_batches(conn, sql, params, batch_size, fetch_mode, dtypes):
+    """游标抽取：tuple模式逐批构建DataFrame；arrow模式退化为按列类型累积"""
+    logger.info("执行SQL查询...")
+    cursor = conn.cursor()
+    try:
+        cursor.arraysize = ORACLE_FETCH_ARRAYSIZE
+        cursor.prefetchrows = ORACLE_PREFETCH_ROWS
+        cursor.execute(sql, params)
+        columns = [col[0].lower() for col in cursor.description]
+
+        if fetch_mode == 'arrow':
+            yield from _typed_batches(cursor, columns, batch_size, dtypes or {})
+            return
+
+        fetched = False
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            fetched = True
+            yield pd.DataFrame(rows, columns=columns)
+        if not fetched:
+            yield pd.DataFrame(columns=columns)
+    finally:
+        cursor.close()
+
+
+def _typed_batches(cursor, columns, batch_size, dtypes):
+    """按列类型累积：每取回一个 arraysize 块即转置为定长数组，元组随块释放"""
+    buffers = {col: [] for col in columns}
+    buffered = 0
+    fetched = False
+    while True:
+        rows = cursor.fetchmany(cursor.arraysize)
+        exhausted = not rows
+        if rows:
+            for col, values in zip(columns, zip(*rows)):
+                buffers[col].append(_to_array(values, dtypes.get(col)))
+            buffered += len(rows)
+            rows = None
+        if buffered and (buffered >= batch_size or exhausted):
+            fetched = True
+            yield pd.DataFrame({col: _concat_arrays(parts) for col, parts in buffers.items()})
+            buffers = {col: [] for col in columns}
+            buffered = 0
+        if exhausted:
+            break
+    if not fetched:
+        yield pd.DataFrame({col: pd.Series(dtype=dtypes.get(col, 'object')) for col in columns})
+
+
+def _to_array(values, dtype):
+    """把一列值转为指定类型数组；非空整型遇到NULL时退回可空Int64"""
+    if dtype is None:
+        return np.array(values, dtype=object)
+    try:
+        return pd.array(values, dtype=dtype) if dtype == 'Int64' else np.array(values, dtype=dtype)
+    except (TypeError, ValueError):
+        return pd.array(values, dtype='Int64')
+
+
+def _concat_arrays(parts):
+    """合并同列的多个块"""
+    if len(parts) == 1:
+        return parts[0]
+    if all(isinstance(p, np.ndarray) for p in parts):
+        return np.concatenate(parts)
+    return pd.concat([pd.Series(p) for p in parts], ignore_index=True)
+
+
+def _arrow_batches(conn, sql, params, batch_size, dtypes):
+    """oracledb DataFrame抽取：结果直接写入Arrow列存，再零拷贝（数值列）转为pandas"""
+    logger.info("执行SQL查询（Arrow列式抽取）...")
+    fetched = False
+    for odf in conn.fetch_df_batches(statement=sql, parameters=params, size=batch_size):
+        df = pyarrow.table(odf).to_pandas()
+        df.columns = [col.lower() for col in df.columns]
+        fetched = True
+        yield _apply_dtypes(df, dtypes)
+    if not fetched:
+        yield _empty_frame(conn, sql, params, dtypes)
+
+
+def _apply_dtypes(df, dtypes):
+    """Arrow中带NULL的整型列会转成float64，按声明类型还原（如可空ID列→Int64）"""
+    for col, dtype in (dtypes or {}).items():
+        if col in df.columns and str(df[col].dtype) != dtype:
+            try:
+                df[col] = df[col].astype(dtype)
+            except (TypeError, ValueError):
+                df[col] = df[col].astype('Int64')
+    return df
+
+
+def _empty_frame(conn, sql, params, dtypes):
+    """无结果时仅取列描述，构造带列名的空DataFrame"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"SELECT * FROM ({sql}) WHERE 1 = 0", params)
+        columns = [col[0].lower() for col in cursor.description]
+    finally:
+        cursor.close()
+    return pd.DataFrame({col: pd.Series(dtype=(dtypes or {}).get(col, 'object')) for col in columns})
+
+
+def extract_df(sql, params=None, conn=None, fetch_mode=None, dtypes=None, pool=None, cache=None):
+    """执行查询并合并为单个DataFrame（仅用于结果集较小、需整体处理的场景）"""
+    batches = iter_batches(sql, params, conn=conn, fetch_mode=fetch_mode, dtypes=dtypes, pool=pool,
+                           cache=cache)
+    return pd.concat(list(batches), ignore_index=True)
+
+
+async def fetch_df_async(pool, sql, params=None, dtypes=None, cache=None):
+    """
+    asyncio抽取：从异步会话池借出连接执行查询，返回单个DataFrame（适合维度表等中等结果集）
+    等待Oracle往返期间让出事件循环，多个查询可在同一线程内并发；同样读写抽取暂存
+    """
+    if etl_stage.is_enabled(cache):
+        key = etl_stage.query_key(sql, params, 'tuple')
+        cached = etl_stage.lookup(key)
+        if cached:
+            return pd.concat(list(etl_stage.read_batches(cached)), ignore_index=True)
+
+    async with pool.acquire() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.arraysize = ORACLE_FETCH_ARRAYSIZE
+            cursor.prefetchrows = ORACLE_PREFETCH_ROWS
+            await cursor.execute(sql, params)
+            columns = [col[0].lower() for col in cursor.description]
+            chunks = []
+            while True:
+                rows = await cursor.fetchmany(ORACLE_FETCH_ARRAYSIZE)
+                if not rows:
+                    break
+                chunks.append(pd.DataFrame(rows, columns=columns))
+        finally:
+            cursor.close()
+
+    df = pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame(columns=columns)
+    df = _apply_dtypes(df, dtypes) if not df.empty else df
+    logger.info(f"抽取完成，共 {len(df)} 条记录")
+
+    if etl_stage.is_enabled(cache):
+        path = etl_stage.begin(key)
+        etl_stage.write_batch(path, 0, df)
+        etl_stage.commit(path)
+    return df
+
+
+def as_frames(frames):
+    """统一入参：单个DataFrame包装为列表，迭代器原样返回"""
+    if isinstance(frames, pd.DataFrame):
+        return [frames]
+    return frames
+
+
+def nonempty_frames(frames):
+    """
+    预读首批判断是否有数据
+    无数据返回None；否则返回包含首批在内的完整迭代器（保留"无数据不清表"的原有语义）
+    """
+    it = iter(as_frames(frames))
+    for first in it:
+        if not first.empty:
+            return itertools.chain([first], it)
+    return None
+
+
+def exceeds_rows(frames, limit):
+    """
+    预读批次直到累计行数超过 limit 或数据读完（最多缓存约 limit 行）
+    返回 (是否超过, 包含已预读批次的完整迭代器)
+    """
+    it = iter(as_frames(frames))
+    head = []
+    rows = 0
+    for df in it:
+        head.append(df)
+        rows += len(df)
+        if rows > limit:
+            return True, itertools.chain(head, it)
+    return False, iter(head)
@@ -0,0 +1,277 @@
+# -*- coding: utf-8 -*-
+"""
+何方珠宝 - 库存变更日志（公共模块）
+每日全量快照 dws_inventory_daily 每天写入全部 店仓×SKU（含刻意保留的 qty=0 行），表按全量行数线性增长。
+本模块改为保存：
+- dws_inventory_current：当前库存（每个 店仓+商品+SKU 一行）
+- dws_inventory_changelog：相对上一次快照发生变化的行（数量/可用/在途或店仓属性变化、新增），
+  源端消失的行记一条 is_deleted=1 的删除标记
+任意日期的全量库存由变更日志还原（inventory_as_of）：每个键取 date_id <= 目标日期的最后一条记录，
+主键 (store_id, product_id, m_productalias_id, date_id) 使该查询可走松散索引扫描。
+
+存储方式由 config.INVENTORY_STORAGE_MODE 控制，delta 模式下快照只保留最近 INVENTORY_SNAPSHOT_KEEP_DAYS 天
+（ADS 仍读取当天快照），更早日期从变更日志还原。
+
+用法：
+    python etl_inventory_delta.py seed              # 一次性：按日期顺序回放已有快照，生成变更日志
+    python etl_inventory_delta.py asof 20260301     # 还原某天库存并输出汇总
+    python etl_inventory_delta.py prune [保留天数]  # 删除可由变更日志还原的旧快照
+"""
+
+import logging
+import sys
+from datetime import datetime, timedelta
+
+import pandas as pd
+from sqlalchemy import text
+
+from config import INVENTORY_SNAPSHOT_KEEP_DAYS
+from etl_conn import get_mysql_engine
+from etl_load import upsert_frame, delete_rows, row_hash
+from etl_partition import is_partitioned, drop_days_before
+from etl_state import get_watermark, set_watermark
+
+logger = logging.getLogger(__name__)
+
+JOB_NAME = 'dws_inventory_delta'
+
+KEY_COLS = ['store_id', 'product_id', 'm_productalias_id']
+QTY_COLS = ['qty', 'qty_valid', 'qty_occupy', 'qtypurchaserem']
+ATTR_COLS = ['store_code', 'is_cloud_store']
+
+# 参与变更判断的列（与当前库存/变更日志存储的列一致）
+HASH_COLS = ATTR_COLS + QTY_COLS
+
+
+def ensure_tables(engine):
+    """确保当前库存表与变更日志表存在"""
+    with engine.begin() as conn:
+        conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS dws_inventory_current (
+                store_id BIGINT NOT NULL COMMENT '店仓ID',
+                product_id BIGINT NOT NULL COMMENT '商品ID',
+                m_productalias_id BIGINT NOT NULL COMMENT 'SKU ID（条码）',
+                store_code VARCHAR(40) DEFAULT NULL COMMENT '店仓编码',
+                is_cloud_store CHAR(1) DEFAULT 'N' COMMENT '是否云仓(Y/N)',
+                qty INT DEFAULT 0 COMMENT '库存数量',
+                qty_valid INT DEFAULT 0 COMMENT '可用库存',
+                qty_occupy INT DEFAULT 0 COMMENT '占用数量',
+                qtypurchaserem BIGINT DEFAULT 0 COMMENT '采购欠数/在途',
+                row_hash BIGINT DEFAULT NULL COMMENT '行内容哈希（变更判断用）',
+                changed_date_id INT NOT NULL COMMENT '最近一次变化的快照日期',
+                etl_time DATETIME DEFAULT NULL COMMENT 'ETL时间戳',
+                PRIMARY KEY (store_id, product_id, m_productalias_id)
+            ) COMMENT='当前库存（由每日快照合并）'
+        """))
+        conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS dws_inventory_changelog (
+                store_id BIGINT NOT NULL COMMENT '店仓ID',
+                product_id BIGINT NOT NULL COMMENT '商品ID',
+                m_productalias_id BIGINT NOT NULL COMMENT 'SKU ID（条码）',
+                date_id INT NOT NULL COMMENT '快照日期（自该日起生效）',
+                store_code VARCHAR(40) DEFAULT NULL COMMENT '店仓编码',
+                is_cloud_store CHAR(1) DEFAULT 'N' COMMENT '是否云仓(Y/N)',
+                qty INT DEFAULT 0 COMMENT '库存数量',
+                qty_valid INT DEFAULT 0 COMMENT '可用库存',
+                qty_occupy INT DEFAULT 0 COMMENT '占用数量',
+                qtypurchaserem BIGINT DEFAULT 0 COMMENT '采购欠数/在途',
+                is_deleted TINYINT NOT NULL DEFAULT 0 COMMENT '1=该日起源端已无此行',
+                etl_time DATETIME DEFAULT NULL COMMENT 'ETL时间戳',
+                PRIMARY KEY (store_id, product_id, m_productalias_id, date_id),
+                KEY idx_date (date_id)
+            ) COMMENT='库存变更日志'
+        """))
+
+
+def last_applied_date(engine):
+    """最近一次合并的快照日期；未合并过返回None"""
+    state = get_watermark(engine, JOB_NAME)
+    return int(state['watermark_id']) if state and state['watermark_id'] else None
+
+
+def _normalize(df):
+    """统一类型（Oracle抽取与MySQL回读的快照哈希一致）"""
+    df = df.copy()
+    for col in KEY_COLS:
+        df[col] = df[col].astype('int64')
+    for col in QTY_COLS:
+        df[col] = pd.to_numeric(df[col]).fillna(0).astype('float64')
+    df['store_code'] = df['store_code'].fillna('').astype(str)
+    df['is_cloud_store'] = df['is_cloud_store'].fillna('N').astype(str)
+    df['row_hash'] = row_hash(df, HASH_COLS)
+    return df
+
+
+def apply_snapshot(df, date_id, engine=None):
+    """
+    把一天的全量快照合并进当前库存，并把变化写入变更日志（单事务，同时推进 etl_watermark）
+    df: etl_dws_inventory.transform 的输出（或从 dws_inventory_daily 回读的同结构数据）
+    同一天重复执行时变更日志按主键覆盖；早于已合并日期的快照拒绝合并
+    返回 dict(changed, deleted, unchanged)
+    """
+    engine = engine or get_mysql_engine()
+    ensure_tables(engine)
+    if df.empty:
+        logger.warning("快照为空，跳过变更日志合并")
+        return None
+
+    last = last_applied_date(engine)
+    if last is not None and date_id < last:
+        raise RuntimeError(f"快照日期 {date_id} 早于已合并日期 {last}，变更日志只能按日期顺序追加")
+
+    df = _normalize(df)
+    etl_time = datetime.now()
+
+    with engine.begin() as conn:
+        existing = {
+            tuple(r[:-1]): r[-1] for r in conn.execute(text(
+                f"SELECT {', '.join(KEY_COLS)}, row_hash FROM dws_inventory_current"
+            )).fetchall()
+        }
+        keys = list(zip(*(df[c].tolist() for c in KEY_COLS)))
+        hashes = df['row_hash'].tolist()
+        mask = [existing.get(k) != h for k, h in zip(keys, hashes)]
+        gone = set(existing) - set(keys)
+
+        changed = df[mask]
+        if not changed.empty:
+            current = changed[KEY_COLS + ATTR_COLS + QTY_COLS + ['row_hash']].assign(
+                changed_date_id=date_id, etl_time=etl_time)
+            upsert_frame(conn, 'dws_inventory_current', current, KEY_COLS)
+            log = changed[KEY_COLS + ATTR_COLS + QTY_COLS].assign(
+                date_id=date_id, is_deleted=0, etl_time=etl_time)
+            upsert_frame(conn, 'dws_inventory_changelog', log, KEY_COLS + ['date_id'])
+
+        if gone:
+            tombstones = pd.DataFrame(list(gone), columns=KEY_COLS).assign(
+                date_id=date_id, qty=0, qty_valid=0, qty_occupy=0, qtypurchaserem=0,
+                is_deleted=1, etl_time=etl_time)
+            upsert_frame(conn, 'dws_inventory_changelog', tombstones, KEY_COLS + ['date_id'])
+            delete_rows(conn, 'dws_inventory_current', KEY_COLS, gone)
+
+        set_watermark(conn, JOB_NAME, watermark_id=date_id)
+
+    counts = {'changed': len(changed), 'deleted': len(gone), 'unchanged': len(df) - len(changed)}
+    logger.info(
+        f"库存变更日志 {date_id}：变化 {counts['changed']}，删除 {counts['deleted']}，"
+        f"未变 {counts['unchanged']}（快照 {len(df)} 行）"
+    )
+    return counts
+
+
+# 还原某天库存：每个键取生效日期 <= 目标日期的最后一条变更，去掉删除标记
+AS_OF_SQL = """
+    SELECT
+        :date_id AS date_id,
+        c.store_id, c.store_code, c.is_cloud_store, c.product_id, c.m_productalias_id,
+        c.qty, c.qty_valid, c.qty_occupy, c.qtypurchaserem,
+        c.date_id AS changed_date_id
+    FROM dws_inventory_changelog c
+    JOIN (
+        SELECT store_id, product_id, m_productalias_id, MAX(date_id) AS date_id
+        FROM dws_inventory_changelog
+        WHERE date_id <= :date_id
+        GROUP BY store_id, product_id, m_productalias_id
+    ) last_change
+        ON c.store_id = last_change.store_id
+        AND c.product_id = last_change.product_id
+        AND c.m_productalias_id = last_change.m_productalias_id
+        AND c.date_id = last_change.date_id
+    WHERE c.is_deleted = 0
+    """
+
+
+def inventory_as_of(date_id, engine=None):
+    """
+    还原 date_id 当天的全量库存（与 dws_inventory_daily 同列，外加 changed_date_id）
+    - 不早于最近合并日期：直接读当前库存表
+    - 早于变更日志起始日期：读 dws_inventory_daily 中保留的快照（如有）
+    - 其他：由变更日志还原
+    """
+    engine = engine or get_mysql_engine()
+    ensure_tables(engine)
+    last = last_applied_date(engine)
+    with engine.connect() as conn:
+        first = conn.execute(text("SELECT MIN(date_id) FROM dws_inventory_changelog")).scalar()
+        if last is not None and date_id >= last:
+            return pd.read_sql(text("""
+                SELECT :date_id AS date_id, store_id, store_code, is_cloud_store, product_id, m_productalias_id,
+                       qty, qty_valid, qty_occupy, qtypurchaserem, changed_date_id
+                FROM dws_inventory_current
+            """), conn, params={"date_id": date_id})
+        if first is None or date_id < first:
+            logger.info(f"{date_id} 早于变更日志起始日期，读取快照表")
+            return pd.read_sql(text(
+                "SELECT * FROM dws_inventory_daily WHERE date_id = :date_id"
+            ), conn, params={"date_id": date_id})
+        return pd.read_sql(text(AS_OF_SQL), conn, params={"date_id": date_id})
+
+
+def seed(engine=None):
+    """一次性：按日期顺序把 dws_inventory_daily 中尚未合并的快照回放进变更日志"""
+    engine = engine or get_mysql_engine()
+    ensure_tables(engine)
+    last = last_applied_date(engine) or 0
+    with engine.connect() as conn:
+        dates = [r[0] for r in conn.execute(text(
+            "SELECT DISTINCT date_id FROM dws_inventory_daily WHERE date_id > :last ORDER BY date_id"
+        ), {"last": last})]
+    logger.info(f"待回放快照 {len(dates)} 天")
+    for date_id in dates:
+        with engine.connect() as conn:
+            df = pd.read_sql(text(
+                "SELECT * FROM dws_inventory_daily WHERE date_id = :date_id"
+            ), conn, params={"date_id": date_id})
+        apply_snapshot(df, date_id, engine)
+
+
+def prune_snapshots(engine=None, keep_days=None):
+    """
+    删除 dws_inventory_daily 中早于 保留天数 且可由变更日志还原的快照
+    分区表直接删除日分区，否则按日期分批DELETE
+    """
+    engine = engine or get_mysql_engine()
+    keep_days = INVENTORY_SNAPSHOT_KEEP_DAYS if keep_days is None else keep_days
+    ensure_tables(engine)
+    with engine.connect() as conn:
+        first = conn.execute(text("SELECT MIN(date_id) FROM dws_inventory_changelog")).scalar()
+    if first is None:
+        logger.warning("变更日志为空，不清理快照")
+        return 0
+    cutoff = int((datetime.now() - timedelta(days=keep_days)).strftime('%Y%m%d'))
+
+    if is_partitioned(engine, 'dws_inventory_daily'):
+        dropped = drop_days_before(engine, 'dws_inventory_daily', cutoff, since=first)
+        logger.info(f"dws_inventory_daily 已删除 {dropped} 个早于 {cutoff} 的日分区")
+        return dropped
+
+    deleted = 0
+    while True:
+        with engine.begin() as conn:
+            result = conn.execute(text("""
+                DELETE FROM dws_inventory_daily
+                WHERE date_id >= :first AND date_id < :cutoff
+                LIMIT 50000
+            """), {"first": first, "cutoff": cutoff})
+        deleted += result.rowcount
+        if result.rowcount == 0:
+            break
+    logger.info(f"dws_inventory_daily 已删除早于 {cutoff} 的快照 {deleted} 行")
+    return deleted
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    command = sys.argv[1] if len(sys.argv) > 1 else ''
+    if command == 'seed':
+        seed()
+    elif command == 'asof' and len(sys.argv) > 2:
+        d = int(sys.argv[2])
+        start = datetime.now()
+        result = inventory_as_of(d)
+        print(f"{d} 库存：{len(result)} 行，qty合计 {result['qty'].sum():,.0f}，"
+              f"耗时 {(datetime.now() - start).total_seconds():.2f} 秒")
+    elif command == 'prune':
+        prune_snapshots(keep_days=int(sys.argv[2]) if len(sys.argv) > 2 else None)
+    else:
+        print(__doc__)
@@ -0,0 +1,437 @@
+# -*- coding: utf-8 -*-
+"""
+何方珠宝 - MySQL批量写入工具（公共模块）
+批量 INSERT ... ON DUPLICATE KEY UPDATE 与按键批量删除，供增量/合并类加载复用
+
+批量加载（bulk_insert）：DataFrame写入临时TSV文件后以 LOAD DATA LOCAL INFILE 一次载入，
+比 to_sql 的参数化多行INSERT快一个数量级；在调用方事务内执行，保持先删后插的原子性。
+服务端未开启 local_infile 时自动退回 to_sql。
+
+并行写入（parallel_load）：单连接的写入吞吐有上限，大批量数据按 LOAD_SHARD_ROWS 切片，
+经 LOAD_WORKERS 个连接并发写入本次运行的临时表（<表>__load_<run>），再由调用方在单事务内
+INSERT ... SELECT 到目标表（publish_load），保持先删后插"全有或全无"的语义。
+
+影子表发布（prepare_staging / publish_staging）：全量刷新写入 <表>__staging（CREATE TABLE LIKE，
+DDL与索引一致），校验行数后一条 RENAME TABLE 原子切换，读者不会看到空表或半截数据。
+
+哈希合并（merge_by_hash）：transform 阶段按内容列计算 row_hash，与目标表已存哈希比对，
+只写入新增/变更行、删除源端已不存在的行；无变化时不产生任何写入。
+支持单列键（维度表ID）与复合业务键（如 dws_sales_daily 的 日期+店仓+SKU），可用 where 限定比对范围。
+"""
+
+import csv
+import decimal
+import logging
+import os
+import tempfile
+import time
+import uuid
+from datetime import date, datetime
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import pandas as pd
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+
+from config import LOAD_METHOD, LOAD_WORKERS, LOAD_SHARD_ROWS, DIM_PUBLISH_MIN_RATIO
+from etl_runlog import count_rows
+
+logger = logging.getLogger(__name__)
+
+UPSERT_BATCH_SIZE = 5000
+
+STAGING_SUFFIX = '__staging'
+OLD_SUFFIX = '__old'
+RUN_TABLE_SUFFIX = '__load_'
+
+# LOAD DATA LOCAL INFILE 被客户端/服务端禁用时的MySQL错误码
+LOCAL_INFILE_DISABLED_ERRORS = (1148, 2068, 3948)
+
+# 运行期检测到 infile 不可用后，本进程后续加载直接走 to_sql
+_infile_available = {'value': True}
+
+
+def bulk_insert(conn, table, df, method=None, chunksize=5000):
+    """
+    批量追加写入（在调用方事务内执行）
+    method: 'infile' / 'to_sql'，默认 LOAD_METHOD
+    返回写入行数
+    """
+    if df.empty:
+        return 0
+    method = method or LOAD_METHOD
+    if method == 'infile' and _infile_available['value'] and not _has_null_literal(df):
+        try:
+            rows = load_infile(conn, table, df)
+            count_rows(written=rows)
+            return rows
+        except DBAPIError as e:
+            code = e.orig.args[0] if e.orig is not None and e.orig.args else None
+            if code not in LOCAL_INFILE_DISABLED_ERRORS:
+                raise
+            _infile_available['value'] = False
+            logger.warning(f"LOAD DATA LOCAL INFILE 不可用（{e.orig}），改用 to_sql 写入")
+    df.to_sql(name=table, con=conn, if_exists='append', index=False, chunksize=chunksize)
+    count_rows(written=len(df))
+    return len(df)
+
+
+def _has_null_literal(df):
+    """文本列中是否有字符串 'NULL'（infile 会把未加引号的 NULL 载入为SQL NULL，此类批次改走 to_sql）"""
+    for col in df.columns:
+        if df[col].dtype == object and df[col].eq('NULL').any():
+            return True
+    return False
+
+
+def load_infile(conn, table, df):
+    """
+    DataFrame → 临时TSV → LOAD DATA LOCAL INFILE
+    文本字段按需加双引号（内部引号双写），NULL写为未加引号的 NULL，时间统一为秒级
+    LOCAL 载入隐含 IGNORE：重复键/无法转换的行只产生警告而不报错，
+    载入行数与DataFrame行数不一致或有警告时抛出 RuntimeError（调用方事务回滚）
+    """
+    fd, path = tempfile.mkstemp(prefix=f"{table}_", suffix='.tsv')
+    os.close(fd)
+    try:
+        df.to_csv(
+            path, sep='\t', header=False, index=False, na_rep='NULL',
+            quoting=csv.QUOTE_MINIMAL, doublequote=True, lineterminator='\n',
+            date_format='%Y-%m-%d %H:%M:%S', encoding='utf-8'
+        )
+        columns = ', '.join(f"`{c}`" for c in df.columns)
+        result = conn.execute(text(f"""
+            LOAD DATA LOCAL INFILE :path INTO TABLE {table}
+            CHARACTER SET utf8mb4
+            FIELDS TERMINATED BY '\\t' OPTIONALLY ENCLOSED BY '"' ESCAPED BY ''
+            LINES TERMINATED BY '\\n'
+            ({columns})
+        """), {"path": path})
+        rows = result.rowcount
+        warnings = [w for w in conn.execute(text("SHOW WARNINGS")).fetchall() if w[0] != 'Note']
+        if rows != len(df) or warnings:
+            detail = '; '.join(f"{w[1]} {w[2]}" for w in warnings[:5])
+            raise RuntimeError(f"LOAD DATA 载入 {table} 行数不一致：{rows}/{len(df)}，警告 {len(warnings)} 条 {detail}")
+        return rows
+    finally:
+        os.remove(path)
+
+
+def _iter_shards(frames, shard_rows):
+    """把DataFrame或迭代器按行数切分为分片（分片不跨批次，最后一片可能不足 shard_rows）"""
+    if isinstance(frames, pd.DataFrame):
+        frames = [frames]
+    for df in frames:
+        for i in range(0, len(df), shard_rows):
+            yield df.iloc[i:i + shard_rows]
+
+
+def _write_shard(engine, table, shard_no, df):
+    """单个分片：从连接池借出一个连接，独立事务写入临时表，返回分片统计"""
+    start = time.perf_counter()
+    with engine.begin() as conn:
+        rows = bulk_insert(conn, table, df)
+    seconds = time.perf_counter() - start
+    logger.info(f"分片 {shard_no}：{rows} 条，耗时 {seconds:.2f} 秒（{rows / max(seconds, 1e-6):,.0f} 行/秒）")
+    return {'shard': shard_no, 'rows': rows, 'seconds': round(seconds, 3)}
+
+
+def parallel_load(engine, table, frames, workers=None, shard_rows=None):
+    """
+    并行写入临时表（不影响目标表）
+    frames: 已转换的DataFrame或迭代器；按 shard_rows 切片后由 workers 个连接并发写入
+            <table>__load_<run>（CREATE TABLE LIKE，结构与目标表一致）
+    在途分片不超过 workers × 2，内存占用与总行数无关
+    返回 (临时表名, 写入列, 分片统计列表)；任一分片失败时删除临时表并抛出异常
+    调用方在事务内用 publish_load 发布，之后 drop_load_table 清理
+    """
+    workers = workers or LOAD_WORKERS
+    shard_rows = shard_rows or LOAD_SHARD_ROWS
+    run_table = f"{table}{RUN_TABLE_SUFFIX}{uuid.uuid4().hex[:8]}"
+    with engine.begin() as conn:
+        conn.execute(text(f"CREATE TABLE {run_table} LIKE {table}"))
+        # CREATE TABLE LIKE 会复制目标表的按天分区；临时表只做中转，去掉分区
+        partitioned = conn.execute(text("""
+            SELECT COUNT(*) FROM information_schema.PARTITIONS
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table AND PARTITION_NAME IS NOT NULL
+        """), {"table": run_table}).scalar() > 0
+        if partitioned:
+            conn.execute(text(f"ALTER TABLE {run_table} REMOVE PARTITIONING"))
+
+    columns = None
+    stats = []
+    start = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = set()
+            for shard_no, df in enumerate(_iter_shards(frames, shard_rows), start=1):
+                if columns is None:
+                    columns = list(df.columns)
+                pending.add(executor.submit(_write_shard, engine, run_table, shard_no, df))
+                if len(pending) >= workers * 2:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    stats.extend(f.result() for f in done)
+            stats.extend(f.result() for f in pending)
+    except Exception:
+        drop_load_table(engine, run_table)
+        raise
+
+    total = sum(s['rows'] for s in stats)
+    seconds = time.perf_counter() - start
+    stats.sort(key=lambda s: s['shard'])
+    logger.info(
+        f"{run_table} 并行写入完成：{len(stats)} 个分片，{total} 条，"
+        f"{workers} 个连接，耗时 {seconds:.2f} 秒"
+    )
+    return run_table, columns or [], stats
+
+
+def publish_load(conn, table, run_table, columns, where=None, params=None):
+    """
+    把临时表数据 INSERT ... SELECT 到目标表（在调用方事务内执行，自增ID由目标表重新分配）
+    where/params: 只发布临时表中满足条件的行（如按天写入分区交换表）
+    返回写入行数
+    """
+    if not columns:
+        return 0
+    cols = ', '.join(f"`{c}`" for c in columns)
+    sql = f"INSERT INTO {table} ({cols}) SELECT {cols} FROM {run_table}"
+    if where:
+        sql += f" WHERE {where}"
+    rows = conn.execute(text(sql), params or {}).rowcount
+    count_rows(written=rows)
+    return rows
+
+
+def drop_load_table(engine, run_table):
+    """删除本次运行的临时表"""
+    with engine.begin() as conn:
+        conn.execute(text(f"DROP TABLE IF EXISTS {run_table}"))
+
+
+def prepare_staging(engine, table):
+    """按线上表结构（含索引）重建影子表，返回影子表名"""
+    staging = table + STAGING_SUFFIX
+    with engine.begin() as conn:
+        conn.execute(text(f"DROP TABLE IF EXISTS {staging}"))
+        conn.execute(text(f"CREATE TABLE {staging} LIKE {table}"))
+    logger.info(f"已创建影子表 {staging}")
+    return staging
+
+
+def publish_staging(engine, written, min_ratio=None):
+    """
+    校验影子表后原子切换
+    written: {线上表名: 本次写入影子表的行数}；多张表在同一条 RENAME TABLE 中一起切换
+    校验：影子表行数等于写入行数，且不低于线上表行数 × min_ratio（默认 DIM_PUBLISH_MIN_RATIO）
+    校验失败抛出 RuntimeError，线上表不受影响，影子表保留供排查
+    """
+    min_ratio = DIM_PUBLISH_MIN_RATIO if min_ratio is None else min_ratio
+    with engine.connect() as conn:
+        for table, rows in written.items():
+            staged = conn.execute(text(f"SELECT COUNT(*) FROM {table}{STAGING_SUFFIX}")).scalar()
+            live = conn.execute(text(f"SELECT COUNT(*) FROM {table}")).scalar()
+            if staged != rows:
+                raise RuntimeError(f"{table} 影子表行数 {staged} 与写入行数 {rows} 不一致，放弃切换")
+            if staged == 0 or staged < live * min_ratio:
+                raise RuntimeError(
+                    f"{table} 影子表行数 {staged} 低于线上 {live} 的 {min_ratio:.0%}，放弃切换"
+                )
+            logger.info(f"{table} 校验通过：影子表 {staged} 条，线上 {live} 条")
+
+    renames = ', '.join(
+        f"{t} TO {t}{OLD_SUFFIX}, {t}{STAGING_SUFFIX} TO {t}" for t in written
+    )
+    with engine.begin() as conn:
+        for table in written:
+            conn.execute(text(f"DROP TABLE IF EXISTS {table}{OLD_SUFFIX}"))
+        conn.execute(text(f"RENAME TABLE {renames}"))
+        for table in written:
+            conn.execute(text(f"DROP TABLE IF EXISTS {table}{OLD_SUFFIX}"))
+    logger.info(f"已原子切换：{', '.join(written)}")
+
+
+def _records(df):
+    """DataFrame转为参数字典列表（NaN/NA → None）"""
+    return df.astype(object).where(pd.notna(df), None).to_dict('records')
+
+
+def upsert_frame(conn, table, df, key_cols, batch_size=UPSERT_BATCH_SIZE, insert_only_cols=()):
+    """
+    批量 upsert：INSERT ... ON DUPLICATE KEY UPDATE（pymysql executemany 合并为多行VALUES）
+    conn: 事务内连接（engine.begin()）
+    key_cols: 唯一键列，不参与 UPDATE
+    insert_only_cols: 仅插入时写入、已存在时保留原值的列（如 created_at）
+    返回处理行数
+    """
+    if df.empty:
+        return 0
+    cols = list(df.columns)
+    updates = [c for c in cols if c not in key_cols and c not in insert_only_cols]
+    sql = (
+        f"INSERT INTO {table} ({', '.join(cols)}) "
+        f"VALUES ({', '.join(':' + c for c in cols)})"
+    )
+    if updates:
+        sql += " ON DUPLICATE KEY UPDATE " + ", ".join(f"{c} = VALUES({c})" for c in updates)
+    stmt = text(sql)
+    for i in range(0, len(df), batch_size):
+        conn.execute(stmt, _records(df.iloc[i:i + batch_size]))
+    count_rows(written=len(df))
+    return len(df)
+
+
+def delete_keys(conn, table, key_col, keys, batch_size=UPSERT_BATCH_SIZE):
+    """按单列键批量删除（每批一条 DELETE ... WHERE key IN (...)），返回删除行数"""
+    keys = list(keys)
+    deleted = 0
+    for i in range(0, len(keys), batch_size):
+        chunk = keys[i:i + batch_size]
+        params = {f"k{j}": int(k) for j, k in enumerate(chunk)}
+        result = conn.execute(
+            text(f"DELETE FROM {table} WHERE {key_col} IN ({', '.join(':' + p for p in params)})"),
+            params
+        )
+        deleted += result.rowcount
+    return deleted
+
+
+def delete_rows(conn, table, key_cols, keys, batch_size=1000):
+    """按复合键批量删除（DELETE ... WHERE (a, b) IN ((...), ...)），返回删除行数"""
+    keys = list(keys)
+    deleted = 0
+    columns = ', '.join(key_cols)
+    for i in range(0, len(keys), batch_size):
+        chunk = keys[i:i + batch_size]
+        params = {}
+        rows = []
+        for j, key in enumerate(chunk):
+            names = []
+            for n, value in enumerate(key):
+                params[f"k{j}_{n}"] = value
+                names.append(f":k{j}_{n}")
+            rows.append(f"({', '.join(names)})")
+        result = conn.execute(
+            text(f"DELETE FROM {table} WHERE ({columns}) IN ({', '.join(rows)})"), params
+        )
+        deleted += result.rowcount
+    return deleted
+
+
+HASH_TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def _hash_value(v):
+    """object 列单值的哈希文本：数值统一为float、时间统一格式、空值（None/nan/NaT）为空串"""
+    if v is None or v is pd.NaT or (isinstance(v, float) and v != v):
+        return ''
+    if isinstance(v, (decimal.Decimal, int, float)) and not isinstance(v, bool):
+        return str(float(v))
+    if isinstance(v, (datetime, date)):
+        return v.strftime(HASH_TIME_FORMAT)
+    return str(v)
+
+
+def _hash_text(s):
+    """列转为哈希文本（与抽取模式无关：Decimal/int/float、datetime64/datetime、None/nan/NaT 分别归一）"""
+    if pd.api.types.is_bool_dtype(s):
+        return s.astype(str).where(s.notna(), '')
+    if pd.api.types.is_numeric_dtype(s):
+        values = s.astype('float64')
+        return values.astype(str).where(values.notna(), '')
+    if pd.api.types.is_datetime64_any_dtype(s):
+        return s.dt.strftime(HASH_TIME_FORMAT).where(s.notna(), '')
+    return s.map(_hash_value)
+
+
+def row_hash(df, cols):
+    """
+    按内容列计算行哈希（BIGINT）
+    各列先按类型归一为文本再哈希（_hash_text），tuple/arrow 两种抽取模式下结果一致；不含ETL时间戳等易变列
+    """
+    text_df = pd.DataFrame({col: _hash_text(df[col]) for col in cols}, index=df.index)
+    hashed = pd.util.hash_pandas_object(text_df, index=False)
+    return pd.Series(hashed.to_numpy().view('int64'), index=df.index)
+
+
+def ensure_hash_column(engine, table, hash_col='row_hash'):
+    """确保目标表有行哈希列（首次合并时已有行哈希为NULL，会被视为变更重写一次）"""
+    with engine.connect() as conn:
+        exists = conn.execute(text("""
+            SELECT COUNT(*) FROM information_schema.COLUMNS
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table AND COLUMN_NAME = :col
+        """), {"table": table, "col": hash_col}).fetchone()[0] > 0
+        if not exists:
+            logger.info(f"添加新字段: {table}.{hash_col}")
+            conn.execute(text(
+                f"ALTER TABLE {table} ADD COLUMN {hash_col} BIGINT DEFAULT NULL COMMENT '行内容哈希（合并加载比对用）'"
+            ))
+            conn.commit()
+
+
+def merge_by_hash(engine, table, frames, key_col, hash_col='row_hash',
+                  insert_only_cols=(), batch_size=UPSERT_BATCH_SIZE, where=None, params=None):
+    """
+    按行哈希合并加载（单事务）
+    frames: 已转换且含 hash_col 的DataFrame或迭代器
+    key_col: 键列名；复合键传列名列表/元组（目标表需有对应唯一键）
+    where/params: 只与目标表中满足条件的行比对（如日期范围），范围外的行不读取、不删除
+    - 键不存在 → 插入；哈希不同 → 更新；哈希相同 → 跳过
+    - 目标表中有、本次源数据中没有的键 → 删除
+      不限范围（维度全表合并）且源数据为空时不删除，避免抽取异常清空维度；
+      以 where 限定范围（如按日期的事实表合并）时源数据为空也删除范围内全部行（如当天单据全部作废）
+    返回 dict(inserted, updated, unchanged, deleted)
+    """
+    ensure_hash_column(engine, table, hash_col)
+    counts = {'inserted': 0, 'updated': 0, 'unchanged': 0, 'deleted': 0}
+    key_cols = [key_col] if isinstance(key_col, str) else list(key_col)
+    composite = len(key_cols) > 1
+
+    sql = f"SELECT {', '.join(key_cols)}, {hash_col} FROM {table}"
+    if where:
+        sql += f" WHERE {where}"
+
+    with engine.begin() as conn:
+        # 已存哈希：{键: 哈希}（复合键为元组），哈希为NULL的历史行视为变更
+        rows = conn.execute(text(sql), params or {}).fetchall()
+        existing = {(tuple(r[:-1]) if composite else r[0]): r[-1] for r in rows}
+        rows = None
+        logger.info(f"{table} 现有 {len(existing)} 条记录")
+
+        seen = set()
+        for df in frames:
+            if df.empty:
+                continue
+            if composite:
+                keys = list(zip(*(df[c].tolist() for c in key_cols)))
+            else:
+                keys = df[key_col].tolist()
+            hashes = df[hash_col].tolist()
+            is_new = [k not in existing for k in keys]
+            is_changed = [not n and existing[k] != h for k, h, n in zip(keys, hashes, is_new)]
+            seen.update(keys)
+
+            n_new = sum(is_new)
+            n_changed = sum(is_changed)
+            counts['inserted'] += n_new
+            counts['updated'] += n_changed
+            counts['unchanged'] += len(df) - n_new - n_changed
+
+            mask = [n or c for n, c in zip(is_new, is_changed)]
+            if any(mask):
+                upsert_frame(conn, table, df[mask], key_cols, batch_size, insert_only_cols)
+
+        if seen or where:
+            gone = set(existing) - seen
+            if composite:
+                counts['deleted'] = delete_rows(conn, table, key_cols, gone)
+            else:
+                counts['deleted'] = delete_keys(conn, table, key_col, gone, batch_size)
+        else:
+            logger.warning(f"{table} 本次源数据为空，跳过删除")
+
+    logger.info(
+        f"{table} 合并完成：新增 {counts['inserted']}，更新 {counts['updated']}，"
+        f"删除 {counts['deleted']}，未变 {counts['unchanged']}"
+    )
+    return counts
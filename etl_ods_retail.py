@@ -0,0 +1,395 @@
+# -*- coding: utf-8 -*-
+"""
+何方珠宝 - 零售单ODS落地ETL
+从Oracle M_RETAIL/M_RETAILITEM原样落地到MySQL ods_m_retail/ods_m_retailitem
+策略：按 M_RETAIL.MODIFIEDDATE / ID 高水位增量（etl_watermark），每次运行一个 etl_batch_id
+
+- 零售单主表：新增或修改过的单据 upsert
+- 零售单明细：按本次落地的单据ID抽取，整单先删后插（明细行删除也能同步；
+  不再按增量条件重新筛选，两次查询之间被修改的单据不会只追加明细而不删旧明细）
+- 店仓/商品口径字段：C_STORE/M_PRODUCT 按 MODIFIEDDATE 增量落地到 ods_c_store/ods_m_product，
+  含已停用记录（dim_store/dim_product 只保留启用记录，停用后的历史销售按ODS聚合时不能丢失）
+- ods_m_retail / ods_m_retailitem 首次写入前确认 id 上有主键或唯一键（缺失时补建，有重复 id 时报错）
+- ODS不做业务过滤（状态/店仓/品类），由 etl_dws_sales.rebuild_from_ods 在MySQL内聚合
+- 首次运行（无高水位）按单据日期回溯 ODS_RETAIL_INITIAL_DAYS 天
+- 与日内微批（etl_sales_micro）共用高水位，以命名锁 ODS_LOCK 互斥
+"""
+
+import pandas as pd
+from datetime import datetime, timedelta
+import logging
+
+from sqlalchemy import text
+
+from config import ODS_RETAIL_INITIAL_DAYS, WATERMARK_OVERLAP_MINUTES, ODS_LOCK_TIMEOUT_SECONDS
+from etl_conn import get_mysql_engine
+from etl_extract import iter_batches
+from etl_queries import in_list
+from etl_load import upsert_frame, delete_keys, bulk_insert
+from etl_state import get_watermark, set_watermark, named_lock
+
+# 配置日志
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+
+JOB_NAME = 'ods_m_retail'
+ODS_LOCK = 'etl_ods_m_retail'
+
+# 增量条件：修改时间超过高水位（含重叠窗口），或ID超过已落地的最大ID
+INCREMENTAL_FILTER = "r.MODIFIEDDATE > :since OR r.ID > :last_id"
+
+# 首次落地条件：按单据日期回溯
+INITIAL_FILTER = "r.BILLDATE >= :start_date"
+
+RETAIL_SQL = """
+    SELECT
+        r.ID AS id,
+        r.DOCNO AS docno,
+        r.BILLDATE AS billdate,
+        r.C_STORE_ID AS c_store_id,
+        r.TOT_AMT_ACTUAL AS tot_amt_actual,
+        r.TOT_AMT_LIST AS tot_amt_list,
+        r.TOT_QTY AS tot_qty,
+        r.STATUS AS status,
+        r.ISACTIVE AS isactive,
+        r.CREATIONDATE AS created,
+        r.MODIFIEDDATE AS modified_at
+    FROM M_RETAIL r
+    WHERE {filter}
+    """
+
+# 明细按单据ID抽取；ID列表补齐为固定长度 ITEM_CHUNK，各批SQL文本相同
+ITEM_CHUNK = 1000
+RETAILITEM_SQL = """
+    SELECT
+        ri.ID AS id,
+        ri.M_RETAIL_ID AS m_retail_id,
+        ri.M_PRODUCT_ID AS m_product_id,
+        ri.M_PRODUCTALIAS_ID AS m_productalias_id,
+        ri.QTY AS qty,
+        ri.PRICELIST AS pricelist,
+        ri.PRICEACTUAL AS priceactual,
+        ri.TOT_AMT_ACTUAL AS tot_amt_actual,
+        ri.TOT_AMT_LIST AS tot_amt_list
+    FROM M_RETAILITEM ri
+    WHERE ri.M_RETAIL_ID IN ({ids})
+    """.format(ids=in_list('id', range(ITEM_CHUNK))[0])
+
+
+# 店仓/商品口径字段（不过滤 ISACTIVE）：首次全量，之后按 MODIFIEDDATE 高水位增量
+MASTER_INITIAL_FILTER = "1 = 1"
+MASTER_INCREMENTAL_FILTER = "t.MODIFIEDDATE > :since"
+
+STORE_SQL = """
+    SELECT
+        t.ID AS id,
+        t.CODE AS code,
+        t.IS_ALLO2OSTORAGE AS is_allo2ostorage,
+        t.ISACTIVE AS isactive,
+        t.MODIFIEDDATE AS modified_at
+    FROM C_STORE t
+    WHERE {filter}
+    """
+
+PRODUCT_SQL = """
+    SELECT
+        t.ID AS id,
+        t.M_DIM4_ID AS m_dim4_id,
+        t.ISACTIVE AS isactive,
+        t.MODIFIEDDATE AS modified_at
+    FROM M_PRODUCT t
+    WHERE {filter}
+    """
+
+# (ODS表（同为高水位任务名）, 抽取SQL, 列类型)
+MASTERS = [
+    ('ods_c_store', STORE_SQL, {'id': 'int64'}),
+    ('ods_m_product', PRODUCT_SQL, {'id': 'int64', 'm_dim4_id': 'Int64'}),
+]
+
+MASTER_DDL = {
+    'ods_c_store': """
+        CREATE TABLE IF NOT EXISTS ods_c_store (
+            id BIGINT NOT NULL COMMENT '店仓ID',
+            code VARCHAR(80) DEFAULT NULL COMMENT '店仓编码',
+            is_allo2ostorage CHAR(1) DEFAULT NULL COMMENT '是否云仓',
+            isactive CHAR(1) DEFAULT NULL COMMENT '是否启用',
+            etl_batch_id BIGINT NOT NULL DEFAULT 0,
+            etl_loaded_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (id)
+        ) COMMENT='ODS-店仓（销售聚合口径字段，含停用）'
+    """,
+    'ods_m_product': """
+        CREATE TABLE IF NOT EXISTS ods_m_product (
+            id BIGINT NOT NULL COMMENT '商品ID',
+            m_dim4_id BIGINT DEFAULT NULL COMMENT '商品类别ID',
+            isactive CHAR(1) DEFAULT NULL COMMENT '是否启用',
+            etl_batch_id BIGINT NOT NULL DEFAULT 0,
+            etl_loaded_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (id)
+        ) COMMENT='ODS-商品（销售聚合口径字段，含停用）'
+    """,
+}
+
+
+# 主表 upsert（ON DUPLICATE KEY UPDATE）与明细先删后插都依赖 id 唯一，缺键时会重复追加
+KEYED_TABLES = ['ods_m_retail', 'ods_m_retailitem']
+
+# 只含 id 一列的主键/唯一键
+ID_KEY_SQL = """
+    SELECT INDEX_NAME FROM information_schema.STATISTICS
+    WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table AND NON_UNIQUE = 0
+    GROUP BY INDEX_NAME
+    HAVING COUNT(*) = 1 AND MAX(COLUMN_NAME) = 'id'
+    """
+
+HAS_PRIMARY_SQL = """
+    SELECT COUNT(*) FROM information_schema.TABLE_CONSTRAINTS
+    WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table AND CONSTRAINT_TYPE = 'PRIMARY KEY'
+    """
+
+
+# 单据在ODS中对应的 dws_sales_daily 粒度（日期+店仓+商品+SKU）
+AFFECTED_KEYS_SQL = """
+    SELECT DISTINCT r.billdate, r.c_store_id, ri.m_product_id, ri.m_productalias_id
+    FROM ods_m_retailitem ri
+    JOIN ods_m_retail r ON ri.m_retail_id = r.id
+    WHERE r.id IN ({ids})
+    """
+
+
+# 列式抽取时的列类型
+RETAIL_DTYPES = {
+    'id': 'int64',
+    'billdate': 'Int64',
+    'c_store_id': 'Int64',
+    'status': 'Int64',
+    'tot_amt_actual': 'float64',
+    'tot_amt_list': 'float64',
+    'tot_qty': 'float64',
+}
+
+RETAILITEM_DTYPES = {
+    'id': 'int64',
+    'm_retail_id': 'int64',
+    'm_product_id': 'Int64',
+    'm_productalias_id': 'Int64',
+    'qty': 'float64',
+    'pricelist': 'float64',
+    'priceactual': 'float64',
+    'tot_amt_actual': 'float64',
+    'tot_amt_list': 'float64',
+}
+
+
+def new_batch_id():
+    """本次落地的批次号（yyyymmddHHMMSS）"""
+    return int(datetime.now().strftime('%Y%m%d%H%M%S'))
+
+
+def build_filter(state):
+    """根据高水位确定抽取条件与绑定变量"""
+    if state is None or state['watermark_time'] is None:
+        start_dt = datetime.now() - timedelta(days=ODS_RETAIL_INITIAL_DAYS)
+        start_date = int(start_dt.strftime('%Y%m%d'))
+        logger.info(f"模式：首次落地（单据日期 >= {start_date}）")
+        return INITIAL_FILTER, {'start_date': start_date}
+
+    since = state['watermark_time'] - timedelta(minutes=WATERMARK_OVERLAP_MINUTES)
+    last_id = state['watermark_id'] or 0
+    logger.info(f"模式：增量落地（MODIFIEDDATE > {since} 或 ID > {last_id}）")
+    return INCREMENTAL_FILTER, {'since': since, 'last_id': last_id}
+
+
+def extract_retail(where, params, pool=None):
+    """分批抽取零售单主表（生成器；高水位增量，不使用抽取暂存）"""
+    logger.info("抽取 M_RETAIL ...")
+    return iter_batches(RETAIL_SQL.format(filter=where), params, dtypes=RETAIL_DTYPES, pool=pool, cache=False)
+
+
+def extract_retailitem(retail_ids, pool=None):
+    """按单据ID分批抽取明细（生成器）；末批ID以最后一个ID补齐到 ITEM_CHUNK 个"""
+    logger.info("抽取 M_RETAILITEM ...")
+    retail_ids = [int(v) for v in retail_ids]
+    for i in range(0, len(retail_ids), ITEM_CHUNK):
+        chunk = retail_ids[i:i + ITEM_CHUNK]
+        chunk += [chunk[-1]] * (ITEM_CHUNK - len(chunk))
+        yield from iter_batches(RETAILITEM_SQL, in_list('id', chunk)[1], dtypes=RETAILITEM_DTYPES,
+                                pool=pool, cache=False)
+
+
+def load_masters(batch_id, engine=None, pool=None):
+    """
+    增量落地店仓/商品口径字段（每张表单独事务，upsert 后推进各自的高水位）
+    返回 {ODS表: 行数}
+    """
+    engine = engine or get_mysql_engine()
+    loaded = {}
+    for table, sql, dtypes in MASTERS:
+        with engine.begin() as conn:
+            conn.execute(text(MASTER_DDL[table]))
+        state = get_watermark(engine, table)
+        if state is None or state['watermark_time'] is None:
+            where, params = MASTER_INITIAL_FILTER, {}
+        else:
+            where = MASTER_INCREMENTAL_FILTER
+            params = {'since': state['watermark_time'] - timedelta(minutes=WATERMARK_OVERLAP_MINUTES)}
+
+        rows = 0
+        max_modified = None
+        with engine.begin() as conn:
+            for df in iter_batches(sql.format(filter=where), params, dtypes=dtypes, pool=pool, cache=False):
+                if df.empty:
+                    continue
+                batch_modified = df['modified_at'].max()
+                if pd.notna(batch_modified) and (max_modified is None or batch_modified > max_modified):
+                    max_modified = batch_modified
+                df = df.drop(columns=['modified_at'])
+                df['etl_batch_id'] = batch_id
+                df['etl_loaded_at'] = datetime.now()
+                upsert_frame(conn, table, df, key_cols=['id'])
+                rows += len(df)
+            if max_modified is not None:
+                set_watermark(conn, table, watermark_time=max_modified)
+        loaded[table] = rows
+        logger.info(f"落地 {table}：{rows} 条")
+    return loaded
+
+
+def ensure_id_keys(engine):
+    """
+    确保 ods_m_retail / ods_m_retailitem 在 id 上有主键或唯一键
+    缺键时补建（无主键时加 PRIMARY KEY，已有其他主键时加 UNIQUE KEY uk_id）；
+    已有重复 id 导致建键失败时抛出 RuntimeError，不在无键表上继续 upsert
+    """
+    for table in KEYED_TABLES:
+        with engine.connect() as conn:
+            if conn.execute(text(ID_KEY_SQL), {"table": table}).first() is not None:
+                continue
+            has_primary = conn.execute(text(HAS_PRIMARY_SQL), {"table": table}).scalar() > 0
+        ddl = f"ALTER TABLE {table} ADD UNIQUE KEY uk_id (id)" if has_primary \
+            else f"ALTER TABLE {table} ADD PRIMARY KEY (id)"
+        logger.info(f"{table}.id 无主键/唯一键，补建: {ddl}")
+        try:
+            with engine.begin() as conn:
+                conn.execute(text(ddl))
+        except Exception as e:
+            raise RuntimeError(
+                f"{table}.id 主键创建失败（可能已有重复 id，需先清理重复行）: {e}"
+            ) from e
+
+
+def affected_keys(conn, retail_ids, batch_size=1000):
+    """单据当前在ODS中对应的 (date_id, store_id, product_id, m_productalias_id) 集合"""
+    retail_ids = list(retail_ids)
+    keys = set()
+    for i in range(0, len(retail_ids), batch_size):
+        chunk = retail_ids[i:i + batch_size]
+        params = {f"id{j}": int(v) for j, v in enumerate(chunk)}
+        rows = conn.execute(text(AFFECTED_KEYS_SQL.format(ids=', '.join(':' + p for p in params))), params)
+        keys.update(tuple(r) for r in rows if None not in r)
+    return keys
+
+
+def load_to_mysql(where, params, batch_id, engine=None, pool=None, on_change=None):
+    """
+    落地到ODS：先确认主表/明细 id 上有键（ensure_id_keys），增量落地店仓/商品口径字段（load_masters），
+    再单事务内 主表 upsert → 删除变更单据的旧明细 → 按这些单据ID追加新明细 → 推进高水位
+    on_change: on_change(conn, keys)，在同一事务内、推进高水位前调用；
+               keys 为变更单据变更前后涉及的全部销售粒度（单据改日期/店仓/明细、作废、审核均覆盖）
+    返回 (主表行数, 明细行数)
+    """
+    engine = engine or get_mysql_engine()
+    ensure_id_keys(engine)
+    load_masters(batch_id, engine, pool)
+
+    max_modified = None
+    max_id = None
+    n_retail = 0
+    n_item = 0
+    retail_ids = []
+    keys = set()
+
+    with engine.begin() as conn:
+        for df in extract_retail(where, params, pool):
+            if df.empty:
+                continue
+            batch_modified = df['modified_at'].max()
+            batch_id_max = int(df['id'].max())
+            if pd.notna(batch_modified) and (max_modified is None or batch_modified > max_modified):
+                max_modified = batch_modified
+            max_id = batch_id_max if max_id is None else max(max_id, batch_id_max)
+
+            df = df.drop(columns=['modified_at'])
+            df['etl_batch_id'] = batch_id
+            df['etl_loaded_at'] = datetime.now()
+            retail_ids.extend(df['id'].tolist())
+            if on_change is not None:
+                # 变更前的粒度（旧单据日期/店仓/明细），须在覆盖主表与删除明细前读取
+                keys |= affected_keys(conn, df['id'].tolist())
+            upsert_frame(conn, 'ods_m_retail', df, key_cols=['id'])
+            delete_keys(conn, 'ods_m_retailitem', 'm_retail_id', df['id'].tolist())
+            n_retail += len(df)
+
+        if n_retail == 0:
+            logger.info("无新增/变更零售单")
+            return 0, 0
+
+        for df in extract_retailitem(retail_ids, pool):
+            if df.empty:
+                continue
+            df['etl_batch_id'] = batch_id
+            df['etl_loaded_at'] = datetime.now()
+            bulk_insert(conn, 'ods_m_retailitem', df)
+            n_item += len(df)
+
+        if on_change is not None:
+            keys |= affected_keys(conn, retail_ids)
+            on_change(conn, keys)
+
+        set_watermark(conn, JOB_NAME, watermark_time=max_modified, watermark_id=max_id)
+
+    logger.info(f"落地完成：批次 {batch_id}，零售单 {n_retail} 条，明细 {n_item} 条")
+    return n_retail, n_item
+
+
+def run(engine=None, pool=None):
+    """执行ETL
+
+    engine: MySQL引擎；pool: Oracle会话池（由 run_etl 注入，不传则使用进程内共享实例）
+    """
+
+    start_time = datetime.now()
+    logger.info("=" * 50)
+    logger.info("开始执行 ods_m_retail ETL")
+    logger.info("=" * 50)
+
+    try:
+        engine = engine or get_mysql_engine()
+        # 与日内微批互斥：等待正在进行的微批完成后再读取高水位
+        with named_lock(engine, ODS_LOCK, ODS_LOCK_TIMEOUT_SECONDS) as acquired:
+            if not acquired:
+                raise RuntimeError(f"等待ODS落地锁超时（{ODS_LOCK_TIMEOUT_SECONDS} 秒），可能有微批仍在执行")
+            where, params = build_filter(get_watermark(engine, JOB_NAME))
+            load_to_mysql(where, params, new_batch_id(), engine, pool)
+
+        end_time = datetime.now()
+        duration = (end_time - start_time).seconds
+
+        logger.info("=" * 50)
+        logger.info(f"✓ ETL执行成功！耗时 {duration} 秒")
+        logger.info("=" * 50)
+
+        return True
+
+    except Exception as e:
+        logger.error(f"✗ ETL执行失败: {str(e)}")
+        raise
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,315 @@
+# -*- coding: utf-8 -*-
+"""
+何方珠宝 - DWS分区管理（公共模块）
+dws_sales_daily / dws_inventory_daily 按 date_id 做按天 RANGE 分区：
+    p_history（迁移前的历史数据）| p20260101 | p20260102 | ... | pmax（MAXVALUE，保持为空）
+
+- 迁移（一次性，手动执行）：python etl_partition.py migrate
+  主键改为 (id, date_id)（MySQL要求唯一键包含分区列），按现有数据范围建日分区
+- 维护：run_etl 每次执行时从 pmax 拆出未来 PARTITION_AHEAD_DAYS 天的分区
+- 重载某天：数据先写入交换表（同结构、非分区），再 ALTER TABLE ... EXCHANGE PARTITION 换入，
+  旧数据随交换表删除；替代 DELETE，不产生碎片，读者只会看到换入前或换入后的完整一天
+- 没有独立日分区的日期（p_history 内）退回 DELETE + INSERT
+- 表未分区时各加载模块保持原有 DELETE 逻辑
+- ADS 的 date_id 等值/范围条件可直接分区裁剪：python etl_partition.py explain
+"""
+
+import logging
+import sys
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+from config import PARTITION_AHEAD_DAYS
+from etl_conn import get_mysql_engine
+from etl_extract import as_frames
+from etl_load import bulk_insert
+
+logger = logging.getLogger(__name__)
+
+PARTITIONED_TABLES = ('dws_sales_daily', 'dws_inventory_daily')
+
+HISTORY_PARTITION = 'p_history'
+MAX_PARTITION = 'pmax'
+
+# 分区DDL（拆分 pmax）串行执行，避免并行回补的多个线程同时重组分区
+_ddl_lock = threading.Lock()
+
+
+def partition_name(date_id):
+    """日分区名"""
+    return f"p{date_id}"
+
+
+def next_date_id(date_id):
+    """下一天的 date_id"""
+    return int((datetime.strptime(str(date_id), '%Y%m%d') + timedelta(days=1)).strftime('%Y%m%d'))
+
+
+def days_between(start_date, end_date):
+    """[start_date, end_date] 内的每一天"""
+    days = []
+    cur = int(start_date)
+    while cur <= int(end_date):
+        days.append(cur)
+        cur = next_date_id(cur)
+    return days
+
+
+def list_partitions(engine, table):
+    """表的分区名列表（按顺序）；未分区返回空列表"""
+    with engine.connect() as conn:
+        rows = conn.execute(text("""
+            SELECT PARTITION_NAME FROM information_schema.PARTITIONS
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table AND PARTITION_NAME IS NOT NULL
+            ORDER BY PARTITION_ORDINAL_POSITION
+        """), {"table": table}).fetchall()
+    return [r[0] for r in rows]
+
+
+def is_partitioned(engine, table):
+    """表是否已按本模块方式分区"""
+    return MAX_PARTITION in list_partitions(engine, table)
+
+
+def _day_partitions(partitions):
+    """分区名列表中的日分区 date_id 集合"""
+    return {int(p[1:]) for p in partitions if p[1:].isdigit()}
+
+
+def _partition_defs(days):
+    """日分区定义列表"""
+    return [f"PARTITION {partition_name(d)} VALUES LESS THAN ({next_date_id(d)})" for d in days]
+
+
+def ensure_partitions(engine, table, upto_date=None):
+    """
+    确保从最后一个日分区到 upto_date（默认 今天 + PARTITION_AHEAD_DAYS）的日分区都存在
+    新分区从 pmax 拆出（pmax 为空时只改元数据）；表未分区时不做处理，返回 False
+    """
+    if upto_date is None:
+        upto_date = int((datetime.now() + timedelta(days=PARTITION_AHEAD_DAYS)).strftime('%Y%m%d'))
+    with _ddl_lock:
+        partitions = list_partitions(engine, table)
+        if MAX_PARTITION not in partitions:
+            return False
+        existing = _day_partitions(partitions)
+        if not existing:
+            return True
+        last = max(existing)
+        if last >= upto_date:
+            return True
+        new_days = days_between(next_date_id(last), upto_date)
+        defs = _partition_defs(new_days) + [f"PARTITION {MAX_PARTITION} VALUES LESS THAN MAXVALUE"]
+        with engine.begin() as conn:
+            conn.execute(text(
+                f"ALTER TABLE {table} REORGANIZE PARTITION {MAX_PARTITION} INTO ({', '.join(defs)})"
+            ))
+        logger.info(f"{table} 新增日分区 {len(new_days)} 个（{new_days[0]} - {new_days[-1]}）")
+        return True
+
+
+def maintain(engine=None):
+    """为所有分区表预建未来日分区（run_etl 每次执行时调用）"""
+    engine = engine or get_mysql_engine()
+    for table in PARTITIONED_TABLES:
+        ensure_partitions(engine, table)
+
+
+def migrate(engine, table, history_days=None):
+    """
+    一次性把表改为按天分区（会重建整表，需在ETL空闲时手动执行）
+    history_days: 为最近N天建立日分区，更早的数据放入 p_history；默认从表中最早日期开始全部按天分区
+    """
+    if is_partitioned(engine, table):
+        logger.info(f"{table} 已分区，跳过")
+        return
+
+    with engine.connect() as conn:
+        min_date, max_date = conn.execute(text(f"SELECT MIN(date_id), MAX(date_id) FROM {table}")).fetchone()
+    today = int(datetime.now().strftime('%Y%m%d'))
+    first = int(min_date) if min_date else today
+    if history_days:
+        first = max(first, int((datetime.now() - timedelta(days=history_days)).strftime('%Y%m%d')))
+    upto = max(int(max_date or today), today)
+    upto = int((datetime.strptime(str(upto), '%Y%m%d') + timedelta(days=PARTITION_AHEAD_DAYS)).strftime('%Y%m%d'))
+
+    defs = (
+        [f"PARTITION {HISTORY_PARTITION} VALUES LESS THAN ({first})"]
+        + _partition_defs(days_between(first, upto))
+        + [f"PARTITION {MAX_PARTITION} VALUES LESS THAN MAXVALUE"]
+    )
+    logger.info(f"{table} 迁移为按天分区（{first} - {upto}，共 {len(defs)} 个分区）...")
+    with engine.begin() as conn:
+        # 分区表的每个唯一键都必须包含分区列
+        conn.execute(text(f"ALTER TABLE {table} DROP PRIMARY KEY, ADD PRIMARY KEY (id, date_id)"))
+        conn.execute(text(f"ALTER TABLE {table} PARTITION BY RANGE (date_id) ({', '.join(defs)})"))
+    logger.info(f"{table} 迁移完成")
+
+
+def drop_days_before(engine, table, cutoff, since=None):
+    """删除早于 cutoff（且不早于 since）的日分区（不含 p_history），返回删除的分区数"""
+    with _ddl_lock:
+        days = [d for d in sorted(_day_partitions(list_partitions(engine, table)))
+                if d < int(cutoff) and (since is None or d >= int(since))]
+        if days:
+            with engine.begin() as conn:
+                conn.execute(text(
+                    f"ALTER TABLE {table} DROP PARTITION {', '.join(partition_name(d) for d in days)}"
+                ))
+    return len(days)
+
+
+def _create_swap(engine, table, date_id):
+    """
+    创建某天的交换表：同结构、去掉分区，自增起点为主表当前最大ID之后
+    （不读 information_schema.TABLES.AUTO_INCREMENT：MySQL 8 按 information_schema_stats_expiry 缓存，可能落后）
+    """
+    swap = f"{table}__swap_{date_id}"
+    with engine.begin() as conn:
+        conn.execute(text(f"DROP TABLE IF EXISTS {swap}"))
+        conn.execute(text(f"CREATE TABLE {swap} LIKE {table}"))
+        conn.execute(text(f"ALTER TABLE {swap} REMOVE PARTITIONING"))
+        max_id = conn.execute(text(f"SELECT MAX(id) FROM {table}")).scalar()
+        if max_id:
+            conn.execute(text(f"ALTER TABLE {swap} AUTO_INCREMENT = {int(max_id) + 1}"))
+    return swap
+
+
+def _exchange(engine, table, date_id, swap):
+    """
+    换入某天的交换表（原子），换出的旧数据随交换表删除
+    换入的ID可能超过主表的自增计数器（交换不会推进计数器），换入后把计数器推进到全表最大ID之后，
+    之后的写入不会与换入的 (id, date_id) 冲突
+    """
+    with engine.begin() as conn:
+        conn.execute(text(
+            f"ALTER TABLE {table} EXCHANGE PARTITION {partition_name(date_id)} WITH TABLE {swap}"
+        ))
+        max_id = conn.execute(text(f"SELECT MAX(id) FROM {table}")).scalar()
+        if max_id:
+            conn.execute(text(f"ALTER TABLE {table} AUTO_INCREMENT = {int(max_id) + 1}"))
+
+
+def _drop_swaps(engine, swaps):
+    with engine.begin() as conn:
+        for swap in swaps:
+            conn.execute(text(f"DROP TABLE IF EXISTS {swap}"))
+
+
+def _split_days(engine, table, start_date, end_date):
+    """确保范围内的日分区存在，返回 (有独立日分区的日期, 落在 p_history 的日期)"""
+    ensure_partitions(engine, table, max(int(end_date), int(
+        (datetime.now() + timedelta(days=PARTITION_AHEAD_DAYS)).strftime('%Y%m%d'))))
+    existing = _day_partitions(list_partitions(engine, table))
+    days = days_between(start_date, end_date)
+    return [d for d in days if d in existing], [d for d in days if d not in existing]
+
+
+def replace_days(engine, table, frames, start_date, end_date, date_col='date_id'):
+    """
+    按天替换 [start_date, end_date] 的数据（frames 为DataFrame或迭代器，可跨多天）
+    每天的数据先写入各自的交换表，全部写完后逐天 EXCHANGE PARTITION；
+    范围内没有数据的日期同样换入空表（与原先按范围删除的语义一致）。
+    写入阶段失败时线上表不受影响；单天的换入是原子的。
+    返回写入行数
+    """
+    exchange_days, legacy_days = _split_days(engine, table, start_date, end_date)
+    legacy = set(legacy_days)
+    swaps = {}
+    legacy_frames = []
+    total = 0
+    try:
+        for df in as_frames(frames):
+            if df.empty:
+                continue
+            for date_id, part in df.groupby(date_col):
+                date_id = int(date_id)
+                if date_id in legacy:
+                    legacy_frames.append(part)
+                    continue
+                if date_id not in swaps:
+                    swaps[date_id] = _create_swap(engine, table, date_id)
+                with engine.begin() as conn:
+                    bulk_insert(conn, swaps[date_id], part)
+            total += len(df)
+
+        for date_id in exchange_days:
+            if date_id not in swaps:
+                swaps[date_id] = _create_swap(engine, table, date_id)
+            _exchange(engine, table, date_id, swaps[date_id])
+        logger.info(f"{table} 已换入 {len(exchange_days)} 个日分区")
+
+        if legacy_days:
+            # p_history 内的日期没有独立分区，按原方式先删后插
+            with engine.begin() as conn:
+                conn.execute(text(
+                    f"DELETE FROM {table} WHERE {date_col} >= :s AND {date_col} <= :e"
+                ), {"s": min(legacy_days), "e": max(legacy_days)})
+                for part in legacy_frames:
+                    bulk_insert(conn, table, part)
+            logger.info(f"{table} 历史分区内 {len(legacy_days)} 天按删除重写")
+    finally:
+        _drop_swaps(engine, swaps.values())
+    return total
+
+
+def rebuild_days(engine, table, start_date, end_date, fill):
+    """
+    按天在MySQL内重建：fill(conn, target_table, day_start, day_end) 向目标表写入数据并返回行数
+    有日分区的日期写入交换表后 EXCHANGE PARTITION；p_history 内的日期先删后插
+    返回写入行数
+    """
+    exchange_days, legacy_days = _split_days(engine, table, start_date, end_date)
+    total = 0
+    for date_id in exchange_days:
+        swap = _create_swap(engine, table, date_id)
+        try:
+            with engine.begin() as conn:
+                total += fill(conn, swap, date_id, date_id)
+            _exchange(engine, table, date_id, swap)
+        finally:
+            _drop_swaps(engine, [swap])
+
+    if legacy_days:
+        with engine.begin() as conn:
+            conn.execute(text(
+                f"DELETE FROM {table} WHERE date_id >= :s AND date_id <= :e"
+            ), {"s": min(legacy_days), "e": max(legacy_days)})
+            total += fill(conn, table, min(legacy_days), max(legacy_days))
+    return total
+
+
+def explain(engine=None):
+    """输出ADS计算中按 date_id 过滤的查询所扫描的分区，确认分区裁剪生效"""
+    engine = engine or get_mysql_engine()
+    today = int(datetime.now().strftime('%Y%m%d'))
+    date_30_ago = int((datetime.now() - timedelta(days=30)).strftime('%Y%m%d'))
+    queries = {
+        'dws_inventory_daily（当天快照）':
+            ("SELECT COUNT(*) FROM dws_inventory_daily WHERE date_id = :today", {"today": today}),
+        'dws_sales_daily（近30天）':
+            ("SELECT COUNT(*) FROM dws_sales_daily WHERE date_id >= :d30", {"d30": date_30_ago}),
+    }
+    with engine.connect() as conn:
+        for label, (sql, params) in queries.items():
+            row = conn.execute(text("EXPLAIN " + sql), params).mappings().fetchone()
+            partitions = (row.get('partitions') or '') if row else ''
+            count = len(partitions.split(',')) if partitions else 0
+            print(f"{label}: 扫描 {count} 个分区 {partitions[:80]}{'...' if len(partitions) > 80 else ''}")
+
+
+if __name__ == '__main__':
+    # python etl_partition.py migrate [表名...]   一次性迁移为分区表
+    # python etl_partition.py maintain           预建未来日分区
+    # python etl_partition.py explain            查看ADS查询的分区裁剪
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    command = sys.argv[1] if len(sys.argv) > 1 else 'maintain'
+    if command == 'migrate':
+        for name in (sys.argv[2:] or PARTITIONED_TABLES):
+            migrate(get_mysql_engine(), name)
+    elif command == 'explain':
+        explain()
+    else:
+        maintain()
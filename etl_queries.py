@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""
+何方珠宝 - Oracle查询层（公共模块）
+日期范围、ID列表等可变条件一律走绑定变量，SQL文本保持不变：
+ERP共享池中每类查询只有一个游标，不同日期范围/每日循环只做软解析（配合会话池语句缓存可免解析）。
+
+- 主销品类别取自 config.MAIN_CATEGORY_IDS，展开为固定个数的绑定变量 :cat0, :cat1, ...
+- in_list() 为任意ID列表生成占位符与绑定变量
+"""
+
+from config import MAIN_CATEGORY_IDS
+
+
+def in_list(prefix, values):
+    """
+    生成 IN 列表的占位符与绑定变量
+    返回 (":p0, :p1, ...", {"p0": v0, "p1": v1, ...})
+    列表长度不同时SQL文本不同，长度固定的列表（如配置中的类别）才能共享游标
+    """
+    names = [f"{prefix}{i}" for i in range(len(values))]
+    return ', '.join(':' + n for n in names), dict(zip(names, values))
+
+
+# 主销品类别：占位符文本与绑定变量
+MAIN_CATEGORY_IN, MAIN_CATEGORY_PARAMS = in_list('cat', list(MAIN_CATEGORY_IDS))
+
+
+def with_categories(params=None):
+    """在绑定变量中加入主销品类别"""
+    merged = dict(MAIN_CATEGORY_PARAMS)
+    merged.update(params or {})
+    return merged
+
+
+# 日销售汇总（Oracle端按 日期,店仓,SKU 聚合），绑定 :start_date / :end_date 与类别
+SALES_DAILY_SQL = f"""
+    SELECT
+        r.BILLDATE AS date_id,
+        r.C_STORE_ID AS store_id,
+        s.CODE AS store_code,
+        NVL(s.IS_ALLO2OSTORAGE, 'N') AS is_cloud_store,
+        ri.M_PRODUCT_ID AS product_id,
+        ri.M_PRODUCTALIAS_ID AS m_productalias_id,
+        -- 销售数据（正单）
+        SUM(CASE WHEN r.TOT_AMT_ACTUAL > 0 THEN ri.QTY ELSE 0 END) AS sales_qty,
+        SUM(CASE WHEN r.TOT_AMT_ACTUAL > 0 THEN ri.TOT_AMT_ACTUAL ELSE 0 END) AS sales_amount,
+        SUM(CASE WHEN r.TOT_AMT_ACTUAL > 0 THEN ri.TOT_AMT_LIST ELSE 0 END) AS sales_amount_list,
+        -- 退货数据（负单）
+        SUM(CASE WHEN r.TOT_AMT_ACTUAL < 0 THEN ABS(ri.QTY) ELSE 0 END) AS return_qty,
+        SUM(CASE WHEN r.TOT_AMT_ACTUAL < 0 THEN ABS(ri.TOT_AMT_ACTUAL) ELSE 0 END) AS return_amount,
+        -- 订单数
+        COUNT(DISTINCT CASE WHEN r.TOT_AMT_ACTUAL > 0 THEN r.ID END) AS order_count
+    FROM M_RETAILITEM ri
+    LEFT JOIN M_RETAIL r ON ri.M_RETAIL_ID = r.ID
+    LEFT JOIN C_STORE s ON r.C_STORE_ID = s.ID
+    LEFT JOIN M_PRODUCT p ON ri.M_PRODUCT_ID = p.ID
+    WHERE r.ISACTIVE = 'Y'
+        AND r.STATUS = 2
+        AND r.BILLDATE >= :start_date
+        AND r.BILLDATE <= :end_date
+        AND ri.M_PRODUCTALIAS_ID IS NOT NULL
+        AND (s.CODE LIKE 'DS%' OR s.IS_ALLO2OSTORAGE = 'Y')
+        AND p.M_DIM4_ID IN ({MAIN_CATEGORY_IN})
+    GROUP BY r.BILLDATE, r.C_STORE_ID, s.CODE, NVL(s.IS_ALLO2OSTORAGE, 'N'), ri.M_PRODUCT_ID, ri.M_PRODUCTALIAS_ID
+    """
+
+
+def sales_daily_params(start_date, end_date):
+    """SALES_DAILY_SQL 的绑定变量"""
+    return with_categories({'start_date': int(start_date), 'end_date': int(end_date)})
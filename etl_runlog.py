@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+"""
+何方珠宝 - ETL运行日志与断点续跑（公共模块）
+run_etl 每个阶段在 etl_log 中记录一行：运行ID、业务日期、起止时间、读取/写入行数、状态与错误信息。
+失败后以 --resume <run_id> 重跑时，同一业务日期内该运行已成功的阶段直接跳过，只执行失败/未执行的阶段。
+
+行数按阶段线程统计：etl_extract.iter_batches 计入读取行数，etl_load 的批量写入/upsert/发布计入写入行数；
+阶段内另开线程写入的分片（etl_load.parallel_load）以发布到目标表时的行数计入。
+"""
+
+import logging
+import threading
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+# etl_log 早于运行ID存在，旧表按需补齐这两列
+RUN_COLUMNS = [
+    ("run_id", "VARCHAR(32) DEFAULT NULL COMMENT '运行ID（同一次 run_etl 的各阶段相同，续跑沿用）'"),
+    ("biz_date", "INT DEFAULT NULL COMMENT '业务日期（运行开始当天，YYYYMMDD）'"),
+]
+
+_local = threading.local()
+
+
+def ensure_log_table(engine):
+    """确保 etl_log 表存在且含运行ID/业务日期列"""
+    with engine.begin() as conn:
+        conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS etl_log (
+                id BIGINT NOT NULL AUTO_INCREMENT,
+                job_name VARCHAR(100) NOT NULL COMMENT '任务名称',
+                job_type VARCHAR(50) DEFAULT NULL COMMENT '任务类型',
+                source_table VARCHAR(100) DEFAULT NULL COMMENT '源表',
+                target_table VARCHAR(100) DEFAULT NULL COMMENT '目标表',
+                start_time DATETIME DEFAULT NULL COMMENT '开始时间',
+                end_time DATETIME DEFAULT NULL COMMENT '结束时间',
+                rows_read INT DEFAULT 0 COMMENT '读取行数',
+                rows_written INT DEFAULT 0 COMMENT '写入行数',
+                status VARCHAR(20) DEFAULT NULL COMMENT '状态',
+                error_message TEXT COMMENT '错误信息',
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (id)
+            ) COMMENT='ETL执行日志表'
+        """))
+        for col_name, col_def in RUN_COLUMNS:
+            exists = conn.execute(text("""
+                SELECT COUNT(*) FROM information_schema.COLUMNS
+                WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'etl_log' AND COLUMN_NAME = :col
+            """), {"col": col_name}).fetchone()[0] > 0
+            if not exists:
+                logger.info(f"添加新字段: etl_log.{col_name}")
+                conn.execute(text(f"ALTER TABLE etl_log ADD COLUMN {col_name} {col_def}"))
+        has_index = conn.execute(text("""
+            SELECT COUNT(*) FROM information_schema.STATISTICS
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'etl_log' AND INDEX_NAME = 'idx_run_id'
+        """)).fetchone()[0] > 0
+        if not has_index:
+            logger.info("添加索引: etl_log.run_id")
+            conn.execute(text("ALTER TABLE etl_log ADD INDEX idx_run_id (run_id)"))
+
+
+def new_run_id():
+    """生成运行ID：开始时间 + 随机后缀（如 20261018_030001_3fa2c1）"""
+    return f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:6]}"
+
+
+def business_date():
+    """业务日期：运行开始当天（与库存快照、库存健康度的 snapshot_date 一致）"""
+    return int(datetime.now().strftime('%Y%m%d'))
+
+
+def latest_run(engine):
+    """最近一次运行的运行ID，无记录返回None"""
+    ensure_log_table(engine)
+    with engine.connect() as conn:
+        row = conn.execute(text(
+            "SELECT run_id FROM etl_log WHERE run_id IS NOT NULL ORDER BY id DESC LIMIT 1"
+        )).fetchone()
+    return row[0] if row else None
+
+
+def run_date(engine, run_id):
+    """运行的业务日期，运行ID不存在返回None"""
+    ensure_log_table(engine)
+    with engine.connect() as conn:
+        row = conn.execute(text(
+            "SELECT MAX(biz_date) FROM etl_log WHERE run_id = :run_id"
+        ), {"run_id": run_id}).fetchone()
+    return row[0] if row else None
+
+
+def succeeded_stages(engine, run_id, biz_date):
+    """该运行在业务日期内已成功的阶段名集合"""
+    ensure_log_table(engine)
+    with engine.connect() as conn:
+        rows = conn.execute(text("""
+            SELECT DISTINCT job_name FROM etl_log
+            WHERE run_id = :run_id AND biz_date = :biz_date AND status = 'SUCCESS'
+        """), {"run_id": run_id, "biz_date": biz_date}).fetchall()
+    return {r[0] for r in rows}
+
+
+def count_rows(read=0, written=0):
+    """计入当前阶段线程的读取/写入行数（不在阶段内时忽略）"""
+    counts = getattr(_local, 'counts', None)
+    if counts is not None:
+        counts['rows_read'] += read
+        counts['rows_written'] += written
+
+
+def _start(engine, run_id, biz_date, job_name):
+    with engine.begin() as conn:
+        return conn.execute(text("""
+            INSERT INTO etl_log (run_id, biz_date, job_name, job_type, start_time, status)
+            VALUES (:run_id, :biz_date, :job, :job_type, NOW(), 'RUNNING')
+        """), {"run_id": run_id, "biz_date": biz_date, "job": job_name,
+               "job_type": job_name.split('_')[0].upper()}).lastrowid
+
+
+def _finish(engine, log_id, status, counts, error=None):
+    with engine.begin() as conn:
+        conn.execute(text("""
+            UPDATE etl_log
+            SET end_time = NOW(), status = :status, rows_read = :rows_read,
+                rows_written = :rows_written, error_message = :err
+            WHERE id = :id
+        """), {"id": log_id, "status": status, "err": error, **counts})
+
+
+@contextmanager
+def track_stage(engine, run_id, biz_date, job_name):
+    """
+    记录一个阶段的执行（在阶段线程内使用）：开始时写入 RUNNING，结束时更新为 SUCCESS / FAILED 及行数
+    日志表写入失败只告警，不影响阶段本身
+    """
+    log_id = None
+    try:
+        log_id = _start(engine, run_id, biz_date, job_name)
+    except Exception as e:
+        logger.warning(f"写入 etl_log 失败（{job_name}）: {e}")
+
+    _local.counts = {'rows_read': 0, 'rows_written': 0}
+    try:
+        yield
+    except Exception as e:
+        counts, _local.counts = _local.counts, None
+        if log_id is not None:
+            try:
+                _finish(engine, log_id, 'FAILED', counts, str(e)[:2000])
+            except Exception as log_error:
+                logger.warning(f"更新 etl_log 失败（{job_name}）: {log_error}")
+        raise
+    counts, _local.counts = _local.counts, None
+    logger.info(f"{job_name}：读取 {counts['rows_read']} 条，写入 {counts['rows_written']} 条")
+    if log_id is not None:
+        try:
+            _finish(engine, log_id, 'SUCCESS', counts)
+        except Exception as e:
+            logger.warning(f"更新 etl_log 失败（{job_name}）: {e}")
+
+
+def show(engine, run_id):
+    """输出一次运行各阶段的记录"""
+    ensure_log_table(engine)
+    with engine.connect() as conn:
+        rows = conn.execute(text("""
+            SELECT job_name, status, start_time, end_time, rows_read, rows_written, error_message
+            FROM etl_log WHERE run_id = :run_id ORDER BY id
+        """), {"run_id": run_id}).fetchall()
+    if not rows:
+        print(f"运行 {run_id} 无记录")
+        return
+    print(f"运行 {run_id}：")
+    for job, status, start, end, read, written, err in rows:
+        print(f"  {job:<16} {status:<8} {start} → {end}  读取 {read}  写入 {written}"
+              + (f"  {err[:80]}" if err else ""))
+
+
+if __name__ == '__main__':
+    # python etl_runlog.py [run_id]   查看某次运行（默认最近一次）各阶段状态
+    import sys
+    from etl_conn import get_mysql_engine
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    engine = get_mysql_engine()
+    run_id = sys.argv[1] if len(sys.argv) > 1 else latest_run(engine)
+    if run_id is None:
+        print("etl_log 中没有运行记录")
+    else:
+        show(engine, run_id)
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""
+何方珠宝 - 日内销售微批同步ETL
+etl_dws_sales.run(include_today=True) 每次重新抽取并重写整天，同步越频繁成本越高。
+微批沿用零售单ODS的 MODIFIEDDATE / ID 高水位（etl_ods_retail），每轮：
+1. 只抽取上次以来新增或修改的 M_RETAIL 单据（含审核为 status=2、作废 isactive='N' 等状态变更）及其明细，落地ODS
+2. 收集这些单据变更前后涉及的 (date_id, store_id, product_id, m_productalias_id)
+3. 在同一事务内删除这些粒度的 dws_sales_daily 旧行，由ODS重新聚合写回（口径同 etl_dws_sales.REBUILD_SELECT_SQL）
+4. 推进高水位后提交
+Oracle端只查询变更单据，MySQL端只重算受影响的粒度，可每5分钟执行一次。
+与 etl_ods_retail 以命名锁互斥，拿不到锁（日终ODS落地正在执行）时跳过本轮。
+
+用法：
+    python etl_sales_micro.py          # 执行一轮
+    python etl_sales_micro.py loop     # 每 SALES_MICRO_INTERVAL_SECONDS 秒执行一轮
+"""
+
+import logging
+import sys
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+from config import SALES_MICRO_INTERVAL_SECONDS, ROLLING_REFRESH_DAYS
+from etl_conn import get_mysql_engine
+from etl_dws_sales import GRAIN_COLS, REBUILD_SELECT_SQL
+from etl_load import delete_rows
+from etl_queries import sales_daily_params
+from etl_ods_retail import JOB_NAME as ODS_JOB_NAME, ODS_LOCK, build_filter, load_to_mysql, new_batch_id
+from etl_runlog import count_rows
+from etl_state import get_watermark, named_lock
+
+# 配置日志
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+
+INSERT_COLS = ('date_id, store_id, store_code, is_cloud_store, product_id, m_productalias_id, '
+               'sales_qty, sales_amount, sales_amount_list, return_qty, return_amount, order_count, etl_time')
+
+# 由ODS重新聚合某一天受影响的粒度；{keys}：(店仓, 商品, SKU) 行构造器列表
+# 派生表绑定单个日期（start_date = end_date），聚合范围限定为当天，不依赖外层条件下推
+MICRO_SQL = f"""
+    INSERT INTO dws_sales_daily ({INSERT_COLS})
+    SELECT {INSERT_COLS}
+    FROM ({REBUILD_SELECT_SQL}) agg
+    WHERE ({', '.join(GRAIN_COLS[1:])}) IN ({{keys}})
+    """
+
+
+def apply_keys(conn, keys, batch_size=1000):
+    """
+    在调用方事务内重算受影响粒度：先删后由ODS聚合写回（单据作废/不再满足口径的粒度只删不插）
+    按日期分组，每条语句只聚合一天
+    返回写入行数
+    """
+    keys = sorted(keys)
+    if not keys:
+        return 0
+    deleted = delete_rows(conn, 'dws_sales_daily', GRAIN_COLS, keys, batch_size)
+    by_date = {}
+    for key in keys:
+        by_date.setdefault(key[0], []).append(key[1:])
+    written = 0
+    for date_id, day_keys in by_date.items():
+        for i in range(0, len(day_keys), batch_size):
+            params = sales_daily_params(date_id, date_id)
+            rows = []
+            for j, key in enumerate(day_keys[i:i + batch_size]):
+                names = []
+                for n, value in enumerate(key):
+                    params[f"k{j}_{n}"] = value
+                    names.append(f":k{j}_{n}")
+                rows.append(f"({', '.join(names)})")
+            written += conn.execute(text(MICRO_SQL.format(keys=', '.join(rows))), params).rowcount
+    count_rows(written=written)
+    logger.info(f"重算 {len(keys)} 个粒度：删除 {deleted} 行，写入 {written} 行")
+    return written
+
+
+def run(engine=None, pool=None):
+    """
+    执行一轮微批
+    engine/pool: MySQL引擎与Oracle会话池，默认进程内共享实例
+    返回重算的粒度数；ODS尚未初始化或本轮被跳过时返回0
+    """
+    start_time = datetime.now()
+    engine = engine or get_mysql_engine()
+
+    with named_lock(engine, ODS_LOCK) as acquired:
+        if not acquired:
+            logger.info("ODS落地正在执行，跳过本轮微批")
+            return 0
+
+        state = get_watermark(engine, ODS_JOB_NAME)
+        if state is None or state['watermark_time'] is None:
+            logger.warning("零售单ODS尚未初始化（无高水位），请先执行 etl_ods_retail.py")
+            return 0
+
+        affected = set()
+
+        def on_change(conn, keys):
+            affected.update(keys)
+            apply_keys(conn, keys)
+
+        where, params = build_filter(state)
+        load_to_mysql(where, params, new_batch_id(), engine, pool, on_change=on_change)
+
+    # 改动了滚动汇总增量维护范围之外的历史日期时，下次维护改为全量重算
+    oldest = int((datetime.now() - timedelta(days=ROLLING_REFRESH_DAYS - 1)).strftime('%Y%m%d'))
+    if any(k[0] < oldest for k in affected):
+        from etl_sales_rolling import invalidate as invalidate_rolling
+        invalidate_rolling(engine)
+
+    duration = (datetime.now() - start_time).total_seconds()
+    logger.info(f"✓ 微批完成：{len(affected)} 个粒度，耗时 {duration:.1f} 秒")
+    return len(affected)
+
+
+def loop(interval=None):
+    """按固定间隔循环执行微批（单轮失败只记录日志，下一轮继续）"""
+    interval = interval or SALES_MICRO_INTERVAL_SECONDS
+    logger.info(f"日内微批循环启动，间隔 {interval} 秒")
+    while True:
+        started = time.monotonic()
+        try:
+            run()
+        except Exception as e:
+            logger.error(f"✗ 微批失败: {e}")
+        time.sleep(max(0, interval - (time.monotonic() - started)))
+
+
+if __name__ == '__main__':
+    from etl_conn import close_all
+    try:
+        if len(sys.argv) > 1 and sys.argv[1] == 'loop':
+            loop(int(sys.argv[2]) if len(sys.argv) > 2 else None)
+        else:
+            run()
+    finally:
+        close_all()
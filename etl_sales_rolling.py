@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+"""
+何方珠宝 - SKU滚动销售汇总（公共模块）
+ads_inventory_health 原先每次扫描近30天 dws_sales_daily（关联 dim_store 过滤电商+云仓）重算
+sales_qty_30d / sales_qty_7d / return_qty_30d 等字段；改为维护两张小表：
+- dws_sales_sku_day：窗口内每天的 SKU 级汇总（已按电商+云仓口径过滤、合并店仓）
+- dws_sales_rolling：每个 (product_id, sku_id) 一行的近7/30天累计，ADS 直接关联
+
+增量维护（窗口从上次的 A 日推进到 T 日）在单事务内：
+1. 按 A 日窗口减去受影响日期的贡献（需重新汇总的日期 + 滑出7/30天窗口的日期）
+2. 重新汇总需要更新的日期（A 之后新进入窗口的日期 + 最近 ROLLING_REFRESH_DAYS 天）写入 dws_sales_sku_day
+3. 按 T 日窗口加回同一批日期的贡献
+窗口口径与原SQL一致：30天为 date_id >= T-30，7天为 date_id >= T-7。
+距上次全量重算超过 ROLLING_FULL_RECOMPUTE_DAYS 天（或状态缺失/跨度超出窗口）时全量重算，
+修正历史回补、店仓口径变化等增量无法感知的偏差。
+
+用法：
+    python etl_sales_rolling.py            # 增量维护到今天
+    python etl_sales_rolling.py full       # 全量重算
+    python etl_sales_rolling.py check      # 与直接扫描 dws_sales_daily 的结果比对
+"""
+
+import logging
+import sys
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+from config import ROLLING_REFRESH_DAYS, ROLLING_FULL_RECOMPUTE_DAYS
+from etl_conn import get_mysql_engine
+from etl_state import get_watermark, set_watermark
+
+logger = logging.getLogger(__name__)
+
+JOB_NAME = 'dws_sales_rolling'
+
+WINDOW_DAYS = 30
+SHORT_WINDOW_DAYS = 7
+
+MEASURES = ['sales_qty_30d', 'sales_amt_30d', 'sales_qty_7d', 'return_qty_30d', 'return_amount_30d']
+
+
+def ensure_tables(engine):
+    """确保日汇总表与滚动汇总表存在"""
+    with engine.begin() as conn:
+        conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS dws_sales_sku_day (
+                date_id INT NOT NULL COMMENT '日期ID',
+                product_id BIGINT NOT NULL COMMENT '商品ID',
+                sku_id BIGINT NOT NULL COMMENT 'SKU ID（条码）',
+                sales_qty DECIMAL(14,2) NOT NULL DEFAULT 0 COMMENT '销售数量',
+                sales_amount DECIMAL(16,2) NOT NULL DEFAULT 0 COMMENT '销售金额',
+                return_qty DECIMAL(14,2) NOT NULL DEFAULT 0 COMMENT '退货数量',
+                return_amount DECIMAL(16,2) NOT NULL DEFAULT 0 COMMENT '退货金额',
+                PRIMARY KEY (date_id, product_id, sku_id)
+            ) COMMENT='SKU日销售汇总（电商+云仓，滚动窗口内）'
+        """))
+        conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS dws_sales_rolling (
+                product_id BIGINT NOT NULL COMMENT '商品ID',
+                sku_id BIGINT NOT NULL COMMENT 'SKU ID（条码）',
+                sales_qty_30d DECIMAL(14,2) NOT NULL DEFAULT 0 COMMENT '近30天销售数量',
+                sales_amt_30d DECIMAL(16,2) NOT NULL DEFAULT 0 COMMENT '近30天销售金额',
+                sales_qty_7d DECIMAL(14,2) NOT NULL DEFAULT 0 COMMENT '近7天销售数量',
+                return_qty_30d DECIMAL(14,2) NOT NULL DEFAULT 0 COMMENT '近30天退货数量',
+                return_amount_30d DECIMAL(16,2) NOT NULL DEFAULT 0 COMMENT '近30天退货金额',
+                PRIMARY KEY (product_id, sku_id)
+            ) COMMENT='SKU近7/30天滚动销售汇总'
+        """))
+
+
+def _shift(date_id, days):
+    """date_id 加减天数"""
+    return int((datetime.strptime(str(date_id), '%Y%m%d') + timedelta(days=days)).strftime('%Y%m%d'))
+
+
+# 按口径（电商+云仓，使用dim_store口径）汇总 [start_date, end_date] 的 SKU 日销售
+SKU_DAY_SQL = """
+    INSERT INTO dws_sales_sku_day (date_id, product_id, sku_id, sales_qty, sales_amount, return_qty, return_amount)
+    SELECT
+        ds.date_id,
+        ds.product_id,
+        ds.m_productalias_id AS sku_id,
+        SUM(ds.sales_qty),
+        SUM(ds.sales_amount),
+        SUM(ds.return_qty),
+        SUM(ds.return_amount)
+    FROM dws_sales_daily ds
+    LEFT JOIN dim_store s ON ds.store_id = s.store_id
+    WHERE ds.date_id >= :start_date AND ds.date_id <= :end_date
+        AND (s.store_code LIKE 'DS%%' OR s.is_cloud_store = 'Y')
+        AND ds.m_productalias_id IS NOT NULL
+    GROUP BY ds.date_id, ds.product_id, ds.m_productalias_id
+    """
+
+# 把 dws_sales_sku_day 中满足 {where} 的日期按 as_of 日的窗口乘以 :sign 累加到滚动表
+APPLY_SQL = """
+    INSERT INTO dws_sales_rolling (product_id, sku_id, sales_qty_30d, sales_amt_30d, sales_qty_7d,
+                                   return_qty_30d, return_amount_30d)
+    SELECT
+        product_id,
+        sku_id,
+        :sign * SUM(CASE WHEN date_id >= :w30 THEN sales_qty ELSE 0 END),
+        :sign * SUM(CASE WHEN date_id >= :w30 THEN sales_amount ELSE 0 END),
+        :sign * SUM(CASE WHEN date_id >= :w7 THEN sales_qty ELSE 0 END),
+        :sign * SUM(CASE WHEN date_id >= :w30 THEN return_qty ELSE 0 END),
+        :sign * SUM(CASE WHEN date_id >= :w30 THEN return_amount ELSE 0 END)
+    FROM dws_sales_sku_day
+    WHERE {where}
+    GROUP BY product_id, sku_id
+    ON DUPLICATE KEY UPDATE
+        sales_qty_30d = sales_qty_30d + VALUES(sales_qty_30d),
+        sales_amt_30d = sales_amt_30d + VALUES(sales_amt_30d),
+        sales_qty_7d = sales_qty_7d + VALUES(sales_qty_7d),
+        return_qty_30d = return_qty_30d + VALUES(return_qty_30d),
+        return_amount_30d = return_amount_30d + VALUES(return_amount_30d)
+    """
+
+
+def _apply(conn, where, params, as_of, sign):
+    """按 as_of 日的窗口把指定日期的贡献加到（sign=1）或减出（sign=-1）滚动表"""
+    conn.execute(text(APPLY_SQL.format(where=where)), {
+        **params, "sign": sign,
+        "w30": _shift(as_of, -WINDOW_DAYS), "w7": _shift(as_of, -SHORT_WINDOW_DAYS),
+    })
+
+
+def full_recompute(engine, as_of):
+    """全量重算窗口内的日汇总与滚动汇总（单事务）"""
+    logger.info(f"滚动销售汇总全量重算（截至 {as_of}）...")
+    with engine.begin() as conn:
+        conn.execute(text("DELETE FROM dws_sales_sku_day"))
+        conn.execute(text(SKU_DAY_SQL), {"start_date": _shift(as_of, -WINDOW_DAYS), "end_date": as_of})
+        conn.execute(text("DELETE FROM dws_sales_rolling"))
+        _apply(conn, "1 = 1", {}, as_of, 1)
+        set_watermark(conn, JOB_NAME, watermark_id=as_of, full=True)
+
+
+def incremental_update(engine, last, as_of, refresh_days=None):
+    """
+    从 last 日窗口推进到 as_of 日窗口（单事务）
+    受影响日期：重新汇总的日期 [max(last+1, as_of-refresh_days+1), as_of] ∪ 最近 refresh_days 天，
+    以及滑出30天窗口 [last-30, as_of-31]、滑出7天窗口 [last-7, as_of-8] 的日期
+    """
+    refresh_days = ROLLING_REFRESH_DAYS if refresh_days is None else refresh_days
+    refresh_start = max(_shift(as_of, -WINDOW_DAYS), min(_shift(last, 1), _shift(as_of, 1 - refresh_days)))
+    affected = (
+        "(date_id >= :refresh_start AND date_id <= :as_of)"
+        " OR (date_id >= :leave30_start AND date_id <= :leave30_end)"
+        " OR (date_id >= :leave7_start AND date_id <= :leave7_end)"
+    )
+    params = {
+        "refresh_start": refresh_start, "as_of": as_of,
+        "leave30_start": _shift(last, -WINDOW_DAYS), "leave30_end": _shift(as_of, -WINDOW_DAYS - 1),
+        "leave7_start": _shift(last, -SHORT_WINDOW_DAYS), "leave7_end": _shift(as_of, -SHORT_WINDOW_DAYS - 1),
+    }
+    logger.info(f"滚动销售汇总增量维护：{last} → {as_of}，重新汇总 {refresh_start} - {as_of}")
+    with engine.begin() as conn:
+        # 1. 按旧窗口减去受影响日期的贡献
+        _apply(conn, affected, params, last, -1)
+        # 2. 重新汇总需要更新的日期，清理滑出窗口的日期
+        conn.execute(text(
+            "DELETE FROM dws_sales_sku_day WHERE date_id >= :s AND date_id <= :e"
+        ), {"s": refresh_start, "e": as_of})
+        conn.execute(text(SKU_DAY_SQL), {"start_date": refresh_start, "end_date": as_of})
+        # 3. 按新窗口加回
+        _apply(conn, affected, params, as_of, 1)
+        conn.execute(text("DELETE FROM dws_sales_sku_day WHERE date_id < :w30"),
+                     {"w30": _shift(as_of, -WINDOW_DAYS)})
+        conn.execute(text(
+            "DELETE FROM dws_sales_rolling WHERE " + " AND ".join(f"{m} = 0" for m in MEASURES)
+        ))
+        set_watermark(conn, JOB_NAME, watermark_id=as_of)
+
+
+def refresh(engine=None, as_of=None, full=False):
+    """
+    维护滚动汇总到 as_of 日（默认今天）
+    状态缺失、窗口倒退、跨度超过窗口或距上次全量重算超过 ROLLING_FULL_RECOMPUTE_DAYS 天时全量重算
+    """
+    engine = engine or get_mysql_engine()
+    as_of = as_of or int(datetime.now().strftime('%Y%m%d'))
+    ensure_tables(engine)
+
+    state = get_watermark(engine, JOB_NAME)
+    last = int(state['watermark_id']) if state and state['watermark_id'] else None
+    stale = (
+        state is None or state['last_full_at'] is None
+        or datetime.now() - state['last_full_at'] > timedelta(days=ROLLING_FULL_RECOMPUTE_DAYS)
+    )
+    if full or stale or last is None or last > as_of or _shift(last, WINDOW_DAYS) < as_of:
+        full_recompute(engine, as_of)
+    else:
+        incremental_update(engine, last, as_of)
+
+    with engine.connect() as conn:
+        count = conn.execute(text("SELECT COUNT(*) FROM dws_sales_rolling")).scalar()
+    logger.info(f"滚动销售汇总完成，共 {count} 个SKU")
+    return count
+
+
+def invalidate(engine=None):
+    """历史日期被回补后调用：清除全量重算时间，下次维护时全量重算"""
+    engine = engine or get_mysql_engine()
+    with engine.begin() as conn:
+        conn.execute(text(
+            "UPDATE etl_watermark SET last_full_at = NULL WHERE job_name = :job"
+        ), {"job": JOB_NAME})
+    logger.info("滚动销售汇总已标记为待全量重算")
+
+
+def check(engine=None, as_of=None):
+    """与直接扫描 dws_sales_daily 的结果比对，返回存在差异的SKU数"""
+    engine = engine or get_mysql_engine()
+    as_of = as_of or int(datetime.now().strftime('%Y%m%d'))
+    sql = """
+        SELECT COUNT(*) FROM (
+            SELECT
+                ds.product_id, ds.m_productalias_id AS sku_id,
+                SUM(ds.sales_qty) AS sales_qty_30d,
+                SUM(ds.sales_amount) AS sales_amt_30d,
+                SUM(CASE WHEN ds.date_id >= :w7 THEN ds.sales_qty ELSE 0 END) AS sales_qty_7d,
+                SUM(ds.return_qty) AS return_qty_30d,
+                SUM(ds.return_amount) AS return_amount_30d
+            FROM dws_sales_daily ds
+            LEFT JOIN dim_store s ON ds.store_id = s.store_id
+            WHERE ds.date_id >= :w30
+                AND (s.store_code LIKE 'DS%%' OR s.is_cloud_store = 'Y')
+                AND ds.m_productalias_id IS NOT NULL
+            GROUP BY ds.product_id, ds.m_productalias_id
+        ) raw
+        LEFT JOIN dws_sales_rolling r ON raw.product_id = r.product_id AND raw.sku_id = r.sku_id
+        WHERE r.sku_id IS NULL
+            OR raw.sales_qty_30d <> r.sales_qty_30d OR raw.sales_amt_30d <> r.sales_amt_30d
+            OR raw.sales_qty_7d <> r.sales_qty_7d OR raw.return_qty_30d <> r.return_qty_30d
+            OR raw.return_amount_30d <> r.return_amount_30d
+    """
+    with engine.connect() as conn:
+        diff = conn.execute(text(sql), {
+            "w30": _shift(as_of, -WINDOW_DAYS), "w7": _shift(as_of, -SHORT_WINDOW_DAYS)
+        }).scalar()
+    if diff:
+        logger.warning(f"滚动销售汇总与明细不一致：{diff} 个SKU（可执行 full 全量重算）")
+    else:
+        logger.info("滚动销售汇总与明细一致")
+    return diff
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    command = sys.argv[1] if len(sys.argv) > 1 else 'refresh'
+    if command == 'full':
+        refresh(full=True)
+    elif command == 'check':
+        check()
+    else:
+        refresh()
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""
+何方珠宝 - 抽取暂存区（公共模块）
+Oracle抽取结果逐批写入本地Parquet，重跑/回补时直接读取，避免重复查询ERP
+
+只有调用方显式 cache=True 的抽取才使用暂存（当前为截止到昨天及以前的销售日期范围）：
+高水位增量、库存快照、含当天的销售等结果随时间变化的查询按 SQL+绑定变量 复用会读到旧结果
+
+目录结构：STAGE_DIR/YYYYMMDD/<查询键>_<HHMMSS>/part-00000.parquet ...
+- 查询键：SQL + 绑定变量 + 抽取模式 的 sha1
+- 全部批次写完后才写入 _SUCCESS 标记，中途失败/中断的暂存不会被复用
+- 有效期 STAGE_MAX_AGE_HOURS 内命中最近一次完整暂存；保留 STAGE_RETENTION_DAYS 天
+- 需要 pyarrow（可选依赖），未安装时自动关闭暂存
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+from config import STAGE_ENABLED, STAGE_DIR, STAGE_MAX_AGE_HOURS, STAGE_RETENTION_DAYS
+
+try:
+    import pyarrow  # noqa: F401  pandas.to_parquet/read_parquet 的引擎
+except ImportError:  # pyarrow 为可选依赖，未安装时不暂存
+    pyarrow = None
+
+logger = logging.getLogger(__name__)
+
+SUCCESS_MARKER = '_SUCCESS'
+
+# 运行期开关（configure() 修改）：enabled=是否使用暂存；refresh=忽略已有暂存强制重新抽取
+_settings = {'enabled': STAGE_ENABLED, 'refresh': False}
+
+
+def configure(enabled=None, refresh=None):
+    """调整运行期开关（如命令行 --refresh、基准测试关闭暂存）"""
+    if enabled is not None:
+        _settings['enabled'] = enabled
+    if refresh is not None:
+        _settings['refresh'] = refresh
+
+
+def is_enabled(cache=None):
+    """本次抽取是否使用暂存：调用方显式 cache=True 且全局开关开启"""
+    enabled = bool(cache) and _settings['enabled']
+    if enabled and pyarrow is None:
+        logger.warning("未安装pyarrow，抽取暂存已关闭")
+        _settings['enabled'] = False
+        return False
+    return enabled
+
+
+def query_key(sql, params=None, fetch_mode=None):
+    """查询键：SQL（忽略首尾空白）+ 绑定变量 + 抽取模式"""
+    payload = json.dumps(
+        {'sql': sql.strip(), 'params': params, 'fetch_mode': fetch_mode},
+        sort_keys=True, default=str, ensure_ascii=False
+    )
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()[:16]
+
+
+def lookup(key, max_age_hours=None):
+    """查找有效期内最近一次完整暂存，返回目录；无或 refresh 时返回None"""
+    if _settings['refresh'] or not os.path.isdir(STAGE_DIR):
+        return None
+    max_age = timedelta(hours=STAGE_MAX_AGE_HOURS if max_age_hours is None else max_age_hours)
+    now = datetime.now()
+    # 日期分区倒序，最多回看到有效期覆盖的最早日期
+    earliest = (now - max_age).strftime('%Y%m%d')
+    for day in sorted(os.listdir(STAGE_DIR), reverse=True):
+        if day < earliest:
+            break
+        day_dir = os.path.join(STAGE_DIR, day)
+        if not os.path.isdir(day_dir):
+            continue
+        for name in sorted(os.listdir(day_dir), reverse=True):
+            if not name.startswith(key + '_'):
+                continue
+            path = os.path.join(day_dir, name)
+            extracted_at = datetime.strptime(day + name[len(key) + 1:], '%Y%m%d%H%M%S')
+            if now - extracted_at <= max_age and os.path.exists(os.path.join(path, SUCCESS_MARKER)):
+                return path
+    return None
+
+
+def read_batches(path):
+    """按写入顺序读取暂存批次（生成器）"""
+    parts = sorted(f for f in os.listdir(path) if f.endswith('.parquet'))
+    logger.info(f"读取暂存 {path}（{len(parts)} 批）")
+    for part in parts:
+        yield pd.read_parquet(os.path.join(path, part))
+
+
+def begin(key):
+    """创建本次抽取的暂存目录（按抽取日期分区）"""
+    now = datetime.now()
+    path = os.path.join(STAGE_DIR, now.strftime('%Y%m%d'), f"{key}_{now.strftime('%H%M%S')}")
+    # 同一秒内同一查询重复抽取时覆盖未完成的旧目录
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path)
+    return path
+
+
+def write_batch(path, batch_no, df):
+    """写入一批"""
+    df.to_parquet(os.path.join(path, f"part-{batch_no:05d}.parquet"), index=False)
+
+
+def commit(path):
+    """标记暂存完整可复用"""
+    open(os.path.join(path, SUCCESS_MARKER), 'w').close()
+    logger.info(f"抽取结果已暂存：{path}")
+
+
+def abort(path):
+    """丢弃未完成的暂存"""
+    shutil.rmtree(path, ignore_errors=True)
+
+
+def purge(retention_days=None):
+    """删除超过保留天数的日期分区，返回删除的分区数"""
+    retention_days = STAGE_RETENTION_DAYS if retention_days is None else retention_days
+    if not os.path.isdir(STAGE_DIR):
+        return 0
+    cutoff = (datetime.now() - timedelta(days=retention_days)).strftime('%Y%m%d')
+    removed = 0
+    for day in os.listdir(STAGE_DIR):
+        if day.isdigit() and len(day) == 8 and day < cutoff:
+            shutil.rmtree(os.path.join(STAGE_DIR, day), ignore_errors=True)
+            removed += 1
+    if removed:
+        logger.info(f"已清理 {removed} 个过期暂存分区（保留 {retention_days} 天）")
+    return removed
+
+
+if __name__ == '__main__':
+    # 手动清理：python etl_stage.py [保留天数]
+    import sys
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    purge(int(sys.argv[1]) if len(sys.argv) > 1 else None)
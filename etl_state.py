@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+何方珠宝 - ETL状态存储（公共模块）
+在MySQL etl_watermark 表中记录各增量任务的高水位（修改时间 / 单据ID）与最近一次全量对账时间；
+共享同一高水位的任务（如零售单ODS落地与日内微批）以命名锁互斥
+"""
+
+import logging
+from contextlib import contextmanager
+
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+
+def ensure_watermark_table(engine):
+    """确保高水位状态表存在"""
+    with engine.begin() as conn:
+        conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS etl_watermark (
+                job_name VARCHAR(100) NOT NULL COMMENT '任务名称',
+                watermark_time DATETIME DEFAULT NULL COMMENT '源表修改时间高水位',
+                watermark_id BIGINT DEFAULT NULL COMMENT '源表ID高水位',
+                last_full_at DATETIME DEFAULT NULL COMMENT '最近一次全量对账时间',
+                updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+                PRIMARY KEY (job_name)
+            ) COMMENT='增量抽取高水位'
+        """))
+
+
+def get_watermark(engine, job_name):
+    """读取任务高水位，返回 dict(watermark_time, watermark_id, last_full_at)；无记录返回None"""
+    ensure_watermark_table(engine)
+    with engine.connect() as conn:
+        row = conn.execute(text(
+            "SELECT watermark_time, watermark_id, last_full_at FROM etl_watermark WHERE job_name = :job"
+        ), {"job": job_name}).fetchone()
+    if row is None:
+        return None
+    return {'watermark_time': row[0], 'watermark_id': row[1], 'last_full_at': row[2]}
+
+
+def set_watermark(conn, job_name, watermark_time=None, watermark_id=None, full=False):
+    """
+    推进任务高水位（在调用方事务内执行，与数据写入一起提交）
+    传 None 的字段保持原值；full=True 时同时记录全量对账时间
+    """
+    conn.execute(text("""
+        INSERT INTO etl_watermark (job_name, watermark_time, watermark_id, last_full_at)
+        VALUES (:job, :wm_time, :wm_id, IF(:full, NOW(), NULL))
+        ON DUPLICATE KEY UPDATE
+            watermark_time = COALESCE(VALUES(watermark_time), watermark_time),
+            watermark_id = COALESCE(VALUES(watermark_id), watermark_id),
+            last_full_at = IF(:full, NOW(), last_full_at)
+    """), {"job": job_name, "wm_time": watermark_time, "wm_id": watermark_id, "full": 1 if full else 0})
+    logger.info(f"高水位已更新：{job_name} time={watermark_time} id={watermark_id}{'（全量对账）' if full else ''}")
+
+
+@contextmanager
+def named_lock(engine, name, timeout=0):
+    """
+    MySQL命名锁（GET_LOCK），防止同一任务的多个进程并发推进同一高水位
+    在独立连接上持有，退出时释放；timeout 秒内拿不到锁时 yield False，由调用方决定跳过或报错
+    """
+    with engine.connect() as conn:
+        acquired = conn.execute(text("SELECT GET_LOCK(:name, :timeout)"),
+                                {"name": name, "timeout": timeout}).scalar() == 1
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                conn.execute(text("SELECT RELEASE_LOCK(:name)"), {"name": name})
@@ -5,10 +5,9 @@
 """
 
 import logging
-from datetime import datetime, timedelta
+from datetime import datetime
 import sys
 import os
-from sqlalchemy import create_engine, text
 
 # 配置日志
 logging.basicConfig(
@@ -30,104 +29,147 @@ if PROJECT_DIR not in sys.path:
     sys.path.insert(0, PROJECT_DIR)
 
 
-def run_all():
-    """执行所有ETL任务"""
+def build_stages(engine, pool):
+    """
+    ETL阶段依赖图（etl_dag）
+    维度、零售ODS、库存互不依赖，可并发；销售排在ODS与维度之后（ODS失败时改从Oracle聚合）；
+    库存健康度依赖全部上游，任一失败则跳过，避免用不完整数据覆盖ADS。
+    DIM_EXTRACT_MODE=async 时三个维度合为一个 dims 阶段（etl_dim_async，ERP并发查询数受 DIM_CONCURRENCY 限制），
+    sequential 时为前后串联的三个阶段
+    """
+    from config import DIM_EXTRACT_MODE
+    from etl_dag import stage
+
+    def dim_product(results):
+        from etl_dim_product import run as run_dim_product
+        run_dim_product(engine=engine, pool=pool)
+
+    def dim_sku(results):
+        from etl_dim_sku import run as run_dim_sku
+        run_dim_sku(engine=engine, pool=pool)
+
+    def dim_store(results):
+        from etl_dim_store import run as run_dim_store
+        run_dim_store(engine=engine, pool=pool)
+
+    def dims(results):
+        from etl_dim_async import run as run_dims
+        run_dims(engine=engine, raise_on_failure=True)
+
+    def ods_retail(results):
+        from etl_ods_retail import run as run_ods_retail
+        run_ods_retail(engine=engine, pool=pool)
+
+    def dws_sales(results):
+        # ODS落地失败时本次改从Oracle聚合，避免用过期ODS覆盖
+        from etl_dws_sales import run as run_dws_sales
+        source = 'oracle' if results['ods_retail'] != 'SUCCESS' else None
+        run_dws_sales(days_back=1, include_today=True, engine=engine, pool=pool, source=source)  # 实时同步（含当天）
+
+        # 覆盖性校验：只回补近30天中缺失/行数异常的日期区间
+        from etl_coverage import repair as repair_sales_coverage
+        repair_sales_coverage(engine=engine, pool=pool)
+
+    def dws_inventory(results):
+        from etl_dws_inventory import run as run_dws_inventory
+        run_dws_inventory(engine=engine, pool=pool)
+
+    def ads_health(results):
+        from etl_ads_health import run as run_ads_health
+        run_ads_health(engine=engine)
+
+    if DIM_EXTRACT_MODE == 'async':
+        # 一个阶段内并发抽取三个维度，ERP上同时执行的维度查询数不超过 DIM_CONCURRENCY
+        dim_stages = [stage('dims', dims)]
+    else:
+        # sequential 时维度前后串联，同一时刻只有一个维度查询在ERP上执行
+        dim_stages = [
+            stage('dim_product', dim_product),
+            stage('dim_sku', dim_sku, after=['dim_product']),
+            stage('dim_store', dim_store, after=['dim_sku']),
+        ]
+    dim_names = [s.name for s in dim_stages]
+    return dim_stages + [
+        stage('ods_retail', ods_retail),
+        stage('dws_sales', dws_sales, after=['ods_retail'] + dim_names),
+        stage('dws_inventory', dws_inventory),
+        stage('ads_health', ads_health,
+              requires=dim_names + ['ods_retail', 'dws_sales', 'dws_inventory']),
+    ]
+
+
+def run_all(max_parallel=None, resume=None):
+    """执行所有ETL任务
+
+    整个流程共用一个Oracle会话池和一个MySQL引擎（etl_conn），注入各模块 run()。
+    各阶段按依赖图执行（etl_dag），互不依赖的阶段并发，同时执行的阶段数由 ETL_MAX_PARALLEL 限制。
+    每个阶段的状态与行数记录在 etl_log（etl_runlog）；resume 传入失败运行的运行ID（'last' 为最近一次）时，
+    沿用该运行ID，跳过同一业务日期内已成功的阶段。
+    """
     
     start_time = datetime.now()
     logger.info("#"*60)
     logger.info("#  何方珠宝 - 数仓ETL开始执行")
     logger.info("#"*60)
     
-    results = {}
-    
-    # 1. 商品维度
-    logger.info("\n>>> [1/6] Syncing product dimensions...")
+    from config import ETL_MAX_PARALLEL
+    from etl_conn import get_oracle_pool, get_mysql_engine, log_pool_stats
+    from etl_dag import run_dag, log_timings
+    from etl_runlog import ensure_log_table, new_run_id, business_date, latest_run, run_date, \
+        succeeded_stages, track_stage
+    from etl_stage import purge as purge_stage
     try:
-        from etl_dim_product import run as run_dim_product
-        run_dim_product()
-        results['dim_product'] = 'SUCCESS'
-    except Exception as e:
-        error_msg = str(e).encode('utf-8', errors='ignore').decode('utf-8')
-        results['dim_product'] = f'FAILED: {error_msg[:100]}'
-        logger.error(f"dim_product failed: {error_msg}")
-    
-    # 2. SKU维度
-    logger.info("\n>>> [2/6] Syncing sku dimensions...")
-    try:
-        from etl_dim_sku import run as run_dim_sku
-        run_dim_sku()
-        results['dim_sku'] = 'SUCCESS'
+        purge_stage()
     except Exception as e:
-        error_msg = str(e).encode('utf-8', errors='ignore').decode('utf-8')
-        results['dim_sku'] = f'FAILED: {error_msg[:100]}'
-        logger.error(f"dim_sku failed: {error_msg}")
+        logger.warning(f"清理过期暂存失败: {e}")
 
-    # 3. 店仓维度
-    logger.info("\n>>> [3/6] Syncing store dimensions...")
+    engine = get_mysql_engine()
     try:
-        from etl_dim_store import run as run_dim_store
-        run_dim_store()
-        results['dim_store'] = 'SUCCESS'
+        pool = get_oracle_pool()
     except Exception as e:
-        error_msg = str(e).encode('utf-8', errors='ignore').decode('utf-8')
-        results['dim_store'] = f'FAILED: {error_msg[:100]}'
-        logger.error(f"dim_store failed: {error_msg}")
-    
-    # 4. 销售数据
-    logger.info("\n>>> [4/6] Syncing sales data...")
-    try:
-        from etl_dws_sales import run as run_dws_sales, backfill as backfill_dws_sales
-        run_dws_sales(days_back=1, include_today=True)  # 实时同步（含当天）
-
-        # 覆盖性校验：若近30天数据不完整，则自动回补
-        end_dt = datetime.now() - timedelta(days=1)
-        start_dt = end_dt - timedelta(days=29)
-        end_date = int(end_dt.strftime('%Y%m%d'))
-        start_date = int(start_dt.strftime('%Y%m%d'))
-
-        from config import MYSQL_CONN_STR
-        engine = create_engine(MYSQL_CONN_STR)
-        with engine.connect() as conn:
-            row = conn.execute(text(
-                """
-                SELECT COUNT(DISTINCT date_id) AS day_cnt
-                FROM dws_sales_daily
-                WHERE date_id BETWEEN :start_date AND :end_date
-                """
-            ), {"start_date": start_date, "end_date": end_date}).fetchone()
-        engine.dispose()
-
-        day_cnt = row[0] if row else 0
-        if day_cnt < 30:
-            logger.warning(f"近30天销售数据仅覆盖{day_cnt}天，执行回补（{start_date} - {end_date}）...")
-            backfill_dws_sales(start_date, end_date)
-        results['dws_sales'] = 'SUCCESS'
-    except Exception as e:
-        error_msg = str(e).encode('utf-8', errors='ignore').decode('utf-8')
-        results['dws_sales'] = f'FAILED: {error_msg[:100]}'
-        logger.error(f"dws_sales failed: {error_msg}")
-    
-    # 5. 库存数据
-    logger.info("\n>>> [5/6] Syncing inventory data...")
+        # 建池失败时各Oracle任务会各自报错，MySQL侧任务（如ADS计算）仍可执行
+        logger.error(f"Oracle会话池创建失败: {e}")
+        pool = None
+
+    # DWS分区表预建未来日分区（未分区时不做处理）
     try:
-        from etl_dws_inventory import run as run_dws_inventory
-        run_dws_inventory()
-        results['dws_inventory'] = 'SUCCESS'
+        from etl_partition import maintain as maintain_partitions
+        maintain_partitions(engine)
     except Exception as e:
-        error_msg = str(e).encode('utf-8', errors='ignore').decode('utf-8')
-        results['dws_inventory'] = f'FAILED: {error_msg[:100]}'
-        logger.error(f"dws_inventory failed: {error_msg}")
-    
-    # 6. 库存健康度计算
-    logger.info("\n>>> [6/6] Calculating inventory health...")
+        logger.warning(f"分区维护失败: {e}")
+
+    # 运行ID：续跑时沿用原运行ID，只在业务日期相同时跳过已成功阶段（跨日续跑等同于全量重跑）
+    biz_date = business_date()
+    run_id, completed = None, set()
     try:
-        from etl_ads_health import run as run_ads_health
-        run_ads_health()
-        results['ads_health'] = 'SUCCESS'
+        ensure_log_table(engine)
+        if resume:
+            run_id = latest_run(engine) if resume == 'last' else resume
+            prev_date = run_date(engine, run_id) if run_id else None
+            if prev_date is None:
+                logger.warning(f"未找到运行 {resume}，按新运行执行")
+                run_id = None
+            elif prev_date != biz_date:
+                logger.warning(f"运行 {run_id} 的业务日期为 {prev_date}，不是今天（{biz_date}），全部阶段重新执行")
+            else:
+                completed = succeeded_stages(engine, run_id, biz_date)
     except Exception as e:
-        error_msg = str(e).encode('utf-8', errors='ignore').decode('utf-8')
-        results['ads_health'] = f'FAILED: {error_msg[:100]}'
-        logger.error(f"ads_health failed: {error_msg}")
+        logger.warning(f"读取 etl_log 失败，按新运行执行: {e}")
+    run_id = run_id or new_run_id()
+    logger.info(f"运行ID：{run_id}（业务日期 {biz_date}）")
+    if completed:
+        logger.info(f"续跑：{len(completed)} 个阶段已成功，跳过 {', '.join(sorted(completed))}")
+
+    def tracked(s):
+        def func(results):
+            with track_stage(engine, run_id, biz_date, s.name):
+                s.func(results)
+        return s._replace(func=func)
+
+    max_parallel = max_parallel or ETL_MAX_PARALLEL
+    logger.info(f"按依赖图执行ETL阶段（并发上限 {max_parallel}）...")
+    stages = [tracked(s) for s in build_stages(engine, pool)]
+    results, timings = run_dag(stages, max_workers=max_parallel, completed=completed)
     
     # 汇总结果
     end_time = datetime.now()
@@ -140,18 +182,41 @@ def run_all():
     all_success = True
     for task, result in results.items():
         logger.info(f"  {task}: {result}")
-        if 'fail' in result.lower() or 'error' in result.lower():
+        if result != 'SUCCESS':
             all_success = False
     
     logger.info(f"\nTotal time: {duration} seconds")
+    log_timings(stages, timings)
+    log_pool_stats()
     
     if all_success:
         logger.info("All tasks executed successfully!")
     else:
         logger.warning("Some tasks failed, please check the logs")
+        logger.warning(f"修复后续跑（只执行未成功的阶段）：python run_etl.py --resume {run_id}")
     
     return all_success
 
 
+def resume_arg(argv):
+    """解析 --resume [run_id]：未带运行ID时为 'last'（最近一次运行）；未指定返回None"""
+    if '--resume' not in argv:
+        return None
+    i = argv.index('--resume')
+    if i + 1 < len(argv) and not argv[i + 1].startswith('--'):
+        return argv[i + 1]
+    return 'last'
+
+
 if __name__ == '__main__':
-    run_all()
+    # python run_etl.py [--refresh] [--resume [run_id]]
+    # 默认在有效期内复用抽取暂存（失败后重跑不再重复查询ERP）；--refresh 忽略暂存重新抽取
+    # --resume：沿用失败运行的运行ID，跳过当天已成功的阶段（不带运行ID时续跑最近一次）
+    from etl_conn import close_all
+    from etl_stage import configure as configure_stage
+    if '--refresh' in sys.argv:
+        configure_stage(refresh=True)
+    try:
+        run_all(resume=resume_arg(sys.argv))
+    finally:
+        close_all()
@@ -37,17 +37,23 @@ logging.basicConfig(
 
 logger = logging.getLogger(__name__)
 
-def run_etl_with_error_handling():
-    """带错误处理的ETL执行"""
+def run_etl_with_error_handling(resume=None):
+    """带错误处理的ETL执行
+
+    resume: 续跑的运行ID（'last' 为最近一次），跳过当天已成功的阶段
+    """
     try:
         logger.info("="*80)
         logger.info("ETL自动化调度开始")
         logger.info(f"执行时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
         logger.info("="*80)
         
-        # 导入并执行ETL
+        # 导入并执行ETL（定时任务总是重新抽取，同时刷新暂存供手动重跑复用；续跑时复用暂存）
+        from etl_stage import configure as configure_stage
+        if not resume:
+            configure_stage(refresh=True)
         from run_etl import run_all
-        success = run_all()
+        success = run_all(resume=resume)
         
         if success:
             logger.info("✅ ETL执行成功")
@@ -72,5 +78,12 @@ def run_etl_with_error_handling():
         return 3
 
 if __name__ == '__main__':
-    exit_code = run_etl_with_error_handling()
+    # python scheduled_etl.py [--resume [run_id]]
+    from run_etl import resume_arg
+    exit_code = run_etl_with_error_handling(resume=resume_arg(sys.argv))
+    try:
+        from etl_conn import close_all
+        close_all()
+    except Exception as e:
+        logger.warning(f"关闭连接池时出错: {e}")
     sys.exit(exit_code)
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+何方珠宝 - Oracle抽取模式基准测试
+对比 tuple（逐行元组）与 arrow（列式）两种抽取模式的耗时与内存峰值
+
+用法：
+    python tools/bench_extract.py               # FA_STORAGE 快照 + 近30天 M_RETAILITEM
+    python tools/bench_extract.py --days 90     # 指定销售抽取天数
+
+每种 场景×模式 在独立子进程中执行，内存峰值取子进程的最大常驻内存（RSS），互不干扰。
+计时包含抽取 + 模块 transform()（旧路径的类型转换成本在 transform 中）。
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PROJECT_DIR not in sys.path:
+    sys.path.insert(0, PROJECT_DIR)
+
+SCENARIOS = ('fa_storage', 'm_retailitem')
+MODES = ('tuple', 'arrow')
+
+
+def peak_rss_mb():
+    """当前进程的内存峰值（MB）"""
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux 单位为KB，macOS 为字节
+        return peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024
+    except ImportError:
+        import psutil  # Windows 下需安装 psutil
+        return psutil.Process().memory_info().peak_wset / 1024 / 1024
+
+
+def run_child(scenario, mode, days):
+    """子进程：执行一次抽取并输出 JSON 结果"""
+    # 基准测试必须真实访问Oracle，关闭抽取暂存
+    from etl_stage import configure as configure_stage
+    configure_stage(enabled=False)
+
+    start = time.perf_counter()
+    rows = 0
+
+    if scenario == 'fa_storage':
+        import etl_dws_inventory
+        df = etl_dws_inventory.transform(etl_dws_inventory.extract_from_oracle(fetch_mode=mode))
+        rows = len(df)
+    else:
+        import etl_dws_sales
+        end_dt = datetime.now() - timedelta(days=1)
+        start_date = int((end_dt - timedelta(days=days - 1)).strftime('%Y%m%d'))
+        end_date = int(end_dt.strftime('%Y%m%d'))
+        for df in etl_dws_sales.extract_from_oracle(start_date, end_date, fetch_mode=mode):
+            rows += len(etl_dws_sales.transform(df))
+
+    print(json.dumps({
+        'scenario': scenario,
+        'mode': mode,
+        'rows': rows,
+        'seconds': round(time.perf_counter() - start, 2),
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Oracle抽取模式基准测试')
+    parser.add_argument('--days', type=int, default=30, help='M_RETAILITEM 抽取天数')
+    parser.add_argument('--child', nargs=2, metavar=('SCENARIO', 'MODE'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child[0], args.child[1], args.days)
+        return
+
+    results = []
+    for scenario in SCENARIOS:
+        for mode in MODES:
+            print(f"运行 {scenario} / {mode} ...")
+            out = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--days', str(args.days), '--child', scenario, mode],
+                capture_output=True, text=True, check=True
+            )
+            results.append(json.loads(out.stdout.strip().splitlines()[-1]))
+
+    print("\n" + "=" * 70)
+    print(f"{'场景':<14} {'模式':<8} {'行数':>12} {'耗时(秒)':>10} {'内存峰值(MB)':>14}")
+    print("-" * 70)
+    for r in results:
+        print(f"{r['scenario']:<14} {r['mode']:<8} {r['rows']:>12,} {r['seconds']:>10} {r['peak_rss_mb']:>14}")
+    print("=" * 70)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+何方珠宝 - MySQL加载方式基准测试
+对比 to_sql（参数化批量INSERT）与 infile（临时TSV + LOAD DATA LOCAL INFILE）写入同一批数据的耗时
+
+用法：
+    python tools/bench_load.py                 # 100万行
+    python tools/bench_load.py --rows 200000
+
+数据为按 dws_sales_daily 结构随机生成的合成数据，写入临时表 bench_load_sales（CREATE TABLE ... LIKE），
+结束后删除；每种方式写入前清空临时表，写入在单个事务内完成（与正式加载一致）。
+infile 需MySQL服务端 local_infile=ON，否则该项会显示为退回 to_sql。
+"""
+
+import argparse
+import os
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PROJECT_DIR not in sys.path:
+    sys.path.insert(0, PROJECT_DIR)
+
+from etl_conn import get_mysql_engine, close_all  # noqa: E402
+import etl_load  # noqa: E402
+
+BENCH_TABLE = 'bench_load_sales'
+METHODS = ('to_sql', 'infile')
+
+
+def make_frame(rows, seed=42):
+    """生成与 etl_dws_sales.transform 输出同结构的合成数据"""
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range('2025-01-01', periods=365).strftime('%Y%m%d').astype(int).to_numpy()
+    return pd.DataFrame({
+        'date_id': rng.choice(dates, rows),
+        'store_id': rng.integers(1, 500, rows),
+        'store_code': pd.Series(rng.integers(1, 500, rows)).map(lambda i: f"DS{i:03d}"),
+        'is_cloud_store': rng.choice(['Y', 'N'], rows),
+        'product_id': rng.integers(1, 50000, rows),
+        'm_productalias_id': pd.array(rng.integers(1, 500000, rows), dtype='Int64'),
+        'sales_qty': rng.integers(0, 20, rows).astype(float),
+        'sales_amount': rng.random(rows).round(2) * 1000,
+        'sales_amount_list': rng.random(rows).round(2) * 1200,
+        'return_qty': rng.integers(0, 3, rows).astype(float),
+        'return_amount': rng.random(rows).round(2) * 100,
+        'order_count': rng.integers(0, 10, rows),
+        'etl_time': datetime.now(),
+    })
+
+
+def bench(engine, df, method):
+    """清空临时表后按指定方式写入，返回 (耗时秒, 实际方式)"""
+    with engine.begin() as conn:
+        conn.execute(text(f"TRUNCATE TABLE {BENCH_TABLE}"))
+    fallback_before = etl_load._infile_available['value']
+    start = time.perf_counter()
+    with engine.begin() as conn:
+        etl_load.bulk_insert(conn, BENCH_TABLE, df, method=method)
+    seconds = time.perf_counter() - start
+    used = method
+    if method == 'infile' and fallback_before and not etl_load._infile_available['value']:
+        used = 'to_sql（infile不可用）'
+    return seconds, used
+
+
+def main():
+    parser = argparse.ArgumentParser(description='MySQL加载方式基准测试')
+    parser.add_argument('--rows', type=int, default=1_000_000, help='合成数据行数')
+    args = parser.parse_args()
+
+    print(f"生成 {args.rows:,} 行合成数据...")
+    df = make_frame(args.rows)
+
+    engine = get_mysql_engine()
+    with engine.begin() as conn:
+        conn.execute(text(f"DROP TABLE IF EXISTS {BENCH_TABLE}"))
+        conn.execute(text(f"CREATE TABLE {BENCH_TABLE} LIKE dws_sales_daily"))
+
+    results = []
+    try:
+        for method in METHODS:
+            print(f"运行 {method} ...")
+            seconds, used = bench(engine, df, method)
+            results.append((used, seconds))
+    finally:
+        with engine.begin() as conn:
+            conn.execute(text(f"DROP TABLE IF EXISTS {BENCH_TABLE}"))
+        close_all()
+
+    print("\n" + "=" * 60)
+    print(f"{'方式':<24} {'行数':>12} {'耗时(秒)':>10} {'行/秒':>10}")
+    print("-" * 60)
+    for used, seconds in results:
+        print(f"{used:<24} {args.rows:>12,} {seconds:>10.1f} {args.rows / seconds:>10,.0f}")
+    print("=" * 60)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+何方珠宝 - Oracle解析统计报告
+在执行一条ETL命令前后各取一次解析统计，输出差值，用于向ERP DBA说明绑定变量对共享池的影响
+
+用法：
+    python tools/parse_report.py                       # 只输出当前统计
+    python tools/parse_report.py -- python etl_dws_sales.py backfill 20260101 20260131 day 4
+
+统计项：
+- 实例级 v$sysstat：总解析次数、硬解析次数、解析耗时（含ERP其他会话的活动，仅作参考）
+- ETL语句 v$sql：按ETL抽取的源表过滤本账号解析的语句，统计游标数（不同SQL文本数）、
+  解析调用、硬解析（loads）、执行次数与共享池占用；新增游标数是拼接字面量与绑定变量差异最直观的指标
+需要 v$sysstat / v$sql 的查询权限（如 SELECT_CATALOG_ROLE）。
+"""
+
+import os
+import subprocess
+import sys
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PROJECT_DIR not in sys.path:
+    sys.path.insert(0, PROJECT_DIR)
+
+from etl_conn import connect_oracle  # noqa: E402
+
+SYSSTAT_NAMES = (
+    'parse count (total)',
+    'parse count (hard)',
+    'parse time elapsed',
+    'session cursor cache hits',
+)
+
+# ETL抽取涉及的源表（v$sql.sql_text 过滤条件）
+ETL_TABLES = ('M_RETAILITEM', 'FA_STORAGE', 'M_PRODUCT', 'C_STORE', 'M_RETAIL')
+
+
+def snapshot(conn):
+    """取一次统计：实例级解析计数 + ETL语句游标明细"""
+    cursor = conn.cursor()
+    names = ', '.join(f":n{i}" for i in range(len(SYSSTAT_NAMES)))
+    cursor.execute(
+        f"SELECT name, value FROM v$sysstat WHERE name IN ({names})",
+        {f"n{i}": n for i, n in enumerate(SYSSTAT_NAMES)}
+    )
+    sysstat = dict(cursor.fetchall())
+
+    likes = ' OR '.join(f"UPPER(sql_text) LIKE :t{i}" for i in range(len(ETL_TABLES)))
+    cursor.execute(f"""
+        SELECT sql_id, child_number, parse_calls, loads, executions, sharable_mem
+        FROM v$sql
+        WHERE parsing_schema_name = USER
+            AND ({likes})
+            AND UPPER(sql_text) NOT LIKE '%V$SQL%'
+    """, {f"t{i}": f"%{t}%" for i, t in enumerate(ETL_TABLES)})
+    cursors = {(row[0], row[1]): row[2:] for row in cursor.fetchall()}
+    cursor.close()
+    return sysstat, cursors
+
+
+def summarize(cursors):
+    """游标明细汇总：(游标数, 解析调用, 硬解析, 执行次数, 共享池KB)"""
+    parse_calls = sum(c[0] for c in cursors.values())
+    loads = sum(c[1] for c in cursors.values())
+    executions = sum(c[2] for c in cursors.values())
+    mem_kb = sum(c[3] for c in cursors.values()) / 1024
+    return len({k[0] for k in cursors}), parse_calls, loads, executions, mem_kb
+
+
+def print_report(before, after=None):
+    """输出统计（有 after 时输出差值）"""
+    print("\n" + "=" * 70)
+    if after is None:
+        sysstat, cursors = before
+        print("【实例级解析统计（当前累计值）】")
+        for name in SYSSTAT_NAMES:
+            print(f"  {name:<28} {sysstat.get(name, 0):>16,}")
+        n_sql, parse_calls, loads, executions, mem_kb = summarize(cursors)
+        label = '游标数(sql_id)'
+        print("\n【ETL语句（v$sql，当前共享池中）】")
+    else:
+        print("【实例级解析统计（执行期间增量，含其他会话）】")
+        for name in SYSSTAT_NAMES:
+            delta = after[0].get(name, 0) - before[0].get(name, 0)
+            print(f"  {name:<28} {delta:>16,}")
+        new_keys = set(after[1]) - set(before[1])
+        new_cursors = {k: after[1][k] for k in new_keys}
+        # 已存在游标的增量
+        for k in set(after[1]) & set(before[1]):
+            new_cursors[k] = tuple(a - b for a, b in zip(after[1][k], before[1][k]))
+        _, parse_calls, loads, executions, mem_kb = summarize(new_cursors)
+        n_sql = len({k[0] for k in new_keys})
+        label = '新增游标数(sql_id)'
+        print("\n【ETL语句（v$sql，执行期间增量）】")
+    print(f"  {label:<26} {n_sql:>16,}")
+    print(f"  {'解析调用 parse_calls':<26} {parse_calls:>16,}")
+    print(f"  {'硬解析 loads':<26} {loads:>16,}")
+    print(f"  {'执行次数 executions':<26} {executions:>16,}")
+    print(f"  {'共享池占用(KB)':<26} {mem_kb:>16,.0f}")
+    print("=" * 70)
+
+
+def main():
+    args = sys.argv[1:]
+    command = args[args.index('--') + 1:] if '--' in args else []
+
+    conn = connect_oracle()
+    try:
+        before = snapshot(conn)
+        if not command:
+            print_report(before)
+            return 0
+
+        print(f"执行：{' '.join(command)}")
+        code = subprocess.run(command, cwd=PROJECT_DIR).returncode
+        after = snapshot(conn)
+        print_report(before, after)
+        return code
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())